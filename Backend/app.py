@@ -16,17 +16,22 @@
 from pathlib import Path
 from datetime import datetime, timedelta
 from functools import wraps
-import os, json, hashlib, secrets, uuid
-
-from flask import Flask, jsonify, request, send_file, send_from_directory, g
+from itertools import chain
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import os, io, re, csv, gzip, multiprocessing, shutil, hmac, html, json, base64, queue, hashlib, mimetypes, secrets, uuid, threading, time, atexit, tempfile, unicodedata, zipfile
+BOOT_STARTED = time.perf_counter()
+
+from flask import Flask, Request, Response, abort, jsonify, request, send_file, g, has_app_context, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 
-from docx import Document
-from docx.shared import Pt, Cm, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_PARAGRAPH_ALIGNMENT
-from docx.enum.table import WD_TABLE_ALIGNMENT
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.pdfgen import canvas
+# Generadores de documentos y extracción de informes (sin Flask ni BD)
+import documents
+from documents import clean, load_render_libs, personal_number, personal_totals, sweep_temp_dir
 
 # ─── Base dirs ────────────────────────────────────────────────────────────────
 BASE_DIR  = Path(__file__).parent
@@ -34,6 +39,11 @@ FRONT_DIR = BASE_DIR.parent / "frontend"
 TEMP_DIR  = BASE_DIR / "temp"
 TEMP_DIR.mkdir(exist_ok=True)
 
+# Con spawn/forkserver, multiprocessing reimporta este script como __mp_main__
+# en los procesos del pool cuando se arranca con `python app.py`: ahí se omite
+# el arranque (migraciones, estáticos, purga de temporales, precarga).
+MP_CHILD = __name__ == "__mp_main__"
+
 # ─── Flask ────────────────────────────────────────────────────────────────────
 app = Flask(
     __name__,
@@ -43,12 +53,130 @@ app = Flask(
 )
 CORS(app, supports_credentials=True)
 
+# ══════════════════════════════════════════════════════════════════════════════
+#  MÉTRICAS  —  latencia por endpoint, consultas por petición y renders
+#
+#  Histogramas y contadores en memoria, por proceso (cada worker de gunicorn
+#  expone los suyos; el pid va en process_info). GET /api/admin/metrics los
+#  publica en formato de texto de Prometheus. Con SLOW_QUERY_MS > 0 las
+#  consultas más lentas que el umbral se imprimen con SQL, parámetros y
+#  duración, y las últimas SLOW_QUERY_KEEP quedan en /api/admin/slow-queries.
+# ══════════════════════════════════════════════════════════════════════════════
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+SLOW_QUERY_MS   = float(os.environ.get("SLOW_QUERY_MS", 0))
+SLOW_QUERY_KEEP = int(os.environ.get("SLOW_QUERY_KEEP", 100))
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+COUNT_BUCKETS   = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+class Metrics:
+    def __init__(self):
+        self._lock     = threading.Lock()
+        self._hist     = {}   # nombre → (buckets, {etiquetas: [cuentas…, suma, total]})
+        self._counters = {}   # nombre → {etiquetas: valor}
+        self._help     = {}
+
+    def describe(self, name, text): self._help[name] = text
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._hist.setdefault(name, (buckets, {}))[1]
+            row = series.get(key)
+            if row is None: row = series[key] = [0] * (len(buckets) + 2)
+            for i, b in enumerate(buckets):
+                if value <= b: row[i] += 1; break
+            row[-2] += value; row[-1] += 1
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    @staticmethod
+    def _labels(key, extra=()):
+        esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs = [f'{k}="{esc(v)}"' for k, v in (*key, *extra)]
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self):
+        out = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                out += [f"# HELP {name} {self._help.get(name, name)}", f"# TYPE {name} counter"]
+                out += [f"{name}{self._labels(k)} {v}" for k, v in sorted(series.items())]
+            for name, (buckets, series) in sorted(self._hist.items()):
+                out += [f"# HELP {name} {self._help.get(name, name)}", f"# TYPE {name} histogram"]
+                for k, row in sorted(series.items()):
+                    acc = 0
+                    for b, n in zip(buckets, row):
+                        acc += n; out.append(f"{name}_bucket{self._labels(k, [('le', b)])} {acc}")
+                    out.append(f"{name}_bucket{self._labels(k, [('le', '+Inf')])} {row[-1]}")
+                    out.append(f"{name}_sum{self._labels(k)} {round(row[-2], 6)}")
+                    out.append(f"{name}_count{self._labels(k)} {row[-1]}")
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+metrics.describe("http_requests_total", "Peticiones atendidas por endpoint y estado")
+metrics.describe("http_request_duration_seconds", "Latencia de las peticiones por endpoint")
+metrics.describe("http_request_db_queries", "Consultas a la BD por petición")
+metrics.describe("http_request_db_seconds", "Tiempo en la BD por petición")
+metrics.describe("db_query_duration_seconds", "Duración de cada consulta por tipo de sentencia")
+metrics.describe("render_duration_seconds", "Renderizado de documentos en el proceso web")
+metrics.describe("render_job_duration_seconds", "Trabajos de renderizado asíncronos, de la cola al resultado")
+metrics.describe("slow_queries_total", "Consultas por encima de SLOW_QUERY_MS")
+
+slow_queries = deque(maxlen=SLOW_QUERY_KEEP)
+
+def record_query(sql, params, seconds):
+    """Lo llama db_execute tras cada consulta (ambos backends)."""
+    if not METRICS_ENABLED: return
+    if has_app_context():
+        q = g.get("_dbq")
+        if q is None: q = g._dbq = [0, 0.0]
+        q[0] += 1; q[1] += seconds
+    verb = (sql.split(None, 1) or ["?"])[0].upper()
+    metrics.observe("db_query_duration_seconds", seconds, statement=verb)
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        entry = {"at": datetime.now().isoformat(), "ms": round(seconds * 1000, 2),
+                 "sql": " ".join(sql.split()), "params": [str(p)[:200] for p in (params or ())][:50]}
+        slow_queries.append(entry); metrics.inc("slow_queries_total", statement=verb)
+        print(f"🐢 {entry['ms']} ms · {entry['sql']} · {entry['params']}")
+
+@app.before_request
+def _start_timer():
+    g._t0 = time.perf_counter()
+
+@app.after_request
+def _record_request(resp):
+    t0 = g.pop("_t0", None)
+    if t0 is None or not METRICS_ENABLED: return resp
+    elapsed  = time.perf_counter() - t0
+    endpoint = request.url_rule.rule if request.url_rule else "<sin ruta>"
+    queries, db_time = g.get("_dbq") or (0, 0.0)
+    metrics.inc("http_requests_total", method=request.method, endpoint=endpoint, status=resp.status_code)
+    metrics.observe("http_request_duration_seconds", elapsed, method=request.method, endpoint=endpoint)
+    metrics.observe("http_request_db_queries", queries, COUNT_BUCKETS, endpoint=endpoint)
+    metrics.observe("http_request_db_seconds", db_time, endpoint=endpoint)
+    resp.headers["Server-Timing"] = f'db;dur={db_time*1000:.1f};desc="{queries} consultas", app;dur={elapsed*1000:.1f}'
+    return resp
+
 # ══════════════════════════════════════════════════════════════════════════════
 #  BASE DE DATOS  —  PostgreSQL en Render / SQLite local
 # ══════════════════════════════════════════════════════════════════════════════
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "")
 
+# Pool por proceso: cada worker de gunicorn crea el suyo tras el fork, así que
+# DB_POOL_SIZE debe ser >= hilos por worker (--threads) y el total de conexiones
+# será workers × DB_POOL_SIZE.
+DB_POOL_SIZE    = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))   # espera máx. por conexión libre (s)
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))   # edad máx. de una conexión (s)
+DB_POOL_PING    = int(os.environ.get("DB_POOL_PING", 30))        # inactividad que obliga a verificarla (s)
+
 if DATABASE_URL:
     # ── PostgreSQL (Render) ──────────────────────────────────────────────────
     import psycopg2
@@ -58,51 +186,324 @@ if DATABASE_URL:
     if DATABASE_URL.startswith("postgres://"):
         DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
+    class PooledConn:
+        __slots__ = ("conn", "created", "used", "broken")
+        def __init__(self, conn):
+            self.conn = conn; self.created = self.used = time.monotonic(); self.broken = False
+
+    class PgPool:
+        """Pool acotado y thread-safe de conexiones psycopg2.
+
+        Las conexiones se reciclan al superar DB_POOL_RECYCLE segundos y se
+        verifican con SELECT 1 si llevan más de DB_POOL_PING segundos inactivas.
+        """
+        def __init__(self, dsn, size, timeout, recycle, ping):
+            self.dsn, self.size, self.timeout = dsn, size, timeout
+            self.recycle, self.ping = recycle, ping
+            self._reset()
+
+        def _reset(self):
+            # Tras un fork las conexiones heredadas pertenecen al padre: se olvidan
+            self._pid  = os.getpid()
+            self._lock = threading.Lock()
+            self._sem  = threading.BoundedSemaphore(self.size)
+            self._idle = []
+
+        def _connect(self):
+            conn = psycopg2.connect(self.dsn)
+            conn.autocommit = True
+            return PooledConn(conn)
+
+        def _alive(self, item):
+            try:
+                cur = item.conn.cursor(); cur.execute("SELECT 1"); cur.close()
+                return True
+            except psycopg2.Error:
+                return False
+
+        def _discard(self, item):
+            try: item.conn.close()
+            except psycopg2.Error: pass
+
+        def acquire(self):
+            if self._pid != os.getpid(): self._reset()
+            if not self._sem.acquire(timeout=self.timeout):
+                raise RuntimeError("Pool de conexiones agotado")
+            try:
+                while True:
+                    with self._lock:
+                        item = self._idle.pop() if self._idle else None
+                    if item is None: return self._connect()
+                    now = time.monotonic()
+                    if item.conn.closed or now - item.created > self.recycle:
+                        self._discard(item); continue
+                    if now - item.used > self.ping and not self._alive(item):
+                        self._discard(item); continue
+                    return item
+            except Exception:
+                self._sem.release(); raise
+
+        def release(self, item):
+            if self._pid != os.getpid(): return
+            try:
+                if item.broken or item.conn.closed:
+                    self._discard(item)
+                else:
+                    item.used = time.monotonic()
+                    with self._lock: self._idle.append(item)
+            finally:
+                self._sem.release()
+
+        def closeall(self):
+            with self._lock:
+                idle, self._idle = self._idle, []
+            for item in idle: self._discard(item)
+
+    pool = PgPool(DATABASE_URL, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PING)
+    atexit.register(pool.closeall)
+
     def get_db():
-        conn = psycopg2.connect(DATABASE_URL)
-        conn.autocommit = True
-        return conn
+        """Conexión de la petición actual (compartida vía g) o None fuera de una petición."""
+        if not has_app_context(): return None
+        if "_db" not in g: g._db = pool.acquire()
+        return g._db
+
+    def close_db(exc=None):
+        item = g.pop("_db", None)
+        if item is not None: pool.release(item)
+
+    _pg_local = threading.local()   # conexión con una transacción abierta en este hilo
+
+    @contextmanager
+    def db_transaction():
+        """Las sentencias del bloque se confirman juntas o ninguna (ROLLBACK si hay excepción)."""
+        if getattr(_pg_local, "tx", None) is not None: yield; return   # anidada: se une a la exterior
+        item  = get_db()
+        owned = item is None
+        if owned: item = pool.acquire()
+        _pg_local.tx = item
+        cur = item.conn.cursor()
+        try:
+            cur.execute("BEGIN"); yield; cur.execute("COMMIT")
+        except BaseException:
+            try: cur.execute("ROLLBACK")
+            except psycopg2.Error: item.broken = True
+            raise
+        finally:
+            cur.close(); _pg_local.tx = None
+            if owned: pool.release(item)
 
     def db_execute(sql, params=(), fetch="none"):
-        conn = get_db()
-        cur  = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute(sql, params)
-        if fetch == "one":  result = cur.fetchone()
-        elif fetch == "all": result = cur.fetchall()
-        else: result = None
-        cur.close(); conn.close()
-        return result
-
+        item  = getattr(_pg_local, "tx", None) or get_db()
+        owned = item is None
+        if owned: item = pool.acquire()
+        t0 = time.perf_counter()
+        try:
+            cur = item.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute(sql, params)
+            if fetch == "one":  result = cur.fetchone()
+            elif fetch == "all": result = cur.fetchall()
+            else: result = None
+            cur.close()
+            return result
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            item.broken = True
+            raise
+        finally:
+            record_query(sql, params, time.perf_counter() - t0)
+            if owned: pool.release(item)
+
+    DBError     = psycopg2.Error
     PLACEHOLDER = "%s"
-    print("✅ Usando PostgreSQL (Render)")
+    FOR_UPDATE  = " FOR UPDATE"   # bloquea la fila leída hasta el fin de db_transaction
+    print(f"✅ Usando PostgreSQL (Render) — pool de {DB_POOL_SIZE} conexiones por worker")
 
 else:
     # ── SQLite (local) ───────────────────────────────────────────────────────
     import sqlite3
 
-    DB_PATH = BASE_DIR / "data" / "facturador.db"
+    DB_PATH = Path(os.environ.get("SQLITE_PATH", BASE_DIR / "data" / "facturador.db"))
     DB_PATH.parent.mkdir(exist_ok=True)
 
-    def get_db():
-        conn = sqlite3.connect(str(DB_PATH))
+    # SQLITE_MODE=tuned (por defecto): WAL, synchronous=NORMAL, mmap, caché y
+    # busy_timeout. Las lecturas (SELECT/WITH) usan una conexión de solo lectura
+    # por hilo y nunca esperan a un escritor; el resto de sentencias pasa por un
+    # único hilo escritor que agrupa lo que haya en cola en una transacción
+    # (un SAVEPOINT por sentencia, así un fallo no arrastra a las demás) y
+    # responde a cada llamante después del COMMIT. Un fallo de cualquier tipo se
+    # devuelve a su llamante; si el hilo muere se relanza en la siguiente
+    # escritura, y quien espera más de SQLITE_WRITE_TIMEOUT segundos a que su
+    # sentencia empiece la cancela y recibe un error.
+    # db_transaction() toma prestada esa conexión (el escritor espera) para que
+    # varias sentencias, lecturas incluidas, formen una sola transacción.
+    # SQLITE_MODE=simple: una conexión por hilo con la configuración por defecto.
+    SQLITE_MODE          = os.environ.get("SQLITE_MODE", "tuned")
+    SQLITE_SYNCHRONOUS   = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_MMAP_MB       = int(os.environ.get("SQLITE_MMAP_MB", 256))
+    SQLITE_CACHE_MB      = int(os.environ.get("SQLITE_CACHE_MB", 64))
+    SQLITE_BUSY_MS       = int(os.environ.get("SQLITE_BUSY_MS", 5000))
+    SQLITE_WRITE_BATCH   = int(os.environ.get("SQLITE_WRITE_BATCH", 64))
+    SQLITE_WRITE_TIMEOUT = float(os.environ.get("SQLITE_WRITE_TIMEOUT", 30))
+
+    _sqlite_local = threading.local()
+
+    def _sqlite_connect(readonly=False):
+        if readonly: conn = sqlite3.connect(DB_PATH.resolve().as_uri() + "?mode=ro", uri=True, isolation_level=None)
+        else:        conn = sqlite3.connect(str(DB_PATH), isolation_level=None, check_same_thread=False)
         conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_MS}")
+        conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB*1024*1024}")
+        conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB*1024}")
+        if readonly: conn.execute("PRAGMA query_only=1")
+        else:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        return conn
+
+    class SqliteWriter:
+        """Hilo dueño de la única conexión de escritura del proceso."""
+        def __init__(self):
+            self._pid = None; self._thread = None; self._lock = threading.Lock()
+
+        def start(self):
+            with self._lock:
+                if self._pid == os.getpid() and self._thread.is_alive(): return
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._conn  = _sqlite_connect()
+                elif self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")   # el hilo anterior murió a mitad de lote
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+        def _submit(self, op):
+            if self._pid != os.getpid() or not self._thread.is_alive(): self.start()
+            fut = op[3]; self._queue.put(op)
+            try: return fut.result(timeout=SQLITE_WRITE_TIMEOUT)
+            except FutureTimeout:
+                # Si aún no empezó se cancela (no se ejecutará); si ya está en curso, acaba enseguida
+                if fut.cancel(): raise sqlite3.OperationalError(
+                    f"el escritor de SQLite no respondió en {SQLITE_WRITE_TIMEOUT} s") from None
+                return fut.result()
+
+        def execute(self, sql, params, fetch):
+            return self._submit((sql, params, fetch, Future()))
+
+        def lend(self):
+            """(conexión, evento): el hilo escritor queda parado hasta que se active el evento."""
+            back = threading.Event()
+            return self._submit((None, back, None, Future())), back
+
+        def _run(self):
+            held = None
+            while True:
+                ops = [held or self._queue.get()]; held = None
+                if ops[0][0] is None:   # préstamo para db_transaction
+                    _, back, _, fut = ops[0]
+                    if fut.set_running_or_notify_cancel(): fut.set_result(self._conn); back.wait()
+                    continue
+                while len(ops) < SQLITE_WRITE_BATCH:
+                    try: op = self._queue.get_nowait()
+                    except queue.Empty: break
+                    if op[0] is None: held = op; break
+                    ops.append(op)
+                ops = [op for op in ops if op[3].set_running_or_notify_cancel()]
+                try: self._batch(ops)
+                except Exception as e:   # nunca dejar a un llamante esperando
+                    for *_, fut in ops:
+                        if not fut.done(): fut.set_exception(e)
+
+        def _batch(self, ops):
+            conn, done = self._conn, []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for sql, params, fetch, fut in ops:
+                    conn.execute("SAVEPOINT op")
+                    try:
+                        cur = conn.execute(sql, params)
+                        res = cur.fetchone() if fetch == "one" else cur.fetchall() if fetch == "all" else None
+                        conn.execute("RELEASE op"); done.append((fut, res, None))
+                    except Exception as e:   # también OverflowError, ValueError… al enlazar parámetros
+                        conn.execute("ROLLBACK TO op"); conn.execute("RELEASE op"); done.append((fut, None, e))
+                conn.execute("COMMIT")
+            except Exception as e:
+                if conn.in_transaction: conn.execute("ROLLBACK")
+                done = [(fut, None, e) for *_, fut in ops]
+            for fut, res, err in done:
+                fut.set_exception(err) if err else fut.set_result(res)
+
+    sqlite_writer = SqliteWriter()
+
+    def get_db(readonly=False):
+        """Conexión de este hilo (en modo tuned, solo lectura)."""
+        conn = getattr(_sqlite_local, "conn", None)
+        if conn is None or _sqlite_local.pid != os.getpid():
+            if SQLITE_MODE == "tuned":
+                sqlite_writer.start()   # crea el fichero y el WAL antes de abrir en solo lectura
+                conn = _sqlite_connect(readonly=True)
+            else:
+                conn = sqlite3.connect(str(DB_PATH)); conn.row_factory = sqlite3.Row
+            _sqlite_local.conn, _sqlite_local.pid = conn, os.getpid()
         return conn
 
+    def close_db(exc=None):
+        pass  # la conexión vive con el hilo
+
+    @contextmanager
+    def db_transaction():
+        """Las sentencias del bloque se confirman juntas o ninguna (ROLLBACK si hay excepción)."""
+        if getattr(_sqlite_local, "tx", None) is not None: yield; return   # anidada: se une a la exterior
+        conn, back = sqlite_writer.lend() if SQLITE_MODE == "tuned" else (get_db(), None)
+        _sqlite_local.tx = conn
+        try:
+            conn.execute("BEGIN IMMEDIATE"); yield; conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction: conn.execute("ROLLBACK")
+            raise
+        finally:
+            _sqlite_local.tx = None
+            if back: back.set()
+
+    def is_read(sql):
+        head = sql.lstrip()[:6].upper()
+        return head.startswith("SELECT") or head.startswith("WITH")
+
     def db_execute(sql, params=(), fetch="none"):
         # Convierte %s → ? para SQLite
-        sql  = sql.replace("%s", "?")
-        conn = get_db()
+        sql = sql.replace("%s", "?")
+        t0  = time.perf_counter()
+        tx  = getattr(_sqlite_local, "tx", None)   # dentro de db_transaction: la confirma el bloque
+        if tx is None and SQLITE_MODE == "tuned" and not is_read(sql):
+            try: return sqlite_writer.execute(sql, params, fetch)
+            finally: record_query(sql, params, time.perf_counter() - t0)
+        conn = tx or get_db()
         cur  = conn.cursor()
-        cur.execute(sql, params)
-        if fetch == "one":  result = cur.fetchone()
-        elif fetch == "all": result = cur.fetchall()
-        else: result = None
-        conn.commit(); conn.close()
-        return result
-
+        try:
+            cur.execute(sql, params)
+            if fetch == "one":  result = cur.fetchone()
+            elif fetch == "all": result = cur.fetchall()
+            else: result = None
+            if conn.in_transaction and tx is None: conn.commit()
+            return result
+        except sqlite3.ProgrammingError:
+            # Conexión cerrada/inválida: se descarta y se recrea en la próxima llamada
+            if tx is None: _sqlite_local.conn = None
+            raise
+        except sqlite3.Error:
+            # No dejar una transacción abierta (y el fichero bloqueado) en la conexión persistente
+            if conn.in_transaction and tx is None: conn.rollback()
+            raise
+        finally:
+            cur.close()
+            record_query(sql, params, time.perf_counter() - t0)
+
+    DBError     = sqlite3.Error
     PLACEHOLDER = "?"
-    print("✅ Usando SQLite (local)")
+    FOR_UPDATE  = ""   # db_transaction abre con BEGIN IMMEDIATE: ya es exclusiva
+    print(f"✅ Usando SQLite (local, modo {SQLITE_MODE})")
 
+app.teardown_appcontext(close_db)
 
 def row_to_dict(row):
     if row is None: return None
@@ -113,11 +514,100 @@ def rows_to_list(rows):
     if not rows: return []
     return [dict(r) for r in rows]
 
+# ─── Paginación por cursor (keyset) ───────────────────────────────────────────
+#  El cursor es opaco para el cliente: base64 de los valores de ordenación de
+#  la última fila devuelta. Cada página cuesta lo mismo sin importar cuántas
+#  filas tenga el usuario. El total se cachea COUNT_CACHE_TTL segundos.
+
+PAGE_SIZE       = int(os.environ.get("PAGE_SIZE", 50))
+PAGE_SIZE_MAX   = int(os.environ.get("PAGE_SIZE_MAX", 200))
+COUNT_CACHE_TTL = int(os.environ.get("COUNT_CACHE_TTL", 30))
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+CURSOR_KEYS = (str, str)   # (created_at, id): el orden de la mayoría de listados
+
+def decode_cursor(cursor, types=CURSOR_KEYS):
+    """Lista con un valor por tipo de types; ValueError si no encaja."""
+    if not cursor: return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if (isinstance(values, list) and len(values) == len(types)
+                and all(isinstance(v, t) and not isinstance(v, bool) for v, t in zip(values, types))):
+            return values
+    except (ValueError, TypeError): pass
+    raise ValueError("Cursor inválido")
+
+def page_args(types=CURSOR_KEYS):
+    """(limit, cursor) de la query string; ValueError si son inválidos."""
+    limit = max(1, min(int(request.args.get("limit", PAGE_SIZE)), PAGE_SIZE_MAX))
+    return limit, decode_cursor(request.args.get("cursor", ""), types)
+
+def page_result(rows, limit, key):
+    """Recorta la fila extra pedida (limit+1) y calcula el cursor siguiente."""
+    more = len(rows) > limit; rows = rows[:limit]
+    return rows, (encode_cursor(key(rows[-1])) if more and rows else None)
+
+_count_cache = {}   # (tabla, owner, filtro) → (total, instante)
+_count_lock  = threading.Lock()
+
+def cached_count(table, owner, where="", params=()):
+    key = (table, owner, where, tuple(params))
+    with _count_lock:
+        hit = _count_cache.get(key)
+    if hit and time.monotonic() - hit[1] < COUNT_CACHE_TTL: return hit[0]
+    row = row_to_dict(db_execute(f"SELECT COUNT(*) AS n FROM {table} WHERE owner=%s{where}",
+                                 (owner, *params), fetch="one"))
+    with _count_lock:
+        if len(_count_cache) > 10_000: _count_cache.clear()
+        _count_cache[key] = (row["n"], time.monotonic())
+    return row["n"]
+
+def invalidate_counts(table, owner):
+    with _count_lock:
+        for k in [k for k in _count_cache if k[0] == table and k[1] == owner]:
+            del _count_cache[k]
+
+# ─── Operaciones en lote ──────────────────────────────────────────────────────
+#  Cuerpo: {"ops": [{"op": "create"|"update"|"delete"|…, …}], "atomic": false}.
+#  Las operaciones válidas se aplican en una sola transacción y la respuesta
+#  trae un resultado por operación, en orden: {"index","status", "error"?, …}.
+#  Con atomic=true basta una operación inválida para no aplicar ninguna (422).
+
+BATCH_MAX_OPS = int(os.environ.get("BATCH_MAX_OPS", 1000))
+
+def batch_ops(allowed, id_type):
+    """(ops, atomic) del cuerpo de la petición; ValueError si el lote está mal formado.
+    Toda operación salvo create necesita un id de tipo id_type."""
+    data = request.get_json(force=True, silent=True) or {}
+    ops  = data.get("ops")
+    if not isinstance(ops, list) or not ops: raise ValueError("ops debe ser una lista no vacía")
+    if len(ops) > BATCH_MAX_OPS: raise ValueError(f"Máximo {BATCH_MAX_OPS} operaciones por lote")
+    if any(not isinstance(op, dict) or op.get("op") not in allowed for op in ops):
+        raise ValueError(f"Cada operación necesita op: {'|'.join(allowed)}")
+    for i, op in enumerate(ops):
+        if op["op"] != "create" and (not isinstance(op.get("id"), id_type) or isinstance(op["id"], bool)):
+            raise ValueError(f"Operación {i}: id inválido")
+    return ops, bool(data.get("atomic"))
+
+def batch_result(results, atomic, **extra):
+    failed = sum(1 for r in results if r["status"] >= 400)
+    if atomic and failed: return jsonify(results=results, applied=0, failed=failed), 422
+    return jsonify(results=results, applied=len(results) - failed, failed=failed, **extra)
+
 # ══════════════════════════════════════════════════════════════════════════════
-#  INICIALIZAR TABLAS
+#  MIGRACIONES DE ESQUEMA
+#
+#  Cada migración tiene un número de versión creciente y una lista de pasos:
+#  SQL común, un dict {"pg": [...], "sqlite": [...]} o funciones Python.
+#  schema_migrations guarda las versiones aplicadas; al arrancar solo se
+#  consulta MAX(version) y, si el esquema está al día, no se ejecuta DDL.
+#  Los pasos deben ser idempotentes (IF NOT EXISTS) por si una migración se
+#  interrumpe a medias y se reintenta.
 # ══════════════════════════════════════════════════════════════════════════════
 
-def init_db():
+def _m001_initial_schema():
     if DATABASE_URL:
         # PostgreSQL — SERIAL para autoincrement
         db_execute("""
@@ -184,6 +674,12 @@ def init_db():
                 created_at TEXT
             )
         """)
+        db_execute("""
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                name    TEXT PRIMARY KEY,
+                version BIGINT DEFAULT 0
+            )
+        """)
     else:
         # SQLite
         db_execute("""
@@ -230,6 +726,16 @@ def init_db():
                 status TEXT DEFAULT 'exitoso', created_at TEXT
             )
         """)
+        db_execute("""
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                name TEXT PRIMARY KEY, version INTEGER DEFAULT 0
+            )
+        """)
+
+def _m001_seed_defaults():
+    # Contador de invalidación de la caché de sesiones entre workers
+    if not db_execute("SELECT name FROM cache_versions WHERE name=%s", ("auth",), fetch="one"):
+        db_execute("INSERT INTO cache_versions (name,version) VALUES (%s,%s)", ("auth", 0))
 
     # Admin por defecto
     admin = row_to_dict(db_execute(
@@ -244,47 +750,489 @@ def init_db():
         )
         print("✅ Usuario admin creado (admin/admin123)")
 
+MIGRATIONS = [
+    (1, "esquema inicial", [_m001_initial_schema, _m001_seed_defaults]),
+    (2, "índices para consultas frecuentes", [
+        "CREATE INDEX IF NOT EXISTS idx_medical_history_owner_created ON medical_history (owner, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_personal_invoices_owner_created ON personal_invoices (owner, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_owner_status_due ON tasks (owner, status, due_date, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_owner_due ON tasks (owner, due_date, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_login_logs_created ON login_logs (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_login_logs_user_created ON login_logs (user_id, created_at)",
+    ]),
+    (3, "borradores de pacientes persistentes", [
+        """
+        CREATE TABLE IF NOT EXISTS medical_drafts (
+            owner TEXT    NOT NULL,
+            id    INTEGER NOT NULL,
+            name  TEXT    NOT NULL,
+            price BIGINT  DEFAULT 0,
+            PRIMARY KEY (owner, id)
+        )
+        """,
+    ]),
+    (4, "trabajos de renderizado asíncronos", [
+        """
+        CREATE TABLE IF NOT EXISTS render_jobs (
+            id          TEXT PRIMARY KEY,
+            owner       TEXT NOT NULL,
+            kind        TEXT NOT NULL,
+            ref         TEXT DEFAULT '',
+            fmt         TEXT NOT NULL,
+            status      TEXT DEFAULT 'pendiente',
+            error       TEXT DEFAULT '',
+            filename    TEXT DEFAULT '',
+            created_at  TEXT,
+            finished_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_render_jobs_owner_status ON render_jobs (owner, status, created_at)",
+    ]),
+    (5, "columnas normalizadas y líneas de facturas personales", [
+        lambda: add_columns("personal_invoices", PERSONAL_COLUMN_TYPES),
+        """
+        CREATE TABLE IF NOT EXISTS personal_invoice_items (
+            invoice_id  TEXT    NOT NULL,
+            position    INTEGER NOT NULL,
+            description TEXT    DEFAULT '',
+            qty         DOUBLE PRECISION DEFAULT 1,
+            unit_value  DOUBLE PRECISION DEFAULT 0,
+            total       DOUBLE PRECISION DEFAULT 0,
+            PRIMARY KEY (invoice_id, position)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_personal_invoices_owner_status_due ON personal_invoices (owner, status, due_date)",
+        "CREATE INDEX IF NOT EXISTS idx_personal_invoices_owner_client ON personal_invoices (owner, client_name)",
+        lambda: backfill_personal_columns(),
+    ]),
+    (6, "acumulados de facturación para el dashboard", [
+        """
+        CREATE TABLE IF NOT EXISTS revenue_rollup (
+            owner         TEXT NOT NULL,
+            source        TEXT NOT NULL,
+            period        TEXT NOT NULL,
+            status        TEXT NOT NULL,
+            invoice_count BIGINT DEFAULT 0,
+            patient_count BIGINT DEFAULT 0,
+            total         DOUBLE PRECISION DEFAULT 0,
+            PRIMARY KEY (owner, source, period, status)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS personal_due_rollup (
+            owner         TEXT NOT NULL,
+            due_date      TEXT NOT NULL,
+            status        TEXT NOT NULL,
+            invoice_count BIGINT DEFAULT 0,
+            total         DOUBLE PRECISION DEFAULT 0,
+            PRIMARY KEY (owner, due_date, status)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_revenue_rollup_period ON revenue_rollup (period)",
+        lambda: backfill_rollups(),
+    ]),
+    (7, "índices de cobertura para la analítica de accesos", [
+        "CREATE INDEX IF NOT EXISTS idx_login_logs_created_stats ON login_logs (created_at, status, device, ip)",
+        "CREATE INDEX IF NOT EXISTS idx_login_logs_user_stats ON login_logs (user_id, created_at, status, device, ip)",
+        "DROP INDEX IF EXISTS idx_login_logs_created",
+        "DROP INDEX IF EXISTS idx_login_logs_user_created",
+    ]),
+    (8, "fecha del estudio en los borradores", [
+        lambda: add_columns("medical_drafts", {"study_date": "TEXT DEFAULT ''"}),
+    ]),
+    (9, "índice de búsqueda de texto completo", {
+        "pg": [
+            """
+            CREATE TABLE IF NOT EXISTS search_index (
+                kind       TEXT NOT NULL,
+                ref        TEXT NOT NULL,
+                owner      TEXT NOT NULL,
+                created_at TEXT DEFAULT '',
+                title      TEXT DEFAULT '',
+                subtitle   TEXT DEFAULT '',
+                head_terms TEXT DEFAULT '',
+                body_terms TEXT DEFAULT '',
+                tsv        TSVECTOR GENERATED ALWAYS AS (
+                    setweight(to_tsvector('simple', head_terms), 'A') ||
+                    setweight(to_tsvector('simple', body_terms), 'B')) STORED,
+                PRIMARY KEY (kind, ref)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_search_index_tsv ON search_index USING GIN (tsv)",
+            "CREATE INDEX IF NOT EXISTS idx_search_index_owner ON search_index (owner, kind)",
+            lambda: backfill_search(),
+        ],
+        "sqlite": [
+            # owner_tok es un token por usuario: el filtro por dueño va dentro del MATCH
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5 (
+                kind UNINDEXED, ref UNINDEXED, owner UNINDEXED, created_at UNINDEXED,
+                title UNINDEXED, subtitle UNINDEXED, owner_tok, head, body,
+                tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+            )
+            """,
+            lambda: backfill_search(),
+        ],
+    }),
+    (10, "sesiones firmadas: revocaciones y clave", [
+        """
+        CREATE TABLE IF NOT EXISTS session_revocations (
+            subject    TEXT   PRIMARY KEY,
+            not_before BIGINT DEFAULT 0,
+            expires    BIGINT NOT NULL
+        )
+        """,
+        "CREATE TABLE IF NOT EXISTS app_secrets (name TEXT PRIMARY KEY, value TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires)",
+        lambda: db_execute("INSERT INTO app_secrets (name,value) VALUES (%s,%s) ON CONFLICT (name) DO NOTHING",
+                           ("session", secrets.token_hex(32))),
+    ]),
+    (11, "vales para el stream de recordatorios", [
+        """
+        CREATE TABLE IF NOT EXISTS stream_tickets (
+            ticket  TEXT PRIMARY KEY,
+            token   TEXT NOT NULL,
+            expires TEXT NOT NULL
+        )
+        """,
+    ]),
+    (12, "vencimiento de facturas personales en AAAA-MM-DD", [
+        lambda: backfill_personal_columns(),
+    ]),
+    (13, "acumulado de vencimientos en AAAA-MM-DD", [
+        lambda: backfill_rollups(),
+    ]),
+]
+
+def table_columns(table):
+    if DATABASE_URL:
+        rows = db_execute("SELECT column_name AS name FROM information_schema.columns WHERE table_name=%s",
+                          (table,), fetch="all")
+    else:
+        rows = db_execute(f"PRAGMA table_info({table})", fetch="all")
+    return {r["name"] for r in rows_to_list(rows)}
+
+def add_columns(table, columns):
+    """ALTER TABLE ... ADD COLUMN solo para las columnas que aún no existen."""
+    have = table_columns(table)
+    for name, typ in columns.items():
+        if name not in have: db_execute(f"ALTER TABLE {table} ADD COLUMN {name} {typ}")
+
+MIGRATION_LOCK_ID = 48151623  # pg_advisory_lock: un solo worker migra a la vez
+
+def schema_version():
+    try:
+        row = row_to_dict(db_execute("SELECT MAX(version) AS v FROM schema_migrations", fetch="one"))
+        return (row or {}).get("v") or 0
+    except DBError:
+        return None  # la tabla aún no existe
+
+def migrate():
+    """Aplica las migraciones pendientes y devuelve la versión final del esquema."""
+    latest = MIGRATIONS[-1][0]
+    with app.app_context():  # misma conexión para el lock y todos los pasos
+        current = schema_version()
+        if current == latest: return current
+        if DATABASE_URL: db_execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            db_execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version    INTEGER PRIMARY KEY,
+                    name       TEXT,
+                    applied_at TEXT
+                )
+            """)
+            current = schema_version() or 0  # otro worker pudo migrar mientras esperábamos
+            for version, name, steps in MIGRATIONS:
+                if version <= current: continue
+                if isinstance(steps, dict): steps = steps["pg" if DATABASE_URL else "sqlite"]
+                for step in steps:
+                    step() if callable(step) else db_execute(step)
+                db_execute("INSERT INTO schema_migrations (version,name,applied_at) VALUES (%s,%s,%s)",
+                           (version, name, datetime.now().isoformat()))
+                print(f"✅ Migración {version:03d} aplicada: {name}")
+                current = version
+            return current
+        finally:
+            if DATABASE_URL: db_execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+
+def init_db():
+    migrate()
+
 # ══════════════════════════════════════════════════════════════════════════════
 #  AUTH HELPERS
 # ══════════════════════════════════════════════════════════════════════════════
 
 def hash_password(pwd): return hashlib.sha256(pwd.encode()).hexdigest()
 
-init_db()
-
-def create_session(user_id):
+# ─── Modo de sesión ───────────────────────────────────────────────────────────
+#  SESSION_MODE=db (por defecto): token aleatorio guardado en sessions.
+#  SESSION_MODE=signed: el token lleva id, rol, módulos y expiración firmados con
+#  HMAC-SHA256 y se verifica sin tocar la BD. La clave es SESSION_SECRET o, si
+#  falta, la generada en app_secrets (la misma para todos los workers).
+#  Logout, bloqueo, edición y borrado de usuarios escriben en
+#  session_revocations: "jti:<id>" anula un token y "user:<uid>" todos los
+#  emitidos antes de not_before (p. ej. al cambiarle los módulos; vuelve a
+#  iniciar sesión con los nuevos). Cada worker tiene la lista en memoria y la
+#  recarga cuando cambia la versión 'auth' de cache_versions, consultada cada
+#  REVOCATION_SYNC_SECS; cada entrada caduca con el último token al que afecta.
+#  Los tokens de BD emitidos antes del cambio de modo valen hasta su expiración.
+#  En ambos modos un hilo de fondo purga cada SESSION_SWEEP_SECS las sesiones
+#  caducadas de sessions, las revocaciones y los vales de stream vencidos
+#  (0 = sin purga).
+
+SESSION_MODE         = os.environ.get("SESSION_MODE", "db")
+SESSION_SECRET       = os.environ.get("SESSION_SECRET", "")
+SESSION_HOURS        = float(os.environ.get("SESSION_HOURS", 8))
+REVOCATION_SYNC_SECS = float(os.environ.get("REVOCATION_SYNC_SECS", 5))
+SESSION_SWEEP_SECS   = int(os.environ.get("SESSION_SWEEP_SECS", 3600))
+SESSION_SWEEP_CHUNK  = 5000
+SIGNED_PREFIX        = "v1."
+
+def create_session(user):
+    if SESSION_MODE == "signed": return sign_session(user)
     token   = secrets.token_hex(32)
-    expires = (datetime.now() + timedelta(hours=8)).isoformat()
+    expires = (datetime.now() + timedelta(hours=SESSION_HOURS)).isoformat()
     db_execute("INSERT INTO sessions (token,user_id,expires) VALUES (%s,%s,%s)",
-               (token, user_id, expires))
+               (token, user["id"], expires))
     return token
 
+def b64url(raw): return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+def b64url_decode(s): return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+_session_key = {}
+
+def session_key():
+    """Clave HMAC del proceso (se lee una sola vez)."""
+    key = _session_key.get("key")
+    if key is None:
+        secret = SESSION_SECRET or row_to_dict(db_execute(
+            "SELECT value FROM app_secrets WHERE name=%s", ("session",), fetch="one"))["value"]
+        key = _session_key["key"] = hashlib.sha256(secret.encode()).digest()
+    return key
+
+def session_signature(body):
+    return hmac.new(session_key(), (SIGNED_PREFIX + body).encode(), hashlib.sha256).digest()
+
+def sign_session(user):
+    now = time.time()
+    claims = {"sub": user["id"], "usr": user["username"], "nam": user["name"], "rol": user["role"],
+              "mod": user.get("modules",""), "iat": int(now*1000), "exp": int(now + SESSION_HOURS*3600),
+              "jti": secrets.token_hex(8)}
+    body = b64url(json.dumps(claims, separators=(",",":")).encode())
+    return SIGNED_PREFIX + body + "." + b64url(session_signature(body))
+
+def read_signed(token):
+    """Claims de un token firmado íntegro y sin expirar, o None (no consulta la BD)."""
+    body, _, sig = token[len(SIGNED_PREFIX):].partition(".")
+    try:
+        if not hmac.compare_digest(b64url_decode(sig), session_signature(body)): return None
+        claims = json.loads(b64url_decode(body))
+    except ValueError: return None
+    return claims if claims.get("exp", 0) > time.time() else None
+
+class RevocationList:
+    """Revocaciones vigentes en memoria; un solo hilo por proceso recarga a la vez."""
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self._users   = {}      # uid → not_before (ms)
+        self._tokens  = set()   # jti
+        self._version = None
+        self._checked = 0.0
+
+    def refresh(self):
+        loaded = self._version is not None
+        if loaded and time.monotonic() - self._checked < REVOCATION_SYNC_SECS: return
+        # Con una lista ya cargada, si otro hilo recarga se sigue con ella; sin
+        # ninguna (recién arrancado) hay que esperar a que termine la primera carga
+        if not self._lock.acquire(blocking=not loaded): return
+        try:
+            if not loaded and self._version is not None: return   # la cargó el hilo al que esperábamos
+            self._checked = time.monotonic()
+            row = row_to_dict(db_execute("SELECT version FROM cache_versions WHERE name=%s", ("auth",), fetch="one"))
+            version = row["version"] if row else 0
+            if version == self._version: return
+            users, tokens = {}, set()
+            rows = db_execute("SELECT subject,not_before FROM session_revocations WHERE expires>%s",
+                              (int(time.time()),), fetch="all")
+            for r in map(row_to_dict, rows):
+                kind, _, key = r["subject"].partition(":")
+                if kind == "jti": tokens.add(key)
+                else: users[key] = r["not_before"]
+            self._users, self._tokens, self._version = users, tokens, version
+        finally:
+            self._lock.release()
+
+    def revoke(self, subject, not_before, expires):
+        db_execute("INSERT INTO session_revocations (subject,not_before,expires) VALUES (%s,%s,%s) "
+                   "ON CONFLICT (subject) DO UPDATE SET not_before=excluded.not_before,expires=excluded.expires",
+                   (subject, not_before, expires))
+        kind, _, key = subject.partition(":")
+        if kind == "jti": self._tokens.add(key)
+        else: self._users[key] = not_before
+
+    def revoke_user(self, user_id):
+        now = time.time()
+        self.revoke(f"user:{user_id}", int(now*1000), int(now + SESSION_HOURS*3600) + 1)
+
+    def revoked(self, claims):
+        return claims["jti"] in self._tokens or claims["iat"] < self._users.get(claims["sub"], 0)
+
+revocations = RevocationList()
+
+def signed_session_user(token):
+    claims = read_signed(token)
+    if not claims: return None
+    revocations.refresh()
+    if revocations.revoked(claims): return None
+    return {"id": claims["sub"], "username": claims["usr"], "name": claims["nam"], "role": claims["rol"],
+            "modules": claims["mod"], "active": True}
+
+def sweep_sessions():
+    """Borra en bloques las sesiones caducadas, y las revocaciones y vales de stream vencidos."""
+    now = datetime.now().isoformat()
+    while db_execute("SELECT token FROM sessions WHERE expires<%s LIMIT 1", (now,), fetch="one"):
+        db_execute("DELETE FROM sessions WHERE token IN (SELECT token FROM sessions WHERE expires<%s LIMIT %s)",
+                   (now, SESSION_SWEEP_CHUNK))
+    db_execute("DELETE FROM session_revocations WHERE expires<%s", (int(time.time()),))
+    db_execute("DELETE FROM stream_tickets WHERE expires<%s", (now,))
+
+class SessionSweeper:
+    def __init__(self):
+        self._lock   = threading.Lock()
+        self._pid    = None
+        self._thread = None
+
+    def ensure(self):
+        if not SESSION_SWEEP_SECS or (self._pid == os.getpid() and self._thread.is_alive()): return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive(): return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="session-sweeper", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try: sweep_sessions()
+            except Exception as e: print(f"⚠️  Purga de sesiones fallida: {e}")
+            time.sleep(SESSION_SWEEP_SECS)
+
+session_sweeper = SessionSweeper()
+
+# ─── Caché de sesiones ────────────────────────────────────────────────────────
+#  token → (usuario, expiración). Evita los dos SELECT (sessions + users) en cada
+#  petición protegida. Cada entrada vive como máximo SESSION_CACHE_TTL segundos;
+#  además, cada SESSION_CACHE_SYNC segundos se consulta cache_versions y, si otro
+#  worker invalidó (bloqueo, edición, logout…), se vacía la caché local.
+#  SESSION_CACHE_SYNC=0 desactiva el canal entre workers (solo TTL).
+
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", 1024))
+SESSION_CACHE_TTL  = int(os.environ.get("SESSION_CACHE_TTL", 60))
+SESSION_CACHE_SYNC = int(os.environ.get("SESSION_CACHE_SYNC", 5))
+
+class SessionCache:
+    """LRU acotado con TTL, thread-safe."""
+    def __init__(self, size, ttl):
+        self.size, self.ttl = size, ttl
+        self._data = OrderedDict()   # token → (user, expires, stamp)
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._data.get(token)
+            if entry is None: return None
+            user, expires, stamp = entry
+            if time.monotonic() - stamp > self.ttl or expires < datetime.now():
+                del self._data[token]; return None
+            self._data.move_to_end(token)
+            return dict(user)
+
+    def put(self, token, user, expires):
+        if self.size <= 0: return
+        with self._lock:
+            self._data[token] = (dict(user), expires, time.monotonic())
+            self._data.move_to_end(token)
+            while len(self._data) > self.size: self._data.popitem(last=False)
+
+    def drop_token(self, token):
+        with self._lock: self._data.pop(token, None)
+
+    def drop_user(self, user_id):
+        with self._lock:
+            for t in [t for t, e in self._data.items() if e[0].get("id") == user_id]:
+                del self._data[t]
+
+    def clear(self):
+        with self._lock: self._data.clear()
+
+session_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+_auth_sync = {"version": None, "checked": 0.0}
+
+def sync_session_cache():
+    """Vacía la caché local si otro worker incrementó la versión 'auth'."""
+    if not SESSION_CACHE_SYNC: return
+    now = time.monotonic()
+    if now - _auth_sync["checked"] < SESSION_CACHE_SYNC: return
+    _auth_sync["checked"] = now
+    row = row_to_dict(db_execute("SELECT version FROM cache_versions WHERE name=%s", ("auth",), fetch="one"))
+    version = row["version"] if row else 0
+    if version != _auth_sync["version"]:
+        if _auth_sync["version"] is not None: session_cache.clear()
+        _auth_sync["version"] = version
+
+def invalidate_sessions(user_id=None, token=None):
+    """Invalida la caché local y avisa al resto de workers."""
+    if token:   session_cache.drop_token(token)
+    if user_id: session_cache.drop_user(user_id)
+    if user_id and SESSION_MODE == "signed": revocations.revoke_user(user_id)
+    if SESSION_CACHE_SYNC or SESSION_MODE == "signed":
+        db_execute("UPDATE cache_versions SET version=version+1 WHERE name=%s", ("auth",))
+
 def get_session_user(token):
     if not token: return None
+    session_sweeper.ensure()
+    if token.startswith(SIGNED_PREFIX):
+        return signed_session_user(token) if SESSION_MODE == "signed" else None
+    sync_session_cache()
+    user = session_cache.get(token)
+    if user: return user
     sess = row_to_dict(db_execute(
         "SELECT * FROM sessions WHERE token=%s", (token,), fetch="one"
     ))
     if not sess: return None
-    if datetime.fromisoformat(sess["expires"]) < datetime.now():
+    expires = datetime.fromisoformat(sess["expires"])
+    if expires < datetime.now():
         db_execute("DELETE FROM sessions WHERE token=%s", (token,))
         return None
     user = row_to_dict(db_execute(
         "SELECT * FROM users WHERE id=%s", (sess["user_id"],), fetch="one"
     ))
+    if user: session_cache.put(token, user, expires)
     return user
 
 def delete_session(token):
-    db_execute("DELETE FROM sessions WHERE token=%s", (token,))
+    if token.startswith(SIGNED_PREFIX):
+        claims = read_signed(token) if SESSION_MODE == "signed" else None
+        if claims: revocations.revoke(f"jti:{claims['jti']}", 0, claims["exp"])
+    else:
+        db_execute("DELETE FROM sessions WHERE token=%s", (token,))
+    invalidate_sessions(token=token)
+
+def check_access(user, module=None):
+    """(error, código) si user no está activo o no tiene module; None si puede pasar."""
+    active = user.get("active") if user else False
+    if isinstance(active, int): active = bool(active)
+    if not user or not active: return "No autorizado", 401
+    if module and not has_module(user, module): return "Sin acceso a este módulo", 403
+    return None
 
 def require_auth(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
         token = request.headers.get("Authorization","").replace("Bearer ","")
         user  = get_session_user(token)
-        active = user.get("active") if user else False
-        if isinstance(active, int): active = bool(active)
-        if not user or not active:
-            return jsonify(error="No autorizado"), 401
+        denied = check_access(user)
+        if denied: return jsonify(error=denied[0]), denied[1]
         g.user = user
         return f(*args, **kwargs)
     return wrapper
@@ -306,13 +1254,8 @@ def require_module(module):
         def wrapper(*args, **kwargs):
             token = request.headers.get("Authorization","").replace("Bearer ","")
             user  = get_session_user(token)
-            active = user.get("active") if user else False
-            if isinstance(active, int): active = bool(active)
-            if not user or not active:
-                return jsonify(error="No autorizado"), 401
-            mods = user.get("modules","").split(",")
-            if module not in mods and user.get("role") != "admin":
-                return jsonify(error="Sin acceso a este módulo"), 403
+            denied = check_access(user, module)
+            if denied: return jsonify(error=denied[0]), denied[1]
             g.user = user
             return f(*args, **kwargs)
         return wrapper
@@ -321,10 +1264,107 @@ def require_module(module):
 def user_modules(user):
     return user.get("modules","").split(",")
 
+def has_module(user, module):
+    return module in user_modules(user) or user.get("role") == "admin"
+
 # ══════════════════════════════════════════════════════════════════════════════
 #  API AUTH
 # ══════════════════════════════════════════════════════════════════════════════
 
+# ─── Registro de accesos (asíncrono, por lotes) ──────────────────────────────
+#  log_login solo encola el evento; un hilo de fondo lo escribe junto con los
+#  demás pendientes en un INSERT multi-fila. Si la cola se llena se escribe en
+#  línea (contrapresión, nunca se descartan). Al salir se vacía la cola.
+#  Cada hora se borran en bloques los registros con más de
+#  LOGIN_LOG_RETENTION_DAYS días (0 = conservar todo).
+
+LOGIN_LOG_ASYNC          = os.environ.get("LOGIN_LOG_ASYNC", "1") == "1"
+LOGIN_LOG_QUEUE_MAX      = int(os.environ.get("LOGIN_LOG_QUEUE_MAX", 10000))
+LOGIN_LOG_BATCH          = int(os.environ.get("LOGIN_LOG_BATCH", 200))
+LOGIN_LOG_FLUSH_SECS     = float(os.environ.get("LOGIN_LOG_FLUSH_SECS", 2))
+LOGIN_LOG_RETENTION_DAYS = int(os.environ.get("LOGIN_LOG_RETENTION_DAYS", 365))
+LOGIN_LOG_COMPACT_SECS   = int(os.environ.get("LOGIN_LOG_COMPACT_SECS", 3600))
+LOGIN_LOG_COMPACT_CHUNK  = 5000
+
+class LoginLogWriter:
+    COLUMNS = ("id","user_id","username","name","ip","device","status","created_at")
+
+    def __init__(self):
+        self._pid        = None
+        self._thread     = None
+        self._queue      = queue.Queue(maxsize=LOGIN_LOG_QUEUE_MAX)
+        self._lock       = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._compacted  = 0.0
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid() and self._thread.is_alive(): return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Tras un fork la cola heredada la vacía el proceso padre
+                self._queue = queue.Queue(maxsize=LOGIN_LOG_QUEUE_MAX)
+                self._pid, self._thread = os.getpid(), None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="login-log-writer", daemon=True)
+                self._thread.start()
+
+    def put(self, event):
+        if not LOGIN_LOG_ASYNC: return self._insert([event])
+        self._ensure_thread()
+        try: self._queue.put_nowait(event)
+        except queue.Full: self._insert([event])
+
+    def _drain(self, first=None):
+        batch = [] if first is None else [first]
+        while len(batch) < LOGIN_LOG_BATCH:
+            try: batch.append(self._queue.get_nowait())
+            except queue.Empty: break
+        return batch
+
+    def _insert(self, batch):
+        cols = ",".join(self.COLUMNS); row = "(" + ",".join(["%s"]*len(self.COLUMNS)) + ")"
+        db_execute(f"INSERT INTO login_logs ({cols}) VALUES " + ",".join([row]*len(batch)),
+                   [e[c] for e in batch for c in self.COLUMNS])
+
+    def _write(self, batch):
+        for attempt in (1, 2):
+            try: return self._insert(batch)
+            except Exception as e:
+                if attempt == 2: print(f"⚠️  {len(batch)} registros de acceso perdidos: {e}")
+                else: time.sleep(1)
+
+    def flush(self):
+        """Escribe ya todo lo pendiente en este proceso."""
+        if self._pid != os.getpid(): return
+        with self._flush_lock:
+            while True:
+                batch = self._drain()
+                if not batch: return
+                self._write(batch)
+
+    def _run(self):
+        while True:
+            try: first = self._queue.get(timeout=LOGIN_LOG_FLUSH_SECS)
+            except queue.Empty: first = None
+            if first is not None:
+                with self._flush_lock: self._write(self._drain(first))
+            if time.monotonic() - self._compacted > LOGIN_LOG_COMPACT_SECS:
+                self._compacted = time.monotonic()
+                try: compact_login_logs()
+                except Exception as e: print(f"⚠️  Compactación de login_logs fallida: {e}")
+
+login_log_writer = LoginLogWriter()
+atexit.register(login_log_writer.flush)
+
+def compact_login_logs(days=None):
+    """Borra en bloques los registros más antiguos que la retención configurada."""
+    days = LOGIN_LOG_RETENTION_DAYS if days is None else days
+    if days <= 0: return
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+    while db_execute("SELECT id FROM login_logs WHERE created_at<%s LIMIT 1", (cutoff,), fetch="one"):
+        db_execute("DELETE FROM login_logs WHERE id IN (SELECT id FROM login_logs WHERE created_at<%s LIMIT %s)",
+                   (cutoff, LOGIN_LOG_COMPACT_CHUNK))
+
 def log_login(user_id, username, name, status):
     ip     = request.headers.get("X-Forwarded-For", request.remote_addr or "")
     if "," in ip: ip = ip.split(",")[0].strip()
@@ -335,10 +1375,10 @@ def log_login(user_id, username, name, status):
         device = "📟 Tablet"
     else:
         device = "💻 Escritorio"
-    db_execute(
-        "INSERT INTO login_logs (id,user_id,username,name,ip,device,status,created_at) VALUES (%s,%s,%s,%s,%s,%s,%s,%s)",
-        (str(uuid.uuid4()), user_id, username, name, ip, device, status, datetime.now().isoformat())
-    )
+    login_log_writer.put({
+        "id": str(uuid.uuid4()), "user_id": user_id, "username": username, "name": name,
+        "ip": ip, "device": device, "status": status, "created_at": datetime.now().isoformat()
+    })
 
 @app.route("/api/auth/login", methods=["POST"])
 def login():
@@ -360,7 +1400,7 @@ def login():
     if not active:
         log_login(user["id"], user["username"], user["name"], "bloqueado")
         return jsonify(error="Usuario bloqueado"), 403
-    token = create_session(user["id"])
+    token = create_session(user)
     mods  = user_modules(user)
     log_login(user["id"], user["username"], user["name"], "exitoso")
     return jsonify(token=token, user={
@@ -387,16 +1427,23 @@ def me():
 @app.route("/api/admin/login-logs", methods=["GET"])
 @require_admin
 def admin_login_logs():
-    limit = int(request.args.get("limit", 100))
+    login_log_writer.flush()
+    try:
+        limit  = max(1, min(int(request.args.get("limit", 100)), 1000))
+        cursor = decode_cursor(request.args.get("cursor", ""))
+    except ValueError: return jsonify(error="Parámetros de paginación inválidos"), 400
+    sql, params = "SELECT * FROM login_logs", []
+    if cursor: sql += " WHERE (created_at,id)<(%s,%s)"; params += cursor
     rows = rows_to_list(db_execute(
-        "SELECT * FROM login_logs ORDER BY created_at DESC LIMIT %s",
-        (limit,), fetch="all"
+        sql + " ORDER BY created_at DESC,id DESC LIMIT %s", (*params, limit+1), fetch="all"
     ))
-    return jsonify(logs=rows)
+    rows, nxt = page_result(rows, limit, lambda r: [r["created_at"], r["id"]])
+    return jsonify(logs=rows, next_cursor=nxt)
 
 @app.route("/api/auth/my-logs", methods=["GET"])
 @require_auth
 def my_login_logs():
+    login_log_writer.flush()
     uid = g.user["id"]
     rows = rows_to_list(db_execute(
         "SELECT * FROM login_logs WHERE user_id=%s ORDER BY created_at DESC LIMIT 50",
@@ -404,6 +1451,45 @@ def my_login_logs():
     ))
     return jsonify(logs=rows)
 
+# Agregados por intervalo para login-history.html. Los GROUP BY recorren solo
+# los índices de cobertura (created_at|user_id, created_at, status, device, ip).
+LOGIN_STATS_BUCKETS  = {"day": 10, "hour": 13}   # longitud del prefijo ISO
+LOGIN_STATS_MAX_DAYS = 366
+
+@app.route("/api/auth/login-stats", methods=["GET"])
+@require_auth
+def login_stats():
+    """?from=&to= (YYYY-MM-DD, por defecto los últimos 30 días) · ?bucket=day|hour
+    · ?user_id= (solo admin; los demás ven únicamente sus accesos) · ?top=N IPs."""
+    u, a = g.user, request.args
+    bucket = a.get("bucket", "day")
+    if bucket not in LOGIN_STATS_BUCKETS: return jsonify(error="bucket debe ser day u hour"), 400
+    try:
+        end   = datetime.strptime(a["to"], "%Y-%m-%d") if a.get("to") else datetime.now()
+        start = datetime.strptime(a["from"], "%Y-%m-%d") if a.get("from") else end - timedelta(days=29)
+        top   = max(1, min(int(a.get("top", 10)), 100))
+    except ValueError: return jsonify(error="Parámetros inválidos"), 400
+    if start > end or (end - start).days >= LOGIN_STATS_MAX_DAYS:
+        return jsonify(error=f"Rango inválido (máximo {LOGIN_STATS_MAX_DAYS} días)"), 400
+    user_id = a.get("user_id", "") if u.get("role") == "admin" else u["id"]
+    login_log_writer.flush()
+    where  = " WHERE created_at>=%s AND created_at<%s"
+    params = [start.strftime("%Y-%m-%d"), (end + timedelta(days=1)).strftime("%Y-%m-%d")]
+    if user_id: where += " AND user_id=%s"; params.append(user_id)
+    size = LOGIN_STATS_BUCKETS[bucket]
+    q = lambda sql: rows_to_list(db_execute(sql, params, fetch="all"))
+    series = q(f"SELECT SUBSTR(created_at,1,{size}) AS bucket,status,COUNT(*) AS count FROM login_logs"
+               + where + " GROUP BY 1,2 ORDER BY 1")
+    totals = {}
+    for r in series: totals[r["status"]] = totals.get(r["status"], 0) + r["count"]
+    devices = q("SELECT device,status,COUNT(*) AS count FROM login_logs" + where + " GROUP BY device,status")
+    ips = q("SELECT ip,COUNT(*) AS count,"
+            "SUM(CASE WHEN status='fallido' THEN 1 ELSE 0 END) AS fallido,"
+            "SUM(CASE WHEN status='bloqueado' THEN 1 ELSE 0 END) AS bloqueado "
+            "FROM login_logs" + where + f" GROUP BY ip ORDER BY 3 DESC,2 DESC LIMIT {top}")
+    return jsonify(bucket=bucket, **{"from": params[0]}, to=end.strftime("%Y-%m-%d"),
+                   user_id=user_id, totals=totals, series=series, devices=devices, ips=ips)
+
 # ══════════════════════════════════════════════════════════════════════════════
 #  API ADMIN
 # ══════════════════════════════════════════════════════════════════════════════
@@ -459,6 +1545,7 @@ def admin_update_user(uid):
     else:
         db_execute("UPDATE users SET name=%s,role=%s,active=%s,modules=%s WHERE id=%s",
                    (name,role,active,modules,uid))
+    invalidate_sessions(user_id=uid)
     return jsonify(id=uid,name=name,role=role,active=active,modules=modules.split(","))
 
 @app.route("/api/admin/users/<uid>", methods=["DELETE"])
@@ -468,6 +1555,7 @@ def admin_delete_user(uid):
     if not user: return jsonify(error="No encontrado"), 404
     if user.get("username") == "admin": return jsonify(error="No puedes eliminar el admin principal"), 400
     db_execute("DELETE FROM users WHERE id=%s",(uid,))
+    invalidate_sessions(user_id=uid)
     return "", 204
 
 @app.route("/api/admin/users/<uid>/toggle", methods=["POST"])
@@ -480,152 +1568,543 @@ def admin_toggle_user(uid):
     if isinstance(active, int): active = bool(active)
     new_active = not active
     db_execute("UPDATE users SET active=%s WHERE id=%s",(new_active,uid))
+    invalidate_sessions(user_id=uid)
     return jsonify(active=new_active)
 
+@app.route("/api/admin/metrics", methods=["GET"])
+@require_admin
+def admin_metrics():
+    extra = [f'process_info{{pid="{os.getpid()}"}} 1']
+    extra += [f'app_boot_milliseconds{{phase="{k[:-3]}"}} {v}' for k, v in BOOT_STATS.items()]
+    return Response(metrics.render() + "\n".join(extra) + "\n", mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/admin/slow-queries", methods=["GET"])
+@require_admin
+def admin_slow_queries():
+    return jsonify(threshold_ms=SLOW_QUERY_MS, queries=list(slow_queries)[::-1])
+
 # ══════════════════════════════════════════════════════════════════════════════
-#  CONSTANTES MÉDICAS
+#  ALMACÉN DE BORRADORES (pacientes de la factura en curso)
+#
+#  Cada paciente tiene un id estable por usuario (no se renumera al borrar);
+#  la posición visible ("no") se calcula al listar.
+#    DRAFT_STORE=db    → tabla medical_drafts, compartida por todos los workers
+#    DRAFT_STORE=local → dict en RAM del proceso (un solo worker / pruebas)
 # ══════════════════════════════════════════════════════════════════════════════
 
-DOCTOR  = "DR. FRANCISCO ENRIQUE CABRERA PORTIELES"
-SPEC    = "NEUROFISIOLOGO CLINICO"
-LICENSE = "RM0307 - CC 1047488543"
+DRAFT_STORE = os.environ.get("DRAFT_STORE", "db")
+
+class LocalDraftStore:
+    def __init__(self):
+        self._users = {}   # uid → {"next": int, "items": {id: paciente}}
+        self._lock  = threading.RLock()
+
+    @contextmanager
+    def locked(self, uid):
+        """Bloque atómico sobre los borradores de uid (p. ej. contar y luego añadir)."""
+        with self._lock: yield
+
+    def _bucket(self, uid):
+        return self._users.setdefault(uid, {"next": 1, "items": {}})
+
+    def list(self, uid):
+        with self._lock: return [dict(p) for p in self._bucket(uid)["items"].values()]
+
+    def count(self, uid):
+        with self._lock: return len(self._bucket(uid)["items"])
+
+    def get(self, uid, pid):
+        with self._lock:
+            p = self._bucket(uid)["items"].get(pid)
+            return dict(p) if p else None
+
+    def position(self, uid, pid):
+        with self._lock: return sum(1 for i in self._bucket(uid)["items"] if i < pid)
+
+    def add(self, uid, patients):
+        with self._lock:
+            b, out = self._bucket(uid), []
+            for p in patients:
+                p = {"id": b["next"], "name": p["name"], "price": p["price"], "date": p.get("date", "")}
+                b["items"][p["id"]] = p; b["next"] += 1; out.append(dict(p))
+            return out
+
+    def update(self, uid, pid, name, price):
+        with self._lock:
+            p = self._bucket(uid)["items"].get(pid)
+            if not p: return None
+            p["name"], p["price"] = name, price
+            return dict(p)
+
+    def delete(self, uid, pid):
+        with self._lock: return self._bucket(uid)["items"].pop(pid, None) is not None
+
+    def update_many(self, uid, changes):
+        with self._lock:
+            items = self._bucket(uid)["items"]
+            for pid, name, price in changes:
+                if pid in items: items[pid]["name"], items[pid]["price"] = name, price
+
+    def delete_many(self, uid, pids):
+        with self._lock:
+            items = self._bucket(uid)["items"]
+            for pid in pids: items.pop(pid, None)
+
+    def clear(self, uid):
+        with self._lock: self._users.pop(uid, None)
+
+class DbDraftStore:
+    BATCH = 200   # filas por INSERT multi-valor
+
+    @contextmanager
+    def locked(self, uid):
+        """Bloque atómico sobre los borradores de uid (p. ej. contar y luego añadir)."""
+        with db_transaction():
+            # En SQLite BEGIN IMMEDIATE ya serializa a los escritores; en PostgreSQL
+            # un candado por usuario hasta el COMMIT (MAX(id) no admite FOR UPDATE)
+            if DATABASE_URL: db_execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"drafts:{uid}",), fetch="one")
+            yield
+
+    def list(self, uid):
+        return rows_to_list(db_execute(
+            "SELECT id,name,price,study_date AS date FROM medical_drafts WHERE owner=%s ORDER BY id", (uid,), fetch="all"))
+
+    def count(self, uid):
+        return row_to_dict(db_execute(
+            "SELECT COUNT(*) AS n FROM medical_drafts WHERE owner=%s", (uid,), fetch="one"))["n"]
+
+    def get(self, uid, pid):
+        return row_to_dict(db_execute(
+            "SELECT id,name,price,study_date AS date FROM medical_drafts WHERE owner=%s AND id=%s", (uid, pid), fetch="one"))
+
+    def position(self, uid, pid):
+        return row_to_dict(db_execute(
+            "SELECT COUNT(*) AS n FROM medical_drafts WHERE owner=%s AND id<%s", (uid, pid), fetch="one"))["n"]
+
+    def add(self, uid, patients):
+        with self.locked(uid):
+            row = row_to_dict(db_execute(
+                "SELECT COALESCE(MAX(id),0) AS m FROM medical_drafts WHERE owner=%s", (uid,), fetch="one"))
+            out = [{"id": row["m"] + i, "name": p["name"], "price": p["price"], "date": p.get("date", "")}
+                   for i, p in enumerate(patients, 1)]
+            for k in range(0, len(out), self.BATCH):
+                chunk  = out[k:k + self.BATCH]
+                values = ",".join(["(%s,%s,%s,%s,%s)"] * len(chunk))
+                params = [v for p in chunk for v in (uid, p["id"], p["name"], p["price"], p["date"])]
+                db_execute(f"INSERT INTO medical_drafts (owner,id,name,price,study_date) VALUES {values}", params)
+        return out
+
+    def update(self, uid, pid, name, price):
+        db_execute("UPDATE medical_drafts SET name=%s,price=%s WHERE owner=%s AND id=%s",
+                   (name, price, uid, pid))
+        return self.get(uid, pid)
+
+    def delete(self, uid, pid):
+        if not self.get(uid, pid): return False
+        db_execute("DELETE FROM medical_drafts WHERE owner=%s AND id=%s", (uid, pid))
+        return True
+
+    def update_many(self, uid, changes):
+        for pid, name, price in changes:
+            db_execute("UPDATE medical_drafts SET name=%s,price=%s WHERE owner=%s AND id=%s", (name, price, uid, pid))
+
+    def delete_many(self, uid, pids):
+        for k in range(0, len(pids), self.BATCH):
+            chunk = pids[k:k + self.BATCH]
+            db_execute(f"DELETE FROM medical_drafts WHERE owner=%s AND id IN ({','.join(['%s'] * len(chunk))})",
+                       (uid, *chunk))
+
+    def clear(self, uid):
+        db_execute("DELETE FROM medical_drafts WHERE owner=%s", (uid,))
+
+draft_store = LocalDraftStore() if DRAFT_STORE == "local" else DbDraftStore()
 
-patients_store = {}  # RAM: { user_id: [patients] }
-
-def get_patients(uid): return patients_store.setdefault(uid, [])
 def auto_price(idx): return 100_000 if idx < 20 else 70_000
-def clean(name): return Path(name).stem.replace("_"," ").title()
-def fmt_money(v): return f"${int(v):,}".replace(",",".")
-
-# ══════════════════════════════════════════════════════════════════════════════
-#  GENERADORES DE DOCUMENTOS MÉDICOS
-# ══════════════════════════════════════════════════════════════════════════════
-
-def docx_invoice(number, patients):
-    doc = Document()
-    for s in doc.sections:
-        s.top_margin=Cm(2); s.bottom_margin=Cm(2)
-        s.left_margin=Cm(2.5); s.right_margin=Cm(2.5)
-    style=doc.styles['Normal']; style.font.name='Arial'; style.font.size=Pt(11)
-    hdr=doc.add_paragraph(); hdr.alignment=WD_ALIGN_PARAGRAPH.CENTER
-    r=hdr.add_run(DOCTOR+"\n"); r.bold=True; r.font.size=Pt(16); r.font.color.rgb=RGBColor(0,51,102)
-    r2=hdr.add_run(SPEC+"\n"); r2.font.size=Pt(12); r2.font.color.rgb=RGBColor(0,51,102)
-    r3=hdr.add_run(LICENSE+"\n\n"); r3.italic=True; r3.font.size=Pt(10); r3.font.color.rgb=RGBColor(0,51,102)
-    p=doc.add_paragraph(); p.alignment=WD_ALIGN_PARAGRAPH.CENTER
-    rc=p.add_run(f"SE REALIZÓ INFORME Y PROCESAMIENTO DE LA CANTIDAD DE ESTUDIOS: {len(patients)}\nESTUDIOS DE POLISOMNOGRAFÍA\n\n")
-    rc.bold=True; rc.font.size=Pt(11); rc.font.color.rgb=RGBColor(0,51,102)
-    doc.add_paragraph(f"FACTURA N°: {number}",style='Heading 1').runs[0].bold=True
-    doc.add_paragraph(f"Fecha: {datetime.now():%d/%m/%Y %H:%M}"); doc.add_paragraph()
-    tbl=doc.add_table(rows=1,cols=3); tbl.style='Light List Accent 1'
-    tbl.alignment=WD_TABLE_ALIGNMENT.CENTER
-    hc=tbl.rows[0].cells; hc[0].text="No."; hc[1].text="PACIENTE"; hc[2].text="VALOR"
-    for i,p in enumerate(patients,1):
-        row=tbl.add_row().cells; row[0].text=str(i); row[1].text=p['name']; row[2].text=fmt_money(p['price'])
-    doc.add_paragraph(); total=sum(p['price'] for p in patients)
-    tp=doc.add_paragraph(); tp.paragraph_format.alignment=WD_PARAGRAPH_ALIGNMENT.RIGHT
-    rt=tp.add_run(f"TOTAL: {fmt_money(total)}"); rt.bold=True; rt.font.size=Pt(12)
-    fn=TEMP_DIR/f"Factura_{number}.docx"; doc.save(fn); return fn
-
-def generate_pdf(number, patients):
-    path=TEMP_DIR/f"Factura_{number}.pdf"
-    c=canvas.Canvas(str(path),pagesize=letter); w,h=letter
-    def tbl_header(y):
-        c.setFont("Helvetica-Bold",10)
-        c.drawString(72,y,"No."); c.drawString(120,y,"PACIENTE"); c.drawRightString(w-72,y,"VALOR")
-        c.line(72,y-5,w-72,y-5)
-    c.setFont("Helvetica-Bold",14); c.setFillColorRGB(0,51/255,102/255)
-    c.drawCentredString(w/2,h-50,DOCTOR); c.setFont("Helvetica",12)
-    c.drawCentredString(w/2,h-70,SPEC); c.drawCentredString(w/2,h-85,LICENSE)
-    c.setFont("Helvetica-Bold",10)
-    c.drawCentredString(w/2,h-105,f"SE REALIZÓ INFORME Y PROCESAMIENTO DE LA CANTIDAD DE ESTUDIOS: {len(patients)}")
-    c.drawCentredString(w/2,h-120,"ESTUDIOS DE POLISOMNOGRAFÍA")
-    c.setFont("Helvetica-Bold",12); c.drawString(72,h-150,f"FACTURA N°: {number}")
-    c.setFont("Helvetica",11); c.drawString(72,h-170,f"Fecha: {datetime.now():%d/%m/%Y %H:%M}")
-    rh=18; mr=int((h-260)/rh); y=h-225; tbl_header(h-200)
-    for i,p in enumerate(patients,1):
-        if (i-1) and (i-1)%mr==0: c.showPage(); tbl_header(h-50); y=h-80
-        c.setFont("Helvetica",10); c.drawString(72,y,str(i))
-        c.drawString(120,y,p['name']); c.drawRightString(w-72,y,fmt_money(p['price'])); y-=rh
-    sub=sum(p['price'] for p in patients)
-    if y<100: c.showPage(); tbl_header(h-50); y=h-80
-    c.setFont("Helvetica-Bold",11); c.drawRightString(w-72,y-20,f"SUBTOTAL: {fmt_money(sub)}")
-    c.setFont("Helvetica-Bold",12); c.drawRightString(w-72,y-40,f"TOTAL:    {fmt_money(sub)}")
-    c.save(); return path
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  BUFFERS DE RENDERIZADO
+#
+#  Los documentos se generan en memoria y se envían directamente al cliente:
+#  nada queda en disco y dos peticiones con el mismo número no se pisan.
+#  Con RENDER_SPOOL_MAX > 0 los documentos mayores de ese tamaño (bytes) se
+#  quedan en un fichero de TEMP_DIR (hasta RENDER_SPOOL_TOTAL bytes en total,
+#  ver documents.py): se envían desde el disco por bloques, no entran en la
+#  caché de renderizados y se borran al cerrar la respuesta; los restos
+#  antiguos se purgan tras TEMP_MAX_AGE segundos.
+# ══════════════════════════════════════════════════════════════════════════════
+
+MIMETYPES = {
+    "pdf":  "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+def send_document(data, filename):
+    """data: bytes o la ruta (str) de un documento volcado a disco, que se borra al terminar."""
+    mimetype = MIMETYPES[filename.rsplit(".",1)[1]]
+    if not isinstance(data, str):
+        return send_file(io.BytesIO(data), as_attachment=True, download_name=filename, mimetype=mimetype)
+    resp = send_file(SpooledDocument(data), as_attachment=True, download_name=filename, mimetype=mimetype, etag=False)
+    resp.content_length = os.path.getsize(data)
+    return resp
+
+def discard_spooled(path):
+    try: os.unlink(path)
+    except OSError: pass
+
+class SpooledDocument(io.FileIO):
+    """Documento volcado a disco; el fichero se borra al cerrarlo (al terminar de enviarlo)."""
+    def __init__(self, path): super().__init__(path, "rb")
+    def close(self):
+        closed = self.closed; super().close()
+        if not closed: discard_spooled(self.name)
+
+if not MP_CHILD: sweep_temp_dir(force=True)
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  CACHÉ DE DOCUMENTOS RENDERIZADOS
+#
+#  Clave = sha256(tipo, datos de la factura, formato, RENDER_TEMPLATE_VERSION).
+#  Como la clave depende del contenido, editar una factura produce otra clave;
+#  personal_update/personal_delete descartan además la entrada anterior.
+#  La clave se envía como ETag: con If-None-Match coincidente se responde 304
+#  sin leer la caché ni renderizar.
+#    RENDER_CACHE=memory|disk|off   RENDER_CACHE_MAX=bytes totales
+# ══════════════════════════════════════════════════════════════════════════════
+
+RENDER_TEMPLATE_VERSION = "1"   # subir al cambiar el aspecto de los documentos
+RENDER_CACHE     = os.environ.get("RENDER_CACHE", "memory")
+RENDER_CACHE_MAX = int(os.environ.get("RENDER_CACHE_MAX", 64 * 1024 * 1024))
+
+class MemoryRenderCache:
+    """LRU en RAM acotado por tamaño total en bytes."""
+    def __init__(self, max_bytes):
+        self.max_bytes, self.size = max_bytes, 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._data.get(key)
+            if data is not None: self._data.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes: return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None: self.size -= len(old)
+            self._data[key] = data; self.size += len(data)
+            while self.size > self.max_bytes:
+                _, ev = self._data.popitem(last=False); self.size -= len(ev)
+
+    def discard(self, key):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None: self.size -= len(old)
+
+class DiskRenderCache:
+    """LRU en disco (TEMP_DIR/render-cache); el mtime marca el último uso."""
+    def __init__(self, max_bytes, folder):
+        self.max_bytes, self.folder = max_bytes, folder
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        f = self.folder / key
+        try:
+            data = f.read_bytes(); os.utime(f)
+            return data
+        except OSError:
+            return None
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes: return
+        tmp = self.folder / f".{key}.{os.getpid()}.{threading.get_ident()}"
+        tmp.write_bytes(data); os.replace(tmp, self.folder / key)
+        with self._lock: self._evict()
+
+    def _evict(self):
+        files = []
+        for f in self.folder.iterdir():
+            try: st = f.stat(); files.append((st.st_mtime, st.st_size, f))
+            except OSError: pass
+        total = sum(sz for _, sz, _ in files)
+        for _, sz, f in sorted(files):
+            if total <= self.max_bytes: break
+            try: f.unlink(); total -= sz
+            except OSError: pass
+
+    def discard(self, key):
+        try: (self.folder / key).unlink()
+        except OSError: pass
+
+class NullRenderCache:
+    def get(self, key): return None
+    def put(self, key, data): pass
+    def discard(self, key): pass
+
+if RENDER_CACHE == "disk":     render_cache = DiskRenderCache(RENDER_CACHE_MAX, TEMP_DIR / "render-cache")
+elif RENDER_CACHE == "memory": render_cache = MemoryRenderCache(RENDER_CACHE_MAX)
+else:                          render_cache = NullRenderCache()
+
+def render_key(kind, payload, fmt):
+    raw = json.dumps([kind, fmt, RENDER_TEMPLATE_VERSION, payload], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def document_filename(kind, payload, fmt):
+    ext = "docx" if fmt=="word" else "pdf"
+    if kind=="medical": return f"Factura_{payload['number']}.{ext}"
+    return f"FacturaPersonal_{payload['number']}.{ext}"
+
+def render_document(kind, payload, fmt):
+    """Renderiza el documento en este proceso y registra la duración."""
+    t0 = time.perf_counter()
+    data = documents.render_document(kind, payload, fmt)
+    if METRICS_ENABLED: metrics.observe("render_duration_seconds", time.perf_counter()-t0, kind=kind, fmt=fmt)
+    return data
+
+def send_cached(kind, payload, fmt):
+    """Envía el documento desde la caché o lo renderiza y lo guarda."""
+    key = render_key(kind, payload, fmt)
+    if key in request.if_none_match:
+        resp = app.response_class(status=304)
+    else:
+        data = render_cache.get(key)
+        if data is None:
+            data = render_document(kind, payload, fmt)
+            if not isinstance(data, str): render_cache.put(key, data)   # los volcados a disco no se cachean
+        resp = send_document(data, document_filename(kind, payload, fmt))
+    resp.set_etag(key)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+def discard_rendered(kind, payload):
+    for fmt in ("pdf", "word"): render_cache.discard(render_key(kind, payload, fmt))
+
+def medical_payload(number, patients, created_at):
+    return {"number": number, "patients": patients, "created_at": created_at}
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  CARGA DE INFORMES (.doc / .docx / .pdf)
+#
+#  Los archivos se reciben en SpooledTemporaryFile (en RAM hasta
+#  UPLOAD_SPOOL_MAX, después en TEMP_DIR) y la carga se corta con 413 en cuanto
+#  un archivo pasa de UPLOAD_FILE_MAX o el cuerpo de UPLOAD_MAX_TOTAL. De cada
+#  informe se extrae el nombre del paciente y la fecha del estudio (texto del
+#  documento o, en su defecto, metadatos); si no aparecen se usa el nombre del
+#  archivo como antes. La extracción (extract_study, en documents.py) corre en
+#  el pool de render_executor con una ventana acotada de archivos en vuelo:
+#  cada archivo se copia por bloques a un fichero upload-* de TEMP_DIR y el
+#  pool recibe su ruta, así que el proceso web nunca tiene un archivo entero
+#  en memoria. MAX_CONTENT_LENGTH rechaza con 413 un cuerpo declarado mayor que
+#  UPLOAD_MAX_TOTAL antes de leerlo.
+# ══════════════════════════════════════════════════════════════════════════════
+
+UPLOAD_FILE_MAX  = int(os.environ.get("UPLOAD_FILE_MAX", 20 * 1024 * 1024))
+UPLOAD_MAX_TOTAL = int(os.environ.get("UPLOAD_MAX_TOTAL", 256 * 1024 * 1024))
+UPLOAD_SPOOL_MAX = int(os.environ.get("UPLOAD_SPOOL_MAX", 1024 * 1024))
+UPLOAD_MAX_FILES = int(os.environ.get("UPLOAD_MAX_FILES", 500))
+UPLOAD_EXTS      = (".doc", ".docx", ".pdf")
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_TOTAL
+app.config["MAX_FORM_PARTS"]     = UPLOAD_MAX_FILES + 50
+
+class LimitedSpool(tempfile.SpooledTemporaryFile):
+    def __init__(self, limit):
+        super().__init__(max_size=UPLOAD_SPOOL_MAX, dir=TEMP_DIR); self.limit = limit
+
+    def write(self, data):
+        if self.tell() + len(data) > self.limit:
+            raise RequestEntityTooLarge(f"Cada archivo admite como máximo {self.limit // (1024*1024)} MB")
+        return super().write(data)
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return LimitedSpool(UPLOAD_FILE_MAX)
+
+app.request_class = UploadRequest
+
+@app.errorhandler(RequestEntityTooLarge)
+def too_large(e):
+    return jsonify(error=e.description or "Carga demasiado grande"), 413
+
+def spool_upload(stream):
+    """Copia (por bloques) y cierra el archivo subido; devuelve la ruta de la copia en TEMP_DIR."""
+    fd, path = tempfile.mkstemp(prefix="upload-", dir=TEMP_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            stream.seek(0); shutil.copyfileobj(stream, f, 1024 * 1024)
+    except BaseException:
+        discard_spooled(path); raise
+    finally: stream.close()
+    return path
+
+def extract_uploads(files, progress=None):
+    """files: [(nombre, stream)]. Extrae en paralelo, cierra los streams y
+    devuelve los resultados en el orden de carga."""
+    out, pending, todo = [None] * len(files), {}, list(enumerate(files))
+    window = max(2, RENDER_WORKERS * 2)
+    try:
+        while todo or pending:
+            while todo and len(pending) < window:
+                i, (name, stream) = todo.pop(0)
+                path = spool_upload(stream)
+                pending[submit_render(documents.extract_study, name, path)] = (i, path)
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                i, path = pending.pop(fut); discard_spooled(path)
+                try: out[i] = fut.result()
+                except Exception: out[i] = {"name": clean(files[i][0]), "date": "", "source": "archivo"}
+                if progress: progress(len(files) - len(todo) - len(pending), len(files))
+    finally:
+        for _, (name, stream) in todo: stream.close()
+        for fut, (_, path) in pending.items(): fut.cancel(); discard_spooled(path)
+    return out
 
 # ══════════════════════════════════════════════════════════════════════════════
 #  API MÉDICA
 # ══════════════════════════════════════════════════════════════════════════════
 
+def numbered(pts, start=1):
+    """Añade la posición visible ("no") a cada paciente."""
+    for i, p in enumerate(pts, start): p["no"] = i
+    return pts
+
 @app.route("/api/medical/patients", methods=["GET","POST"])
 @require_module("medical")
 def medical_patients():
-    uid=g.user["id"]; pts=get_patients(uid)
+    uid=g.user["id"]
     if request.method=="POST" and "files" in request.files:
-        new=[]
-        for f in request.files.getlist("files"):
-            if f.filename.lower().endswith((".doc",".docx",".pdf")):
-                idx=len(pts)+len(new)
-                new.append({"id":idx+1,"name":clean(f.filename),"price":auto_price(idx)})
-        pts.extend(new); return jsonify(success=True,patients=new)
+        files=[f for f in request.files.getlist("files") if f.filename.lower().endswith(UPLOAD_EXTS)]
+        if len(files)>UPLOAD_MAX_FILES: return jsonify(error=f"Máximo {UPLOAD_MAX_FILES} archivos por carga"),413
+        # Los spools pasan a ser nuestros: al cerrar la petición no se tocan
+        owned=[(f.filename,f.stream) for f in files]
+        for f in files: f.stream=io.BytesIO()
+        def save(found):
+            with draft_store.locked(uid):
+                n=draft_store.count(uid)
+                new=[{"name":r["name"],"date":r["date"],"price":auto_price(n+i)} for i,r in enumerate(found)]
+                return numbered(draft_store.add(uid,new),n+1)
+        if request.args.get("progress")!="1":
+            return jsonify(success=True,patients=save(extract_uploads(owned)))
+        # ?progress=1 → NDJSON: {"done","total"} por archivo y al final {"success","patients"}.
+        # Sin stream_with_context: la conexión de la petición se libera ya.
+        def lines():
+            updates=queue.Queue(); box={}
+            def work():
+                try: box["found"]=extract_uploads(owned,lambda d,t: updates.put({"done":d,"total":t}))
+                except Exception as e: box["error"]=str(e)
+                updates.put(None)
+            worker=threading.Thread(target=work,daemon=True); worker.start()
+            yield json.dumps({"done":0,"total":len(files)})+"\n"
+            while (msg:=updates.get()) is not None: yield json.dumps(msg)+"\n"
+            if "error" in box: yield json.dumps({"error":box["error"]})+"\n"; return
+            yield json.dumps({"success":True,"patients":save(box["found"])})+"\n"
+        return Response(lines(),mimetype="application/x-ndjson",
+                        headers={"Cache-Control":"no-cache","X-Accel-Buffering":"no"})
     if request.method=="POST":
         data=request.get_json(force=True) or {}
         name=data.get("name","").strip()
         if not name: return jsonify(error="Nombre requerido"),400
-        idx=len(pts); price=int(data.get("price") or auto_price(idx))
-        if idx<20: price=100_000
-        p={"id":idx+1,"name":name,"price":price}; pts.append(p)
-        return jsonify(p),201
+        with draft_store.locked(uid):
+            idx=draft_store.count(uid); price=int(data.get("price") or auto_price(idx))
+            if idx<20: price=100_000
+            p=draft_store.add(uid,[{"name":name,"price":price}])[0]
+        return jsonify(numbered([p],idx+1)[0]),201
+    pts=draft_store.list(uid)
     sub=sum(p["price"] for p in pts)
-    return jsonify(patients=pts,count=len(pts),subtotal=sub)
+    return jsonify(patients=numbered(pts),count=len(pts),subtotal=sub)
 
 @app.route("/api/medical/patients/<int:pid>", methods=["PUT","DELETE"])
 @require_module("medical")
 def medical_one(pid):
-    uid=g.user["id"]; pts=get_patients(uid)
-    p=next((x for x in pts if x["id"]==pid),None)
-    if not p: return "",404
+    uid=g.user["id"]
     if request.method=="DELETE":
-        pts.remove(p)
-        for i,obj in enumerate(pts,1): obj["id"]=i
-        return "",204
+        return ("",204) if draft_store.delete(uid,pid) else ("",404)
+    p=draft_store.get(uid,pid)
+    if not p: return "",404
     data=request.get_json(force=True) or {}
-    p["name"]=data.get("name",p["name"]).strip()
+    name=data.get("name",p["name"]).strip()
     if "price" in data:
-        try: p["price"]=int(data["price"])
+        try: price=int(data["price"])
         except: return jsonify(error="Precio inválido"),400
-    else: p["price"]=auto_price(p["id"]-1)
-    return jsonify(p)
+    else: price=auto_price(draft_store.position(uid,pid))
+    return jsonify(draft_store.update(uid,pid,name,price))
+
+@app.route("/api/medical/patients/batch", methods=["POST"])
+@require_module("medical")
+def medical_batch():
+    """Lote de borradores (ver batch_ops): create {name, price?} · update {id, name?, price?} · delete {id}.
+    Devuelve además la lista final, como GET /api/medical/patients."""
+    uid=g.user["id"]
+    try: ops,atomic=batch_ops(("create","update","delete"),int)
+    except ValueError as e: return jsonify(error=str(e)),400
+    with draft_store.locked(uid):
+        pts={p["id"]:p for p in draft_store.list(uid)}
+        results,creates,updates,deletes=[],[],{},[]
+        for i,op in enumerate(ops):
+            if op["op"]!="create" and op.get("id") not in pts:
+                results.append({"index":i,"status":404,"error":"No encontrado"}); continue
+            if op["op"]=="delete":
+                pid=op["id"]; del pts[pid]; updates.pop(pid,None); deletes.append(pid)
+                results.append({"index":i,"status":204}); continue
+            p=pts.get(op.get("id"),{})
+            name=str(op.get("name",p.get("name",""))).strip()
+            if not name: results.append({"index":i,"status":400,"error":"Nombre requerido"}); continue
+            try: price=int(op["price"]) if op.get("price") not in (None,"") else None
+            except (TypeError,ValueError): results.append({"index":i,"status":400,"error":"Precio inválido"}); continue
+            if op["op"]=="create":
+                idx=len(pts)+len(creates); price=100_000 if idx<20 else price or auto_price(idx)
+                creates.append({"name":name,"price":price}); results.append({"index":i,"status":201}); continue
+            pid=op["id"]
+            if price is None: price=auto_price(sum(1 for x in pts if x<pid))
+            p.update(name=name,price=price); updates[pid]=(pid,name,price)
+            results.append({"index":i,"status":200,"patient":dict(p)})
+        if not (atomic and any(r["status"]>=400 for r in results)):
+            draft_store.delete_many(uid,deletes); draft_store.update_many(uid,list(updates.values()))
+            made=iter(draft_store.add(uid,creates) if creates else [])
+            for r in results:
+                if r["status"]==201: r["patient"]=next(made)
+    pts=draft_store.list(uid)
+    return batch_result(results,atomic,patients=numbered(pts),count=len(pts),subtotal=sum(p["price"] for p in pts))
 
 @app.route("/api/medical/clear", methods=["DELETE"])
 @require_module("medical")
 def medical_clear():
-    get_patients(g.user["id"]).clear(); return "",204
+    draft_store.clear(g.user["id"]); return "",204
 
 @app.route("/api/medical/invoice/<fmt>", methods=["POST"])
 @require_module("medical")
 def medical_invoice(fmt):
-    uid=g.user["id"]; pts=get_patients(uid)
+    uid=g.user["id"]; pts=draft_store.list(uid)
     if not pts: return jsonify(error="No hay pacientes"),400
     data=request.get_json(force=True) or {}
     num=data.get("invoice_number",f"FAC-{datetime.now():%Y%m%d%H%M%S}")
     # Guardar en historial
-    total=sum(p["price"] for p in pts)
-    db_execute(
-        "INSERT INTO medical_history (id,owner,invoice_number,created_at,patient_count,total,patients_json) VALUES (%s,%s,%s,%s,%s,%s,%s)",
-        (str(uuid.uuid4()), uid, num, datetime.now().isoformat(), len(pts), total, json.dumps(pts))
-    )
-    path=docx_invoice(num,pts) if fmt=="word" else generate_pdf(num,pts)
-    return send_file(path,as_attachment=True)
+    total=sum(p["price"] for p in pts); created=datetime.now().isoformat(); hid=str(uuid.uuid4())
+    with db_transaction():   # historial, acumulado e índice: todo o nada
+        db_execute(
+            "INSERT INTO medical_history (id,owner,invoice_number,created_at,patient_count,total,patients_json) VALUES (%s,%s,%s,%s,%s,%s,%s)",
+            (hid, uid, num, created, len(pts), total, json.dumps(pts))
+        )
+        rollup_medical(uid,created,pts)
+        search_put(medical_entry(hid,uid,num,created,pts))
+    invalidate_counts("medical_history",uid)
+    if data.get("async"):  # facturas grandes: se renderiza en segundo plano
+        return submit_render_job(uid,"medical",hid,medical_payload(num,pts,created),fmt)
+    return send_cached("medical",medical_payload(num,pts,created),fmt)
 
 @app.route("/api/medical/history", methods=["GET"])
 @require_module("medical")
 def medical_history():
     uid=g.user["id"]
-    rows=rows_to_list(db_execute(
-        "SELECT id,invoice_number,created_at,patient_count,total FROM medical_history WHERE owner=%s ORDER BY created_at DESC LIMIT 50",
-        (uid,),fetch="all"
-    ))
-    return jsonify(history=rows)
+    try: limit,cursor=page_args()
+    except ValueError: return jsonify(error="Parámetros de paginación inválidos"),400
+    sql="SELECT id,invoice_number,created_at,patient_count,total FROM medical_history WHERE owner=%s"
+    params=[uid]
+    if cursor: sql+=" AND (created_at,id)<(%s,%s)"; params+=cursor
+    rows=rows_to_list(db_execute(sql+" ORDER BY created_at DESC,id DESC LIMIT %s",(*params,limit+1),fetch="all"))
+    rows,nxt=page_result(rows,limit,lambda r:[r["created_at"],r["id"]])
+    return jsonify(history=rows,next_cursor=nxt,total=cached_count("medical_history",uid))
 
 @app.route("/api/medical/history/<hid>/download/<fmt>", methods=["GET"])
 @require_module("medical")
@@ -637,116 +2116,132 @@ def medical_history_download(hid,fmt):
     if not row: return jsonify(error="No encontrado"),404
     pts=json.loads(row["patients_json"])
     num=row["invoice_number"]
-    path=docx_invoice(num,pts) if fmt=="word" else generate_pdf(num,pts)
-    return send_file(path,as_attachment=True)
-
-# ══════════════════════════════════════════════════════════════════════════════
-#  API PERSONAL — generadores PDF/DOCX
-# ══════════════════════════════════════════════════════════════════════════════
-
-def generate_personal_pdf(inv):
-    num=inv["number"]; path=TEMP_DIR/f"FacturaPersonal_{num}.pdf"
-    c=canvas.Canvas(str(path),pagesize=A4); w,h=A4
-    c.setFillColorRGB(.05,.08,.18); c.rect(0,h-120,w,120,fill=1,stroke=0)
-    c.setFillColorRGB(.24,.52,1.0); c.rect(0,h-124,w,4,fill=1,stroke=0)
-    c.setFont("Helvetica-Bold",20); c.setFillColorRGB(1,1,1)
-    c.drawString(40,h-55,inv.get("issuer_name","").upper())
-    c.setFont("Helvetica",11); c.setFillColorRGB(.7,.8,1.0)
-    c.drawString(40,h-75,inv.get("issuer_email",""))
-    c.drawString(40,h-90,inv.get("issuer_phone",""))
-    c.drawString(40,h-105,inv.get("issuer_address",""))
-    c.setFont("Helvetica-Bold",28); c.setFillColorRGB(1,1,1)
-    c.drawRightString(w-40,h-60,"FACTURA")
-    c.setFont("Helvetica",13); c.setFillColorRGB(.7,.8,1.0)
-    c.drawRightString(w-40,h-80,f"N° {num}")
-    c.drawRightString(w-40,h-97,f"Fecha: {inv.get('date',datetime.now().strftime('%d/%m/%Y'))}")
-    c.setFillColorRGB(.94,.96,1.0); c.rect(40,h-210,w-80,75,fill=1,stroke=0)
-    c.setFont("Helvetica-Bold",9); c.setFillColorRGB(.24,.52,1.0)
-    c.drawString(55,h-148,"FACTURADO A")
-    c.setFont("Helvetica-Bold",13); c.setFillColorRGB(.05,.08,.18)
-    c.drawString(55,h-165,inv.get("client_name",""))
-    c.setFont("Helvetica",10); c.setFillColorRGB(.3,.35,.5)
-    c.drawString(55,h-180,inv.get("client_company",""))
-    c.drawString(55,h-193,inv.get("client_nit",""))
-    c.drawString(55,h-206,inv.get("client_email",""))
-    sc={"pagada":(0.13,0.7,0.4),"pendiente":(0.95,0.6,0.1),"vencida":(0.9,0.2,0.2)}.get(inv.get("status","pendiente"),(0.5,0.5,0.5))
-    c.setFillColorRGB(*sc); c.roundRect(w-160,h-168,110,22,5,fill=1,stroke=0)
-    c.setFont("Helvetica-Bold",10); c.setFillColorRGB(1,1,1)
-    c.drawCentredString(w-105,h-153,inv.get("status","pendiente").upper())
-    ty=h-255; c.setFillColorRGB(.05,.08,.18); c.rect(40,ty,w-80,24,fill=1,stroke=0)
-    c.setFont("Helvetica-Bold",9); c.setFillColorRGB(1,1,1)
-    c.drawString(55,ty+8,"DESCRIPCIÓN"); c.drawRightString(w/2+20,ty+8,"CANT.")
-    c.drawRightString(w/2+120,ty+8,"V. UNITARIO"); c.drawRightString(w-50,ty+8,"TOTAL")
-    ry=ty-5; rh=22; sub=0
+    return send_cached("medical",medical_payload(num,pts,row["created_at"]),fmt)
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  API PERSONAL  (los generadores PDF/DOCX están en documents.py)
+# ══════════════════════════════════════════════════════════════════════════════
+
+def clean_personal(inv):
+    """Valida y normaliza en su sitio ítems e IVA; ValueError con el mensaje para el cliente."""
+    items=inv.get("items") or []
+    if not isinstance(items,list) or not all(isinstance(it,dict) for it in items):
+        raise ValueError("items debe ser una lista de objetos")
+    for n,it in enumerate(items,1):
+        it["qty"]=personal_number(it.get("qty"),1,f"Cantidad del ítem {n}")
+        it["unit_value"]=personal_number(it.get("unit_value"),0,f"Valor unitario del ítem {n}")
+    inv["items"]=items; inv["tax"]=personal_number(inv.get("tax"),0,"IVA")
+    return inv
+
+# ── Columnas normalizadas ──────────────────────────────────────────────────────
+#  data_json sigue siendo la fuente para renderizar; las columnas y la tabla de
+#  líneas se mantienen sincronizadas en cada escritura para filtrar y sumar en SQL.
+
+PERSONAL_COLUMN_TYPES = {
+    "number":      "TEXT DEFAULT ''",
+    "status":      "TEXT DEFAULT 'pendiente'",
+    "client_name": "TEXT DEFAULT ''",
+    "client_nit":  "TEXT DEFAULT ''",
+    "due_date":    "TEXT DEFAULT ''",
+    "tax_rate":    "DOUBLE PRECISION DEFAULT 0",
+    "subtotal":    "DOUBLE PRECISION DEFAULT 0",
+    "tax":         "DOUBLE PRECISION DEFAULT 0",
+    "total":       "DOUBLE PRECISION DEFAULT 0",
+}
+PERSONAL_COLUMNS = tuple(PERSONAL_COLUMN_TYPES)
+
+def iso_date(value):
+    """Fecha dd/mm/aaaa (la que envía el formulario) o AAAA-MM-DD → AAAA-MM-DD; '' si no es una fecha."""
+    value=str(value or "").strip()
+    for f in ("%d/%m/%Y","%Y-%m-%d"):
+        try: return datetime.strptime(value,f).strftime("%Y-%m-%d")
+        except ValueError: pass
+    return ""
+
+def personal_columns(inv):
+    # due_date va en ISO para que las comparaciones y el orden de texto sean cronológicos
+    sub,taxv,total=personal_totals(inv)
+    return (inv.get("number",""), inv.get("status","pendiente"), inv.get("client_name",""),
+            inv.get("client_nit",""), iso_date(inv.get("due_date")), float(personal_number(inv.get("tax"),0,"IVA")),
+            sub, taxv, total)
+
+def save_personal_items(iid, inv):
+    db_execute("DELETE FROM personal_invoice_items WHERE invoice_id=%s",(iid,))
+    rows=[]
     for i,it in enumerate(inv.get("items",[])):
-        bg=(.97,.98,1.) if i%2==0 else (1.,1.,1.)
-        c.setFillColorRGB(*bg); c.rect(40,ry-rh+4,w-80,rh,fill=1,stroke=0)
-        qty=float(it.get("qty",1)); uv=float(it.get("unit_value",0)); tot=qty*uv; sub+=tot
-        c.setFont("Helvetica",9); c.setFillColorRGB(.1,.12,.25)
-        c.drawString(55,ry-4,it.get("description","")[:65])
-        c.drawRightString(w/2+20,ry-4,str(int(qty) if qty==int(qty) else qty))
-        c.drawRightString(w/2+120,ry-4,f"${uv:,.0f}".replace(",","."))
-        c.drawRightString(w-50,ry-4,f"${tot:,.0f}".replace(",",".")); ry-=rh
-    tax=float(inv.get("tax",0)); taxv=sub*tax/100; total=sub+taxv
-    toty=ry-15; c.setFillColorRGB(.94,.96,1.0); c.rect(w/2+20,toty-50,w/2-60,65,fill=1,stroke=0)
-    c.setFont("Helvetica",10); c.setFillColorRGB(.3,.35,.5)
-    c.drawString(w/2+35,toty+5,"Subtotal:"); c.drawRightString(w-55,toty+5,f"${sub:,.0f}".replace(",","."))
-    if tax:
-        c.drawString(w/2+35,toty-13,f"IVA ({tax:.0f}%):"); c.drawRightString(w-55,toty-13,f"${taxv:,.0f}".replace(",","."))
-    c.setFillColorRGB(.05,.08,.18); c.rect(w/2+20,toty-50,w/2-60,22,fill=1,stroke=0)
-    c.setFont("Helvetica-Bold",12); c.setFillColorRGB(1,1,1)
-    c.drawString(w/2+35,toty-41,"TOTAL:"); c.drawRightString(w-55,toty-41,f"${total:,.0f}".replace(",","."))
-    notes=inv.get("notes","")
-    if notes:
-        c.setFont("Helvetica-Bold",9); c.setFillColorRGB(.3,.35,.5)
-        c.drawString(40,toty-70,"NOTAS:"); c.setFont("Helvetica",9)
-        c.drawString(40,toty-83,notes[:100])
-    c.setFillColorRGB(.05,.08,.18); c.rect(0,0,w,40,fill=1,stroke=0)
-    c.setFont("Helvetica",8); c.setFillColorRGB(.5,.6,.8)
-    c.drawCentredString(w/2,25,"Generado con Facturador FL · "+datetime.now().strftime("%d/%m/%Y %H:%M"))
-    c.save(); return path
-
-def generate_personal_docx(inv):
-    num=inv["number"]; doc=Document()
-    for s in doc.sections:
-        s.top_margin=Cm(2);s.bottom_margin=Cm(2);s.left_margin=Cm(2.5);s.right_margin=Cm(2.5)
-    hdr=doc.add_paragraph(); hdr.alignment=WD_ALIGN_PARAGRAPH.LEFT
-    r=hdr.add_run(inv.get("issuer_name","").upper()+"\n"); r.bold=True; r.font.size=Pt(18); r.font.color.rgb=RGBColor(13,20,46)
-    r2=hdr.add_run(f"{inv.get('issuer_email','')}  |  {inv.get('issuer_phone','')}\n{inv.get('issuer_address','')}\n")
-    r2.font.size=Pt(9); r2.font.color.rgb=RGBColor(100,120,160)
-    pt=doc.add_paragraph(); pt.alignment=WD_ALIGN_PARAGRAPH.RIGHT
-    rt=pt.add_run(f"FACTURA N° {num}"); rt.bold=True; rt.font.size=Pt(22); rt.font.color.rgb=RGBColor(13,20,46)
-    doc.add_paragraph(f"Fecha: {inv.get('date','')}  |  Vence: {inv.get('due_date','')}")
-    doc.add_paragraph(); doc.add_paragraph("FACTURADO A:").runs[0].bold=True
-    doc.add_paragraph(f"{inv.get('client_name','')}  –  {inv.get('client_company','')}")
-    doc.add_paragraph(f"NIT/CC: {inv.get('client_nit','')}  |  Email: {inv.get('client_email','')}"); doc.add_paragraph()
-    tbl=doc.add_table(rows=1,cols=4); tbl.style='Light List Accent 1'
-    hc=tbl.rows[0].cells; hc[0].text="DESCRIPCIÓN"; hc[1].text="CANT."; hc[2].text="V.UNITARIO"; hc[3].text="TOTAL"
-    sub=0
-    for it in inv.get("items",[]):
-        qty=float(it.get("qty",1)); uv=float(it.get("unit_value",0)); tot=qty*uv; sub+=tot
-        row=tbl.add_row().cells; row[0].text=it.get("description","")
-        row[1].text=str(int(qty) if qty==int(qty) else qty)
-        row[2].text=f"${uv:,.0f}".replace(",","."); row[3].text=f"${tot:,.0f}".replace(",",".")
-    doc.add_paragraph(); tax=float(inv.get("tax",0)); taxv=sub*tax/100; total=sub+taxv
-    tp=doc.add_paragraph(); tp.alignment=WD_ALIGN_PARAGRAPH.RIGHT
-    rt=tp.add_run(f"Subtotal: ${sub:,.0f}\n"+(f"IVA: ${taxv:,.0f}\n" if tax else "")+f"TOTAL: ${total:,.0f}")
-    rt.bold=True; rt.font.size=Pt(12)
-    if inv.get("notes"): doc.add_paragraph(); doc.add_paragraph(f"Notas: {inv['notes']}")
-    fn=TEMP_DIR/f"FacturaPersonal_{num}.docx"; doc.save(fn); return fn
+        qty=float(personal_number(it.get("qty"),1,"Cantidad"))
+        uv=float(personal_number(it.get("unit_value"),0,"Valor unitario"))
+        rows.append((iid,i,it.get("description",""),qty,uv,qty*uv))
+    for k in range(0,len(rows),DbDraftStore.BATCH):
+        chunk=rows[k:k+DbDraftStore.BATCH]
+        db_execute("INSERT INTO personal_invoice_items (invoice_id,position,description,qty,unit_value,total) VALUES "
+                   +",".join(["(%s,%s,%s,%s,%s,%s)"]*len(chunk)),[v for r in chunk for v in r])
+
+def save_personal_columns(iid, inv):
+    sets=",".join(f"{c}=%s" for c in PERSONAL_COLUMNS)
+    db_execute(f"UPDATE personal_invoices SET data_json=%s,{sets} WHERE id=%s",
+               (json.dumps(inv),*personal_columns(inv),iid))
+    save_personal_items(iid,inv)
+
+def backfill_personal_columns():
+    last=""
+    while True:
+        rows=rows_to_list(db_execute(
+            "SELECT id,data_json FROM personal_invoices WHERE id>%s ORDER BY id LIMIT 500",(last,),fetch="all"))
+        if not rows: break
+        for r in rows:
+            try: save_personal_columns(r["id"],json.loads(r["data_json"] or "{}"))
+            except (ValueError,TypeError) as e: print(f"⚠️  Factura {r['id']} sin normalizar: {e}")
+        last=rows[-1]["id"]
 
 # ── Endpoints personales ───────────────────────────────────────────────────────
 
+def personal_filters(args):
+    """Filtros opcionales: status, client (nombre o NIT), due_from, due_to (AAAA-MM-DD).
+    ValueError si una fecha no es AAAA-MM-DD."""
+    where,params="",[]
+    for f in ("due_from","due_to"):
+        if args.get(f): datetime.strptime(args[f],"%Y-%m-%d")
+    if args.get("status"): where+=" AND status=%s"; params.append(args["status"])
+    if args.get("client"):
+        where+=" AND (LOWER(client_name) LIKE %s OR client_nit LIKE %s)"
+        q=f"%{args['client'].lower()}%"; params+=[q,q]
+    if args.get("due_from"): where+=" AND due_date!='' AND due_date>=%s"; params.append(args["due_from"])
+    if args.get("due_to"):   where+=" AND due_date!='' AND due_date<=%s"; params.append(args["due_to"])
+    return where,params
+
 @app.route("/api/personal/invoices", methods=["GET"])
 @require_module("personal")
 def personal_list():
     uid=g.user["id"]
-    rows=rows_to_list(db_execute(
-        "SELECT id,data_json,created_at FROM personal_invoices WHERE owner=%s ORDER BY created_at DESC",
-        (uid,),fetch="all"
-    ))
+    try: limit,cursor=page_args()
+    except ValueError: return jsonify(error="Parámetros de paginación inválidos"),400
+    try: where,fparams=personal_filters(request.args)
+    except ValueError: return jsonify(error="Fecha inválida (AAAA-MM-DD)"),400
+    sql="SELECT id,data_json,created_at FROM personal_invoices WHERE owner=%s"+where; params=[uid,*fparams]
+    if cursor: sql+=" AND (created_at,id)<(%s,%s)"; params+=cursor
+    rows=rows_to_list(db_execute(sql+" ORDER BY created_at DESC,id DESC LIMIT %s",(*params,limit+1),fetch="all"))
+    rows,nxt=page_result(rows,limit,lambda r:[r["created_at"],r["id"]])
     invs=[json.loads(r["data_json"]) for r in rows]
-    return jsonify(invoices=invs)
+    return jsonify(invoices=invs,next_cursor=nxt,total=cached_count("personal_invoices",uid,where,fparams))
+
+@app.route("/api/personal/summary", methods=["GET"])
+@require_module("personal")
+def personal_summary():
+    """Totales por estado (y vencidas) calculados en SQL; admite los filtros de la lista."""
+    uid=g.user["id"]
+    try: where,params=personal_filters(request.args)
+    except ValueError: return jsonify(error="Fecha inválida (AAAA-MM-DD)"),400
+    rows=rows_to_list(db_execute(
+        "SELECT status,COUNT(*) AS count,COALESCE(SUM(subtotal),0) AS subtotal,COALESCE(SUM(tax),0) AS tax,"
+        "COALESCE(SUM(total),0) AS total FROM personal_invoices WHERE owner=%s"+where+" GROUP BY status",
+        (uid,*params),fetch="all"))
+    over=row_to_dict(db_execute(
+        "SELECT COUNT(*) AS count,COALESCE(SUM(total),0) AS total FROM personal_invoices WHERE owner=%s"+where+
+        " AND status!='pagada' AND due_date!='' AND due_date<%s",
+        (uid,*params,datetime.now().strftime("%Y-%m-%d")),fetch="one"))
+    return jsonify(by_status=rows,overdue=over,
+                   count=sum(r["count"] for r in rows),total=sum(r["total"] for r in rows))
 
 @app.route("/api/personal/invoices", methods=["POST"])
 @require_module("personal")
@@ -764,33 +2259,53 @@ def personal_create():
         "items":data.get("items",[]),"tax":data.get("tax",0),"notes":data.get("notes",""),
         "created":datetime.now().isoformat()
     }
-    db_execute(
-        "INSERT INTO personal_invoices (id,owner,data_json,created_at) VALUES (%s,%s,%s,%s)",
-        (inv["id"],uid,json.dumps(inv),datetime.now().isoformat())
-    )
+    try: clean_personal(inv)
+    except ValueError as e: return jsonify(error=str(e)),400
+    with db_transaction():   # factura, líneas, acumulados e índice: todo o nada
+        db_execute(
+            f"INSERT INTO personal_invoices (id,owner,data_json,created_at,{','.join(PERSONAL_COLUMNS)}) VALUES (%s,%s,%s,%s{',%s'*len(PERSONAL_COLUMNS)})",
+            (inv["id"],uid,json.dumps(inv),inv["created"],*personal_columns(inv))
+        )
+        save_personal_items(inv["id"],inv)
+        rollup_personal(uid,inv)
+        search_put(personal_entry(inv["id"],uid,inv["created"],inv))
+    invalidate_counts("personal_invoices",uid)
     return jsonify(inv),201
 
 @app.route("/api/personal/invoices/<iid>", methods=["PUT"])
 @require_module("personal")
 def personal_update(iid):
-    uid=g.user["id"]
-    row=row_to_dict(db_execute("SELECT * FROM personal_invoices WHERE id=%s AND owner=%s",(iid,uid),fetch="one"))
-    if not row: return jsonify(error="No encontrado"),404
-    inv=json.loads(row["data_json"])
-    data=request.get_json(force=True) or {}
-    for f in ["number","date","due_date","status","issuer_name","issuer_email","issuer_phone",
-              "issuer_address","client_name","client_company","client_nit","client_email","items","tax","notes"]:
-        if f in data: inv[f]=data[f]
-    db_execute("UPDATE personal_invoices SET data_json=%s WHERE id=%s",(json.dumps(inv),iid))
+    uid=g.user["id"]; data=request.get_json(force=True) or {}
+    # La fila queda bloqueada hasta el COMMIT: dos PUT simultáneos no restan los mismos valores antiguos
+    with db_transaction():
+        row=row_to_dict(db_execute("SELECT * FROM personal_invoices WHERE id=%s AND owner=%s"+FOR_UPDATE,(iid,uid),fetch="one"))
+        if not row: return jsonify(error="No encontrado"),404
+        inv=json.loads(row["data_json"]); discard_rendered("personal",inv)
+        old=dict(inv)
+        for f in ["number","date","due_date","status","issuer_name","issuer_email","issuer_phone",
+                  "issuer_address","client_name","client_company","client_nit","client_email","items","tax","notes"]:
+            if f in data: inv[f]=data[f]
+        try: clean_personal(inv)
+        except ValueError as e: return jsonify(error=str(e)),400
+        save_personal_columns(iid,inv)
+        unroll_personal(uid,old); rollup_personal(uid,inv)
+        search_put(personal_entry(iid,uid,row["created_at"],inv))
+    invalidate_counts("personal_invoices",uid)
     return jsonify(inv)
 
 @app.route("/api/personal/invoices/<iid>", methods=["DELETE"])
 @require_module("personal")
 def personal_delete(iid):
     uid=g.user["id"]
-    row=row_to_dict(db_execute("SELECT id FROM personal_invoices WHERE id=%s AND owner=%s",(iid,uid),fetch="one"))
-    if not row: return jsonify(error="No encontrado"),404
-    db_execute("DELETE FROM personal_invoices WHERE id=%s",(iid,))
+    with db_transaction():
+        row=row_to_dict(db_execute("SELECT id,data_json FROM personal_invoices WHERE id=%s AND owner=%s"+FOR_UPDATE,(iid,uid),fetch="one"))
+        if not row: return jsonify(error="No encontrado"),404
+        db_execute("DELETE FROM personal_invoices WHERE id=%s",(iid,))
+        db_execute("DELETE FROM personal_invoice_items WHERE invoice_id=%s",(iid,))
+        search_drop("personal",iid)
+        inv=json.loads(row["data_json"]); unroll_personal(uid,inv)
+    invalidate_counts("personal_invoices",uid)
+    discard_rendered("personal",inv)
     return "",204
 
 @app.route("/api/personal/invoices/<iid>/download/<fmt>", methods=["GET"])
@@ -800,49 +2315,665 @@ def personal_download(iid,fmt):
     row=row_to_dict(db_execute("SELECT * FROM personal_invoices WHERE id=%s AND owner=%s",(iid,uid),fetch="one"))
     if not row: return jsonify(error="No encontrado"),404
     inv=json.loads(row["data_json"])
-    path=generate_personal_docx(inv) if fmt=="word" else generate_personal_pdf(inv)
-    return send_file(path,as_attachment=True)
+    return send_cached("personal",inv,fmt)
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  TRABAJOS DE RENDERIZADO ASÍNCRONOS
+#
+#  POST /api/jobs                → encola {"kind","id","fmt"} y responde 202
+#  GET  /api/jobs/<jid>          → estado: pendiente | listo | error
+#  GET  /api/jobs/<jid>/result   → descarga el documento
+#
+#  El renderizado corre en un ProcessPoolExecutor (RENDER_WORKERS procesos;
+#  0 = un hilo) para no bloquear a los workers web. Los procesos no se crean
+#  con fork desde el worker, que ya tiene hilos (un fork con locks tomados
+#  puede bloquear al hijo): RENDER_START_METHOD=forkserver (por defecto donde
+#  existe) o spawn. Los hijos solo ejecutan funciones de documents.py, que se
+#  precarga en el forkserver; el pool se crea antes de arrancar los hilos
+#  (post_fork en gunicorn.conf.py, o antes de app.run). El estado vive en la tabla
+#  render_jobs y el resultado en TEMP_DIR/jobs, así que cualquier worker de la
+#  misma máquina puede responder al sondeo. Cola acotada por worker
+#  (RENDER_QUEUE_MAX → 503) y límite de trabajos simultáneos por usuario
+#  (RENDER_JOBS_PER_USER → 429). Los resultados caducan tras RENDER_JOB_TTL s.
+# ══════════════════════════════════════════════════════════════════════════════
+
+RENDER_WORKERS       = int(os.environ.get("RENDER_WORKERS", 2))
+RENDER_QUEUE_MAX     = int(os.environ.get("RENDER_QUEUE_MAX", 32))
+RENDER_JOBS_PER_USER = int(os.environ.get("RENDER_JOBS_PER_USER", 2))
+RENDER_JOB_TTL       = int(os.environ.get("RENDER_JOB_TTL", 900))
+RENDER_JOB_TIMEOUT   = int(os.environ.get("RENDER_JOB_TIMEOUT", 300))   # tras esto un pendiente deja de contar
+RENDER_START_METHOD  = os.environ.get("RENDER_START_METHOD",
+                                      "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+JOBS_DIR = TEMP_DIR / "jobs"
+
+_render_jobs = {"executor": None, "inflight": 0, "purged": 0.0}
+_render_jobs_lock = threading.Lock()
+
+def render_executor(reset=False):
+    with _render_jobs_lock:
+        ex = _render_jobs["executor"]
+        if ex is not None and reset:
+            ex.shutdown(wait=False, cancel_futures=True); ex = None
+        if ex is None and RENDER_WORKERS > 0:
+            ctx = multiprocessing.get_context(RENDER_START_METHOD)
+            if RENDER_START_METHOD == "forkserver": ctx.set_forkserver_preload(["documents"])
+            ex = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=ctx,
+                                     initializer=documents.load_render_libs)
+        elif ex is None:
+            ex = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+        _render_jobs["executor"] = ex
+        return ex
+
+def submit_render(fn, *args):
+    """Encola fn en el pool; si está roto (murió un hijo) lo recrea y reintenta una vez."""
+    try: return render_executor().submit(fn, *args)
+    except BrokenProcessPool: return render_executor(reset=True).submit(fn, *args)
+
+@atexit.register
+def _shutdown_render_executor():
+    ex = _render_jobs["executor"]
+    if ex is not None: ex.shutdown(wait=False, cancel_futures=True)
+
+def job_to_dict(job):
+    job = dict(job)
+    job["result_url"] = f"/api/jobs/{job['id']}/result" if job["status"]=="listo" else None
+    return job
+
+def purge_render_jobs():
+    """Elimina (como mucho una vez por minuto) trabajos y resultados caducados."""
+    now = time.time()
+    if now - _render_jobs["purged"] < 60: return
+    _render_jobs["purged"] = now
+    cutoff = (datetime.now() - timedelta(seconds=RENDER_JOB_TTL)).isoformat()
+    db_execute("DELETE FROM render_jobs WHERE created_at < %s", (cutoff,))
+    for f in JOBS_DIR.glob("*"):
+        try:
+            if now - f.stat().st_mtime > RENDER_JOB_TTL: f.unlink()
+        except OSError: pass
+
+def _finish_job(jid, key, data, error):
+    try:
+        if error is None:
+            JOBS_DIR.mkdir(parents=True, exist_ok=True)
+            if isinstance(data, str): os.replace(data, JOBS_DIR / jid)   # volcado a disco: se mueve, no se cachea
+            else:
+                tmp = JOBS_DIR / f".{jid}"
+                tmp.write_bytes(data); os.replace(tmp, JOBS_DIR / jid)
+                render_cache.put(key, data)
+        db_execute("UPDATE render_jobs SET status=%s,error=%s,finished_at=%s WHERE id=%s",
+                   ("listo" if error is None else "error", error or "", datetime.now().isoformat(), jid))
+    finally:
+        with _render_jobs_lock: _render_jobs["inflight"] -= 1
+
+def _on_job_done(jid, key, fut, labels=None):
+    if labels and METRICS_ENABLED:
+        metrics.observe("render_job_duration_seconds", time.perf_counter()-labels.pop("t0"), **labels)
+    try:
+        data, error = fut.result(), None
+    except Exception as e:
+        data, error = None, f"{type(e).__name__}: {e}"
+    _finish_job(jid, key, data, error)
+
+def submit_render_job(uid, kind, ref, payload, fmt):
+    purge_render_jobs()
+    since = (datetime.now() - timedelta(seconds=RENDER_JOB_TIMEOUT)).isoformat()
+    active = row_to_dict(db_execute(
+        "SELECT COUNT(*) AS n FROM render_jobs WHERE owner=%s AND status='pendiente' AND created_at>=%s",
+        (uid, since), fetch="one"))["n"]
+    if active >= RENDER_JOBS_PER_USER:
+        return jsonify(error="Demasiados trabajos en curso"), 429
+    with _render_jobs_lock:
+        if _render_jobs["inflight"] >= RENDER_QUEUE_MAX:
+            return jsonify(error="Servidor ocupado, reintenta en unos segundos"), 503, {"Retry-After": "5"}
+        _render_jobs["inflight"] += 1
+    jid = str(uuid.uuid4()); key = render_key(kind, payload, fmt)
+    job = {"id": jid, "owner": uid, "kind": kind, "ref": ref, "fmt": fmt, "status": "pendiente",
+           "error": "", "filename": document_filename(kind, payload, fmt),
+           "created_at": datetime.now().isoformat(), "finished_at": None}
+    try:
+        db_execute(
+            "INSERT INTO render_jobs (id,owner,kind,ref,fmt,status,filename,created_at) VALUES (%s,%s,%s,%s,%s,%s,%s,%s)",
+            (jid, uid, kind, ref, fmt, job["status"], job["filename"], job["created_at"]))
+        cached = render_cache.get(key)
+        if cached is not None:
+            _finish_job(jid, key, cached, None); job["status"] = "listo"
+        else:
+            fut = submit_render(documents.render_document, kind, payload, fmt)
+            labels = {"t0": time.perf_counter(), "kind": kind, "fmt": fmt}
+            fut.add_done_callback(lambda f: _on_job_done(jid, key, f, labels))
+    except Exception:
+        with _render_jobs_lock: _render_jobs["inflight"] -= 1
+        raise
+    return jsonify(job_to_dict(job)), 202, {"Location": f"/api/jobs/{jid}"}
+
+@app.route("/api/jobs", methods=["POST"])
+@require_auth
+def jobs_submit():
+    u=g.user; data=request.get_json(force=True) or {}
+    kind=data.get("kind",""); ref=str(data.get("id","")); fmt=data.get("fmt","pdf")
+    if kind not in ("medical","personal") or fmt not in ("pdf","word"):
+        return jsonify(error="Parámetros inválidos"),400
+    if not has_module(u,kind): return jsonify(error="Sin acceso a este módulo"),403
+    if kind=="medical":
+        row=row_to_dict(db_execute("SELECT * FROM medical_history WHERE id=%s AND owner=%s",(ref,u["id"]),fetch="one"))
+        if not row: return jsonify(error="No encontrado"),404
+        payload=medical_payload(row["invoice_number"],json.loads(row["patients_json"]),row["created_at"])
+    else:
+        row=row_to_dict(db_execute("SELECT data_json FROM personal_invoices WHERE id=%s AND owner=%s",(ref,u["id"]),fetch="one"))
+        if not row: return jsonify(error="No encontrado"),404
+        payload=json.loads(row["data_json"])
+    return submit_render_job(u["id"],kind,ref,payload,fmt)
+
+@app.route("/api/jobs/<jid>", methods=["GET"])
+@require_auth
+def jobs_status(jid):
+    job=row_to_dict(db_execute("SELECT * FROM render_jobs WHERE id=%s AND owner=%s",(jid,g.user["id"]),fetch="one"))
+    if not job: return jsonify(error="No encontrado"),404
+    return jsonify(job_to_dict(job))
+
+@app.route("/api/jobs/<jid>/result", methods=["GET"])
+@require_auth
+def jobs_result(jid):
+    job=row_to_dict(db_execute("SELECT * FROM render_jobs WHERE id=%s AND owner=%s",(jid,g.user["id"]),fetch="one"))
+    if not job: return jsonify(error="No encontrado"),404
+    if job["status"]!="listo": return jsonify(job_to_dict(job)),409
+    path=JOBS_DIR/jid
+    if not path.is_file(): return jsonify(error="Resultado caducado"),410
+    return send_file(path,as_attachment=True,download_name=job["filename"],
+                     mimetype=MIMETYPES[job["filename"].rsplit(".",1)[1]])
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  EXPORTACIÓN MASIVA (ZIP en streaming)
+#
+#  GET|POST /api/export/<medical|personal>?from=AAAA-MM-DD&to=AAAA-MM-DD
+#           &ids=a,b,c&fmt=pdf|word&manifest=csv|json
+#  Los documentos se renderizan en paralelo en el pool de render_executor()
+#  con una ventana acotada de trabajos, y cada entrada se escribe en el ZIP
+#  en cuanto termina: la memoria usada no depende del tamaño del archivo.
+#  Las filas se leen por páginas de EXPORT_PAGE (keyset sobre created_at, id),
+#  sin tope de facturas; una lista de ids admite hasta EXPORT_MAX_IDS (→ 400).
+#  Al final se añade un manifiesto con los totales.
+# ══════════════════════════════════════════════════════════════════════════════
+
+EXPORT_PAGE    = int(os.environ.get("EXPORT_PAGE", 200))
+EXPORT_MAX_IDS = int(os.environ.get("EXPORT_MAX_IDS", 1000))
+
+class ZipStream(io.RawIOBase):
+    """Destino no buscable para zipfile: acumula lo escrito hasta drain()."""
+    def __init__(self): self._chunks = []
+    def writable(self): return True
+    def write(self, b):
+        self._chunks.append(bytes(b)); return len(b)
+    def drain(self):
+        data = b"".join(self._chunks); self._chunks.clear(); return data
+
+EXPORT_SOURCES = {
+    "medical":  ("medical_history",   "id,invoice_number,created_at,patients_json"),
+    "personal": ("personal_invoices", "id,created_at,data_json"),
+}
+
+def export_query(kind, uid, params):
+    """(sql, args) de las facturas a exportar; ValueError con el mensaje si los filtros no son válidos."""
+    table, cols = EXPORT_SOURCES[kind]
+    sql, args = f"SELECT {cols} FROM {table} WHERE owner=%s", [uid]
+    ids = params.get("ids") or []
+    if isinstance(ids, str): ids = [i for i in ids.split(",") if i]
+    if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+        raise ValueError("ids debe ser una lista de identificadores")
+    if len(ids) > EXPORT_MAX_IDS: raise ValueError(f"Como máximo {EXPORT_MAX_IDS} ids por exportación")
+    if ids:
+        sql += " AND id IN (" + ",".join(["%s"]*len(ids)) + ")"; args += ids
+    try:
+        if params.get("from"):
+            start = datetime.strptime(params["from"], "%Y-%m-%d")
+            sql += " AND created_at>=%s"; args.append(start.strftime("%Y-%m-%d"))
+        if params.get("to"):
+            end = datetime.strptime(params["to"], "%Y-%m-%d") + timedelta(days=1)
+            sql += " AND created_at<%s"; args.append(end.strftime("%Y-%m-%d"))
+    except (TypeError, ValueError): raise ValueError("Fecha inválida (AAAA-MM-DD)")
+    return sql, args
+
+def export_rows(sql, args):
+    """Filas de export_query en orden (created_at, id), leídas por páginas de EXPORT_PAGE."""
+    last = []
+    while True:
+        page = sql + (" AND (created_at,id)>(%s,%s)" if last else "") + " ORDER BY created_at,id LIMIT %s"
+        rows = rows_to_list(db_execute(page, (*args, *last, EXPORT_PAGE), fetch="all"))
+        yield from rows
+        if len(rows) < EXPORT_PAGE: return
+        last = [rows[-1]["created_at"], rows[-1]["id"]]
+
+def export_payload(kind, row):
+    if kind=="medical":
+        return medical_payload(row["invoice_number"], json.loads(row["patients_json"]), row["created_at"])
+    return json.loads(row["data_json"])
+
+def manifest_entry(kind, payload, name):
+    if kind=="medical":
+        return {"archivo": name, "factura": payload["number"], "fecha": payload["created_at"][:10],
+                "pacientes": len(payload["patients"]), "total": sum(p["price"] for p in payload["patients"])}
+    sub, taxv, total = personal_totals(payload)
+    return {"archivo": name, "factura": payload.get("number",""), "fecha": payload.get("date",""),
+            "cliente": payload.get("client_name",""), "estado": payload.get("status",""),
+            "subtotal": round(sub,2), "iva": round(taxv,2), "total": round(total,2)}
+
+def render_manifest(entries, fmt, errors=()):
+    """errors: {"factura","error"} de las facturas que no se pudieron incluir en el ZIP."""
+    totals = {"facturas": len(entries), "total": round(sum(e["total"] for e in entries), 2), "errores": len(errors)}
+    if fmt=="json":
+        return "manifest.json", json.dumps({"facturas": entries, "errores": list(errors), "totales": totals},
+                                           ensure_ascii=False, indent=2)
+    out = io.StringIO()
+    fields = list(entries[0]) if entries else ["archivo","factura","fecha","total"]
+    if errors: fields.append("error")
+    w = csv.DictWriter(out, fieldnames=fields); w.writeheader(); w.writerows(entries)
+    w.writerows({"archivo": "ERROR", **e} for e in errors)
+    w.writerow({fields[0]: "TOTAL", "total": totals["total"]})
+    return "manifest.csv", out.getvalue()
+
+def export_zip(kind, rows, fmt, manifest_fmt):
+    """Un documento que falla (también tras reintentarlo fuera del pool) queda como
+    error en el manifiesto; el manifiesto se escribe y el ZIP se cierra siempre."""
+    stream = ZipStream(); zf = zipfile.ZipFile(stream, "w")
+    window = max(2, RENDER_WORKERS * 2); used = set(); entries = []; errors = []
+    pending, ready, it = {}, [], iter(rows)
+
+    def failed(number, e): errors.append({"factura": number, "error": f"{type(e).__name__}: {e}"})
+
+    def add(payload, data):
+        base = f"{payload['created_at'][:10] if kind=='medical' else payload.get('created','')[:10]}_{document_filename(kind, payload, fmt)}"
+        name, n = base, 1
+        while name in used: n += 1; name = f"{n}_{base}"
+        used.add(name)
+        info = zipfile.ZipInfo(name, time.localtime()[:6])
+        if isinstance(data, str):   # volcado a disco: se copia al ZIP por bloques, sin cargarlo entero
+            try:
+                info.file_size = os.path.getsize(data)
+                with open(data, "rb") as src, zf.open(info, "w") as dst:
+                    while chunk := src.read(1024 * 1024):
+                        dst.write(chunk); yield stream.drain()
+            finally: discard_spooled(data)
+        else:
+            zf.writestr(info, data, compress_type=zipfile.ZIP_STORED)
+        entries.append(manifest_entry(kind, payload, name))
+
+    def fill():
+        for row in it:
+            try: payload = export_payload(kind, row)
+            except (ValueError, TypeError) as e: failed(row.get("invoice_number") or row["id"], e); continue
+            key = render_key(kind, payload, fmt)
+            data = render_cache.get(key)
+            if data is not None: ready.append((payload, data)); return True
+            pending[submit_render(documents.render_document, kind, payload, fmt)] = (payload, key)
+            if len(pending) >= window: return True
+        return False
+
+    try:
+        more = True
+        while more or pending:
+            if more: more = fill()
+            if pending:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for fut in done:
+                    payload, key = pending.pop(fut)
+                    try: data = fut.result()
+                    except Exception:
+                        # p. ej. el pool se rompió: se reintenta en este hilo antes de darlo por perdido
+                        try: data = render_document(kind, payload, fmt)
+                        except Exception as e: failed(payload.get("number",""), e); continue
+                    if not isinstance(data, str): render_cache.put(key, data)
+                    ready.append((payload, data))
+            for payload, data in ready: yield from add(payload, data)
+            ready.clear()
+            yield stream.drain()
+    except Exception as e:
+        # fallo inesperado (BD, disco…): lo que ya está en el ZIP queda válido y el manifiesto lo indica
+        for fut, (payload, _) in pending.items(): fut.cancel(); failed(payload.get("number",""), e)
+        failed("", e)
+    name, text = render_manifest(entries, manifest_fmt, errors)
+    zf.writestr(name, text, compress_type=zipfile.ZIP_DEFLATED)
+    zf.close()
+    yield stream.drain()
+
+@app.route("/api/export/<kind>", methods=["GET","POST"])
+@require_auth
+def export_invoices(kind):
+    if kind not in EXPORT_SOURCES: return jsonify(error="No encontrado"),404
+    if not has_module(g.user,kind): return jsonify(error="Sin acceso a este módulo"),403
+    params=request.get_json(silent=True) or request.values.to_dict()
+    fmt=params.get("fmt","pdf"); manifest=params.get("manifest","csv")
+    if fmt not in ("pdf","word") or manifest not in ("csv","json"):
+        return jsonify(error="Parámetros inválidos"),400
+    try: sql,args=export_query(kind,g.user["id"],params)
+    except ValueError as e: return jsonify(error=str(e)),400
+    rows=export_rows(sql,args); first=next(rows,None)
+    if first is None: return jsonify(error="No hay facturas en ese rango"),404
+    rows=chain([first],rows)
+    name=f"Facturas_{kind}_{datetime.now():%Y%m%d%H%M%S}.zip"
+    return Response(stream_with_context(export_zip(kind,rows,fmt,manifest)), mimetype="application/zip",
+                    headers={"Content-Disposition": f"attachment; filename={name}"})
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  REPORTES DEL DASHBOARD
+#
+#  revenue_rollup guarda, por usuario/origen/mes/estado, el número de facturas,
+#  pacientes y el total; personal_due_rollup hace lo mismo por fecha de
+#  vencimiento para calcular lo vencido. Se actualizan con UPSERT en la misma
+#  transacción que la factura (medical_invoice, personal_create/update/delete),
+#  así que leer el dashboard cuesta O(periodos), no O(facturas). Si aun así se
+#  desajustan, POST /api/admin/rollups/rebuild los recalcula desde las facturas.
+# ══════════════════════════════════════════════════════════════════════════════
+
+def rollup_add(owner, source, period, status, count, patients, total):
+    db_execute(
+        "INSERT INTO revenue_rollup (owner,source,period,status,invoice_count,patient_count,total) VALUES (%s,%s,%s,%s,%s,%s,%s) "
+        "ON CONFLICT (owner,source,period,status) DO UPDATE SET "
+        "invoice_count=revenue_rollup.invoice_count+excluded.invoice_count, "
+        "patient_count=revenue_rollup.patient_count+excluded.patient_count, "
+        "total=revenue_rollup.total+excluded.total",
+        (owner, source, period, status, count, patients, total))
+
+def due_rollup_add(owner, due_date, status, count, total):
+    db_execute(
+        "INSERT INTO personal_due_rollup (owner,due_date,status,invoice_count,total) VALUES (%s,%s,%s,%s,%s) "
+        "ON CONFLICT (owner,due_date,status) DO UPDATE SET "
+        "invoice_count=personal_due_rollup.invoice_count+excluded.invoice_count, "
+        "total=personal_due_rollup.total+excluded.total",
+        (owner, due_date, status, count, total))
+
+def invoice_period(inv):
+    """AAAA-MM de la fecha de la factura (dd/mm/aaaa) o, si no es válida, de su creación."""
+    try: return datetime.strptime(inv.get("date",""), "%d/%m/%Y").strftime("%Y-%m")
+    except ValueError: return (inv.get("created") or datetime.now().isoformat())[:7]
+
+def rollup_medical(owner, created_at, patients):
+    rollup_add(owner, "medical", created_at[:7], "emitida", 1, len(patients), sum(p["price"] for p in patients))
+
+def rollup_personal(owner, inv, sign=1):
+    """Suma (sign=1) o resta (sign=-1) la contribución de una factura personal.
+    La factura debe venir de clean_personal: con importes no numéricos → ValueError antes de escribir."""
+    status = inv.get("status","pendiente"); total = personal_totals(inv)[2]
+    rollup_add(owner, "personal", invoice_period(inv), status, sign, 0, sign*total)
+    due = iso_date(inv.get("due_date"))   # en ISO, como la columna, para compararla con la fecha de hoy
+    if due: due_rollup_add(owner, due, status, sign, sign*total)
+
+def unroll_personal(owner, inv):
+    """Resta una factura ya guardada. Las anteriores a clean_personal con importes
+    inválidos nunca entraron al acumulado (backfill_rollups las omite)."""
+    try: rollup_personal(owner, inv, -1)
+    except ValueError: pass
+
+def backfill_rollups():
+    """Recalcula ambos acumulados desde las facturas, en una sola transacción."""
+    with db_transaction():
+        # PostgreSQL: las escrituras concurrentes esperan y suman su delta después del COMMIT
+        if DATABASE_URL: db_execute("LOCK TABLE revenue_rollup, personal_due_rollup IN EXCLUSIVE MODE")
+        db_execute("DELETE FROM revenue_rollup"); db_execute("DELETE FROM personal_due_rollup")
+        db_execute(
+            "INSERT INTO revenue_rollup (owner,source,period,status,invoice_count,patient_count,total) "
+            "SELECT owner,'medical',SUBSTR(created_at,1,7),'emitida',COUNT(*),SUM(patient_count),SUM(total) "
+            "FROM medical_history GROUP BY owner,SUBSTR(created_at,1,7)")
+        last=""
+        while True:
+            rows=rows_to_list(db_execute(
+                "SELECT id,owner,data_json FROM personal_invoices WHERE id>%s ORDER BY id LIMIT 500",(last,),fetch="all"))
+            if not rows: break
+            for r in rows:
+                try: rollup_personal(r["owner"],json.loads(r["data_json"] or "{}"))
+                except (ValueError,TypeError) as e: print(f"⚠️  Factura {r['id']} fuera del acumulado: {e}")
+            last=rows[-1]["id"]
+
+def months_back(n):
+    y,m=datetime.now().year,datetime.now().month
+    out=[]
+    for _ in range(n):
+        out.append(f"{y:04d}-{m:02d}"); m-=1
+        if not m: y,m=y-1,12
+    return out[::-1]
+
+@app.route("/api/reports/summary", methods=["GET"])
+@require_auth
+def reports_summary():
+    """Facturación por mes, facturas por estado, pacientes y vencido.
+    ?months=N (1-60) · ?scope=all (solo admin) agrega todos los usuarios."""
+    u=g.user
+    try: n=max(1,min(int(request.args.get("months",12)),60))
+    except ValueError: return jsonify(error="months inválido"),400
+    everyone=request.args.get("scope")=="all"
+    if everyone and u.get("role")!="admin": return jsonify(error="Solo administradores"),403
+    months=months_back(n)
+    who,params=("",()) if everyone else (" AND owner=%s",(u["id"],))
+    rev=rows_to_list(db_execute(
+        "SELECT period,source,SUM(invoice_count) AS invoices,SUM(patient_count) AS patients,SUM(total) AS total "
+        "FROM revenue_rollup WHERE period>=%s AND period<=%s"+who+" GROUP BY period,source HAVING SUM(invoice_count)!=0 ORDER BY period",
+        (months[0],months[-1],*params),fetch="all"))
+    by_status=rows_to_list(db_execute(
+        "SELECT status,SUM(invoice_count) AS count,SUM(total) AS total FROM revenue_rollup "
+        "WHERE source='personal'"+who+" GROUP BY status HAVING SUM(invoice_count)>0",params,fetch="all"))
+    medical=row_to_dict(db_execute(
+        "SELECT COALESCE(SUM(invoice_count),0) AS invoices,COALESCE(SUM(patient_count),0) AS patients,"
+        "COALESCE(SUM(total),0) AS total FROM revenue_rollup WHERE source='medical'"+who,params,fetch="one"))
+    overdue=row_to_dict(db_execute(
+        "SELECT COALESCE(SUM(invoice_count),0) AS count,COALESCE(SUM(total),0) AS total FROM personal_due_rollup "
+        "WHERE due_date<%s AND status!='pagada'"+who,(datetime.now().strftime("%Y-%m-%d"),*params),fetch="one"))
+    result=dict(months=months,revenue=rev,personal_by_status=by_status,medical=medical,overdue=overdue)
+    if everyone:
+        result["by_user"]=rows_to_list(db_execute(
+            "SELECT r.owner,u.name,u.username,SUM(r.invoice_count) AS invoices,SUM(r.total) AS total "
+            "FROM revenue_rollup r LEFT JOIN users u ON u.id=r.owner WHERE r.period>=%s AND r.period<=%s "
+            "GROUP BY r.owner,u.name,u.username ORDER BY SUM(r.total) DESC",(months[0],months[-1]),fetch="all"))
+    return jsonify(result)
+
+@app.route("/api/admin/rollups/rebuild", methods=["POST"])
+@require_admin
+def admin_rebuild_rollups():
+    """Recalcula los acumulados del dashboard desde medical_history y personal_invoices."""
+    t0=time.perf_counter()
+    backfill_rollups()
+    return jsonify(success=True,ms=round((time.perf_counter()-t0)*1000,1))
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  BÚSQUEDA
+#
+#  Un índice invertido por documento (factura médica, factura personal o
+#  tarea): FTS5 en SQLite y tsvector + GIN en PostgreSQL. "head" lleva lo que
+#  identifica al documento (número, cliente, NIT, título) y pesa más en el
+#  ranking que "body" (pacientes, líneas, descripción). Se mantiene en cada
+#  escritura con search_put/search_drop; la migración 9 indexa lo existente.
+#  Cada palabra de la consulta se busca como prefijo y todas deben aparecer.
+# ══════════════════════════════════════════════════════════════════════════════
+
+SEARCH_KINDS     = {"medical": "medical", "personal": "personal", "task": "tasks"}   # tipo → módulo
+SEARCH_MAX_TERMS = int(os.environ.get("SEARCH_MAX_TERMS", 8))
+SEARCH_MARK      = ("\x02", "\x03")   # delimitadores del extracto; se convierten en <mark> tras escapar
+
+def fold(text):
+    """Minúsculas y sin tildes, para que 'gomez' encuentre 'Gómez' en ambos motores."""
+    text = unicodedata.normalize("NFKD", str(text or "").lower())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+def search_terms(q):
+    return re.findall(r"\w+", fold(q))[:SEARCH_MAX_TERMS]
+
+def search_rowid(kind, ref):
+    # rowid estable por documento: reindexar o borrar no necesita buscar la fila
+    return int.from_bytes(hashlib.blake2b(f"{kind}:{ref}".encode(), digest_size=8).digest(), "big") >> 1
+
+def owner_token(owner): return "u" + re.sub(r"\W", "", owner)
+
+def medical_entry(hid, owner, number, created_at, patients):
+    return ("medical", hid, owner, created_at, number, f"{len(patients)} pacientes",
+            number, " · ".join(p.get("name","") for p in patients))
+
+def personal_entry(iid, owner, created_at, inv):
+    nit = inv.get("client_nit","") or ""
+    head = " ".join(filter(None, [inv.get("number",""), inv.get("client_name",""), inv.get("client_company",""),
+                                  nit, re.sub(r"\D", "", nit)]))   # el NIT también sin puntos ni guion
+    return ("personal", iid, owner, created_at, inv.get("number",""), inv.get("client_name",""),
+            head, " · ".join(it.get("description","") for it in inv.get("items",[])))
+
+def task_entry(task):
+    return ("task", task["id"], task["owner"], task.get("created_at") or "", task.get("title",""),
+            task.get("due_date") or task.get("category",""), task.get("title",""), task.get("description") or "")
+
+def search_put_many(entries):
+    """Inserta o reemplaza documentos del índice: (kind, ref, owner, created_at, title, subtitle, head, body)."""
+    for k in range(0, len(entries), DbDraftStore.BATCH):
+        chunk = entries[k:k+DbDraftStore.BATCH]
+        if DATABASE_URL:
+            db_execute(
+                "INSERT INTO search_index (kind,ref,owner,created_at,title,subtitle,head_terms,body_terms) VALUES "
+                + ",".join(["(%s,%s,%s,%s,%s,%s,%s,%s)"]*len(chunk))
+                + " ON CONFLICT (kind,ref) DO UPDATE SET owner=excluded.owner,created_at=excluded.created_at,"
+                  "title=excluded.title,subtitle=excluded.subtitle,head_terms=excluded.head_terms,body_terms=excluded.body_terms",
+                [v for e in chunk for v in (*e[:6], fold(e[6]), fold(e[7]))])
+        else:
+            db_execute(
+                "INSERT OR REPLACE INTO search_fts (rowid,kind,ref,owner,created_at,title,subtitle,owner_tok,head,body) VALUES "
+                + ",".join(["(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)"]*len(chunk)),
+                [v for e in chunk for v in (search_rowid(e[0], e[1]), *e[:6], owner_token(e[2]), e[6], e[7])])
+
+def search_put(entry): search_put_many([entry])
+
+def search_drop(kind, ref):
+    if DATABASE_URL: db_execute("DELETE FROM search_index WHERE kind=%s AND ref=%s", (kind, ref))
+    else: db_execute("DELETE FROM search_fts WHERE rowid=%s", (search_rowid(kind, ref),))
+
+def backfill_search():
+    for table, cols, entry in (
+        ("medical_history", "id,owner,invoice_number,created_at,patients_json",
+         lambda r: medical_entry(r["id"], r["owner"], r["invoice_number"], r["created_at"], json.loads(r["patients_json"] or "[]"))),
+        ("personal_invoices", "id,owner,created_at,data_json",
+         lambda r: personal_entry(r["id"], r["owner"], r["created_at"], json.loads(r["data_json"] or "{}"))),
+        ("tasks", "id,owner,title,description,due_date,category,created_at", task_entry),
+    ):
+        last = ""
+        while True:
+            rows = rows_to_list(db_execute(f"SELECT {cols} FROM {table} WHERE id>%s ORDER BY id LIMIT 500", (last,), fetch="all"))
+            if not rows: break
+            entries = []
+            for r in rows:
+                try: entries.append(entry(r))
+                except (ValueError, TypeError) as e: print(f"⚠️  {table} {r['id']} sin indexar: {e}")
+            search_put_many(entries); last = rows[-1]["id"]
+
+def search_query(owner, terms, kinds, limit, offset):
+    """Documentos del usuario que contienen todos los términos, del más relevante al menos."""
+    marks = ",".join(["%s"]*len(kinds))
+    if DATABASE_URL:
+        tsq = " & ".join(f"{t}:*" for t in terms)
+        return rows_to_list(db_execute(
+            "SELECT kind,ref AS id,title,subtitle,created_at,"
+            "ts_headline('simple',body_terms,q,%s) AS snippet,ts_rank_cd(tsv,q) AS score "
+            f"FROM search_index,to_tsquery('simple',%s) q WHERE owner=%s AND tsv@@q AND kind IN ({marks}) "
+            "ORDER BY score DESC,created_at DESC LIMIT %s OFFSET %s",
+            (f'StartSel="{SEARCH_MARK[0]}",StopSel="{SEARCH_MARK[1]}",MaxWords=18,MinWords=6', tsq, owner, *kinds, limit, offset),
+            fetch="all"))
+    match = f'owner_tok:{owner_token(owner)} AND {{head body}}:(' + " AND ".join(f'"{t}"*' for t in terms) + ")"
+    return rows_to_list(db_execute(
+        "SELECT kind,ref AS id,title,subtitle,created_at,"
+        "snippet(search_fts,8,%s,%s,'…',12) AS snippet,bm25(search_fts,0,0,0,0,0,0,0,10,1) AS score "
+        f"FROM search_fts WHERE search_fts MATCH %s AND kind IN ({marks}) "
+        "ORDER BY score,created_at DESC LIMIT %s OFFSET %s",
+        (*SEARCH_MARK, match, *kinds, limit, offset), fetch="all"))
+
+def snippet_html(text):
+    if SEARCH_MARK[0] not in (text or ""): return ""   # la coincidencia está en el título, no en el cuerpo
+    return html.escape(text).replace(SEARCH_MARK[0], "<mark>").replace(SEARCH_MARK[1], "</mark>")
+
+@app.route("/api/search", methods=["GET"])
+@require_auth
+def search():
+    """?q= palabras (prefijos) · ?kind=medical|personal|task · limit/cursor como en los listados.
+    Solo busca en los documentos propios y en los módulos a los que el usuario tiene acceso."""
+    u=g.user
+    terms=search_terms(request.args.get("q",""))
+    if not terms: return jsonify(error="Consulta vacía"),400
+    kinds=[k for k,mod in SEARCH_KINDS.items() if has_module(u,mod)]
+    if request.args.get("kind"):
+        if request.args["kind"] not in SEARCH_KINDS: return jsonify(error="kind inválido"),400
+        kinds=[k for k in kinds if k==request.args["kind"]]
+    try:
+        limit,cursor=page_args((int,)); offset=max(0,(cursor or [0])[0])
+    except ValueError: return jsonify(error="Parámetros de paginación inválidos"),400
+    if not kinds: return jsonify(results=[],next_cursor=None)
+    rows=search_query(u["id"],terms,kinds,limit+1,offset)
+    rows,nxt=page_result(rows,limit,lambda r:[offset+limit])
+    for r in rows: r["snippet"]=snippet_html(r["snippet"]); r.pop("score",None)
+    return jsonify(results=rows,next_cursor=nxt)
 
 # ══════════════════════════════════════════════════════════════════════════════
 #  API TAREAS
 # ══════════════════════════════════════════════════════════════════════════════
 
+def task_stats(uid):
+    """Contadores por estado para las tarjetas de tasks.html (cacheados)."""
+    today=datetime.now().strftime("%Y-%m-%d")
+    return {
+        "total":      cached_count("tasks",uid),
+        "pendiente":  cached_count("tasks",uid," AND status=%s",("pendiente",)),
+        "completada": cached_count("tasks",uid," AND status=%s",("completada",)),
+        "vencidas":   cached_count("tasks",uid," AND status!='completada' AND due_date!='' AND due_date<%s",(today,)),
+    }
+
 @app.route("/api/tasks", methods=["GET"])
 @require_module("tasks")
 def tasks_list():
     uid=g.user["id"]
     status_filter=request.args.get("status","")
-    if status_filter:
-        rows=rows_to_list(db_execute(
-            "SELECT * FROM tasks WHERE owner=%s AND status=%s ORDER BY due_date,created_at DESC",
-            (uid,status_filter),fetch="all"
-        ))
-    else:
-        rows=rows_to_list(db_execute(
-            "SELECT * FROM tasks WHERE owner=%s ORDER BY due_date,created_at DESC",
-            (uid,),fetch="all"
-        ))
-    return jsonify(tasks=rows)
+    try: limit,cursor=page_args((str,str,str))
+    except ValueError: return jsonify(error="Parámetros de paginación inválidos"),400
+    sql="SELECT * FROM tasks WHERE owner=%s"; params=[uid]
+    if status_filter: sql+=" AND status=%s"; params.append(status_filter)
+    if cursor:
+        # Orden mixto (due_date ASC, created_at DESC, id DESC): sin comparación de tuplas
+        due,created,tid=cursor
+        sql+=" AND (due_date>%s OR (due_date=%s AND (created_at<%s OR (created_at=%s AND id<%s))))"
+        params+=[due,due,created,created,tid]
+    rows=rows_to_list(db_execute(sql+" ORDER BY due_date,created_at DESC,id DESC LIMIT %s",(*params,limit+1),fetch="all"))
+    rows,nxt=page_result(rows,limit,lambda r:[r["due_date"],r["created_at"],r["id"]])
+    total=cached_count("tasks",uid," AND status=%s",(status_filter,)) if status_filter else cached_count("tasks",uid)
+    return jsonify(tasks=rows,next_cursor=nxt,total=total,stats=task_stats(uid))
+
+TASK_FIELDS = ("title","description","due_date","priority","category","status","reminder")   # editables
+
+def new_task(uid, data):
+    """Tarea nueva a partir del cuerpo recibido; ValueError si falta el título."""
+    title=str(data.get("title","")).strip()
+    if not title: raise ValueError("Título requerido")
+    return {"id":str(uuid.uuid4()),"owner":uid,"title":title,
+            "description":data.get("description",""),"due_date":data.get("due_date",""),
+            "priority":data.get("priority","normal"),"category":data.get("category","general"),
+            "status":data.get("status","pendiente"),"reminder":data.get("reminder",""),
+            "created_at":datetime.now().isoformat()}
+
+def insert_tasks(tasks):
+    cols=("id","owner",*TASK_FIELDS,"created_at")
+    for k in range(0,len(tasks),DbDraftStore.BATCH):
+        chunk=tasks[k:k+DbDraftStore.BATCH]
+        db_execute(f"INSERT INTO tasks ({','.join(cols)}) VALUES "+",".join(["("+",".join(["%s"]*len(cols))+")"]*len(chunk)),
+                   [t[c] for t in chunk for c in cols])
+
+def save_task(task):
+    db_execute(f"UPDATE tasks SET {','.join(f'{c}=%s' for c in TASK_FIELDS)} WHERE id=%s",
+               (*(task[c] for c in TASK_FIELDS),task["id"]))
+
+def delete_tasks(uid, ids):
+    for k in range(0,len(ids),DbDraftStore.BATCH):
+        chunk=ids[k:k+DbDraftStore.BATCH]
+        db_execute(f"DELETE FROM tasks WHERE owner=%s AND id IN ({','.join(['%s']*len(chunk))})",(uid,*chunk))
+    for tid in ids: search_drop("task",tid)
 
 @app.route("/api/tasks", methods=["POST"])
 @require_module("tasks")
 def tasks_create():
     data=request.get_json(force=True) or {}; uid=g.user["id"]
-    title=data.get("title","").strip()
-    if not title: return jsonify(error="Título requerido"),400
-    tid=str(uuid.uuid4())
-    db_execute(
-        "INSERT INTO tasks (id,owner,title,description,due_date,priority,category,status,reminder,created_at) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)",
-        (tid,uid,title,
-         data.get("description",""),
-         data.get("due_date",""),
-         data.get("priority","normal"),
-         data.get("category","general"),
-         data.get("status","pendiente"),
-         data.get("reminder",""),
-         datetime.now().isoformat())
-    )
-    task=row_to_dict(db_execute("SELECT * FROM tasks WHERE id=%s",(tid,),fetch="one"))
+    try: task=new_task(uid,data)
+    except ValueError as e: return jsonify(error=str(e)),400
+    insert_tasks([task])
+    invalidate_counts("tasks",uid); reminder_hub.changed(uid)
+    task=row_to_dict(db_execute("SELECT * FROM tasks WHERE id=%s",(task["id"],),fetch="one"))
+    search_put(task_entry(task))
     return jsonify(task),201
 
 @app.route("/api/tasks/<tid>", methods=["PUT"])
@@ -852,18 +2983,11 @@ def tasks_update(tid):
     task=row_to_dict(db_execute("SELECT * FROM tasks WHERE id=%s AND owner=%s",(tid,uid),fetch="one"))
     if not task: return jsonify(error="No encontrado"),404
     data=request.get_json(force=True) or {}
-    title      =data.get("title",      task["title"])
-    description=data.get("description",task["description"])
-    due_date   =data.get("due_date",   task["due_date"])
-    priority   =data.get("priority",   task["priority"])
-    category   =data.get("category",   task["category"])
-    status     =data.get("status",     task["status"])
-    reminder   =data.get("reminder",   task["reminder"])
-    db_execute(
-        "UPDATE tasks SET title=%s,description=%s,due_date=%s,priority=%s,category=%s,status=%s,reminder=%s WHERE id=%s",
-        (title,description,due_date,priority,category,status,reminder,tid)
-    )
+    task.update((f,data[f]) for f in TASK_FIELDS if f in data)
+    save_task(task)
+    invalidate_counts("tasks",uid); reminder_hub.changed(uid)
     task=row_to_dict(db_execute("SELECT * FROM tasks WHERE id=%s",(tid,),fetch="one"))
+    search_put(task_entry(task))
     return jsonify(task)
 
 @app.route("/api/tasks/<tid>", methods=["DELETE"])
@@ -872,7 +2996,8 @@ def tasks_delete(tid):
     uid=g.user["id"]
     task=row_to_dict(db_execute("SELECT id FROM tasks WHERE id=%s AND owner=%s",(tid,uid),fetch="one"))
     if not task: return jsonify(error="No encontrado"),404
-    db_execute("DELETE FROM tasks WHERE id=%s",(tid,))
+    delete_tasks(uid,[tid])
+    invalidate_counts("tasks",uid); reminder_hub.changed(uid)
     return "",204
 
 @app.route("/api/tasks/<tid>/complete", methods=["POST"])
@@ -883,60 +3008,398 @@ def tasks_complete(tid):
     if not task: return jsonify(error="No encontrado"),404
     new_status="completada" if task["status"]!="completada" else "pendiente"
     db_execute("UPDATE tasks SET status=%s WHERE id=%s",(new_status,tid))
+    invalidate_counts("tasks",uid); reminder_hub.changed(uid)
     return jsonify(status=new_status)
 
-@app.route("/api/tasks/reminders", methods=["GET"])
+@app.route("/api/tasks/batch", methods=["POST"])
 @require_module("tasks")
-def tasks_reminders():
-    """Tareas con recordatorio en las próximas 24h o vencidas"""
+def tasks_batch():
+    """Lote de tareas (ver batch_ops): create {campos} · update {id, campos} · delete {id} ·
+    complete {id, done?}: done=true (por defecto) la completa y false la reabre."""
     uid=g.user["id"]
-    now=datetime.now()
-    tomorrow=(now+timedelta(hours=24)).strftime("%Y-%m-%d")
-    today=now.strftime("%Y-%m-%d")
+    try: ops,atomic=batch_ops(("create","update","delete","complete"),str)
+    except ValueError as e: return jsonify(error=str(e)),400
+    ids=list({op["id"] for op in ops if isinstance(op.get("id"),str)})
+    with db_transaction():
+        known={}
+        for k in range(0,len(ids),DbDraftStore.BATCH):
+            chunk=ids[k:k+DbDraftStore.BATCH]
+            known.update((t["id"],t) for t in rows_to_list(db_execute(
+                f"SELECT * FROM tasks WHERE owner=%s AND id IN ({','.join(['%s']*len(chunk))})",(uid,*chunk),fetch="all")))
+        results,created,changed,deleted=[],[],{},[]
+        for i,op in enumerate(ops):
+            if op["op"]=="create":
+                try: task=new_task(uid,op)
+                except ValueError as e: results.append({"index":i,"status":400,"error":str(e)}); continue
+                created.append(task); results.append({"index":i,"status":201,"task":task}); continue
+            task=known.get(op.get("id"))
+            if not task: results.append({"index":i,"status":404,"error":"No encontrado"}); continue
+            if op["op"]=="delete":
+                del known[task["id"]]; changed.pop(task["id"],None); deleted.append(task["id"])
+                results.append({"index":i,"status":204}); continue
+            if op["op"]=="update": task.update((f,op[f]) for f in TASK_FIELDS if f in op)
+            else: task["status"]="completada" if op.get("done",True) else "pendiente"
+            changed[task["id"]]=task; results.append({"index":i,"status":200,"task":dict(task)})
+        if not (atomic and any(r["status"]>=400 for r in results)):
+            insert_tasks(created); delete_tasks(uid,deleted)
+            for task in changed.values(): save_task(task)
+            search_put_many([task_entry(t) for t in (*created,*changed.values())])
+    if created or changed or deleted:
+        invalidate_counts("tasks",uid); reminder_hub.changed(uid)
+    return batch_result(results,atomic)
+
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}$")
+
+def reminders_for(uid, now=None):
+    """Tareas pendientes que vencen mañana, hoy o ya vencieron (fechas ISO: se comparan como texto)."""
+    now=now or datetime.now()
+    today=now.strftime("%Y-%m-%d"); tomorrow=(now+timedelta(days=1)).strftime("%Y-%m-%d")
     rows=rows_to_list(db_execute(
         "SELECT * FROM tasks WHERE owner=%s AND status!='completada' AND due_date!='' AND due_date<=%s ORDER BY due_date",
         (uid,tomorrow),fetch="all"
     ))
     reminders=[]
     for t in rows:
-        due=t.get("due_date","")
-        if due:
-            try:
-                due_dt=datetime.strptime(due,"%Y-%m-%d")
-                overdue=due_dt.date()<now.date()
-                due_today=due_dt.date()==now.date()
-                due_tomorrow=due_dt.date()==(now+timedelta(days=1)).date()
-                t["alert_type"]="vencida" if overdue else ("hoy" if due_today else "mañana")
-                reminders.append(t)
-            except: pass
-    return jsonify(reminders=reminders)
+        due=t["due_date"]
+        if not ISO_DATE.match(due): continue
+        t["alert_type"]="vencida" if due<today else ("hoy" if due==today else "mañana")
+        reminders.append(t)
+    return reminders
+
+@app.route("/api/tasks/reminders", methods=["GET"])
+@require_module("tasks")
+def tasks_reminders():
+    """Tareas con recordatorio en las próximas 24h o vencidas"""
+    return jsonify(reminders=reminders_for(g.user["id"]))
+
+# ─── Recordatorios por push (Server-Sent Events) ──────────────────────────────
+#  GET /api/tasks/stream?ticket=… mantiene abierta una conexión por pestaña. Un
+#  hilo planificador por proceso sabe, para cada usuario conectado, cuándo
+#  cambia su ventana de avisos (la medianoche anterior al vencimiento más
+#  próximo) y solo entonces, o cuando cambian sus tareas, recalcula y envía el
+#  evento "reminders" si el contenido es distinto. Los cambios hechos en otro
+#  worker llegan por cache_versions ("tasks:<uid>"), consultada cada
+#  REMINDER_SYNC_SECS solo si hay conexiones. Una pestaña inactiva no genera
+#  consultas; cada conexión ocupa un hilo del worker, de ahí el tope
+#  REMINDER_STREAMS_MAX (al superarlo → 503 y el cliente vuelve al sondeo).
+#  EventSource no admite cabeceras y el token de sesión no debe acabar en los
+#  logs de acceso: el cliente canjea antes su token por un vale de un solo uso
+#  (POST /api/tasks/stream-ticket, válido STREAM_TICKET_SECS). En cada latido
+#  se vuelven a comprobar sesión, usuario activo y módulo, como en cualquier
+#  petición; si fallan se envía "logout" y se cierra la conexión.
+
+REMINDER_STREAMS_MAX = int(os.environ.get("REMINDER_STREAMS_MAX", 8))
+REMINDER_SYNC_SECS   = float(os.environ.get("REMINDER_SYNC_SECS", 5))
+REMINDER_HEARTBEAT   = float(os.environ.get("REMINDER_HEARTBEAT", 25))
+STREAM_TICKET_SECS   = int(os.environ.get("STREAM_TICKET_SECS", 60))
+
+def reminders_digest(reminders):
+    return hashlib.sha1(json.dumps(reminders, sort_keys=True, default=str).encode()).hexdigest()
+
+def next_reminder_change(uid, now=None):
+    """Próximo instante en que la ventana mañana/hoy/vencida de uid cambia sola."""
+    now=now or datetime.now(); today=now.date()
+    row=row_to_dict(db_execute(
+        "SELECT MIN(due_date) AS d FROM tasks WHERE owner=%s AND status!='completada' AND due_date>=%s",
+        (uid,today.isoformat()),fetch="one"))
+    try: due=datetime.strptime(row["d"],"%Y-%m-%d").date() if row and row["d"] else None
+    except ValueError: due=None
+    if due is None: return None
+    midnight=datetime.combine(today+timedelta(days=1),datetime.min.time())
+    return max(midnight, datetime.combine(due-timedelta(days=1),datetime.min.time()))
+
+class ReminderHub:
+    def __init__(self):
+        self._lock  = threading.Lock()
+        self._wake  = threading.Event()
+        self._subs  = {}    # uid → set(queue.Queue)
+        self._state = {}    # uid → {"digest", "next_at", "version", "dirty"}
+        self._pid   = None
+        self._thread= None
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid() and self._thread.is_alive(): return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="reminder-hub", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, uid, digest):
+        with self._lock:
+            if sum(len(qs) for qs in self._subs.values()) >= REMINDER_STREAMS_MAX: return None
+            self._ensure_thread()
+            q = queue.Queue(maxsize=8)
+            self._subs.setdefault(uid, set()).add(q)
+            st = self._state.setdefault(uid, {"digest": digest, "version": None})
+            st["dirty"] = True   # calcula next_at y la versión de partida
+        self._wake.set()
+        return q
+
+    def unsubscribe(self, uid, q):
+        with self._lock:
+            qs = self._subs.get(uid, set()); qs.discard(q)
+            if not qs: self._subs.pop(uid, None); self._state.pop(uid, None)
+
+    def changed(self, uid):
+        """Las tareas de uid cambiaron: aviso local inmediato y a los demás workers."""
+        db_execute("INSERT INTO cache_versions (name,version) VALUES (%s,1) "
+                   "ON CONFLICT (name) DO UPDATE SET version=cache_versions.version+1", (f"tasks:{uid}",))
+        with self._lock:
+            if uid in self._state: self._state[uid]["dirty"] = True; self._wake.set()
+
+    def _versions(self, uids):
+        out = {}
+        for k in range(0, len(uids), 500):
+            names = [f"tasks:{u}" for u in uids[k:k+500]]
+            rows = db_execute("SELECT name,version FROM cache_versions WHERE name IN ("
+                              + ",".join(["%s"]*len(names)) + ")", names, fetch="all") or []
+            out.update({r["name"][6:]: r["version"] for r in rows})
+        return out
+
+    def _publish(self, uid, reminders):
+        msg = f"event: reminders\ndata: {json.dumps({'reminders': reminders}, default=str)}\n\n"
+        with self._lock: qs = list(self._subs.get(uid, ()))
+        for q in qs:
+            try: q.put_nowait(msg)
+            except queue.Full: pass   # cliente atascado: recibirá el siguiente
+
+    def _tick(self):
+        with self._lock: uids = list(self._subs)
+        if not uids: return None
+        versions, now = self._versions(uids), datetime.now()
+        for uid in uids:
+            with self._lock: st = self._state.get(uid)
+            if st is None: continue
+            version = versions.get(uid, 0)
+            due = st.get("dirty") or version != st["version"] or (st.get("next_at") and now >= st["next_at"])
+            if not due: continue
+            st["dirty"], st["version"] = False, version
+            reminders = reminders_for(uid, now); digest = reminders_digest(reminders)
+            if digest != st["digest"]: st["digest"] = digest; self._publish(uid, reminders)
+            st["next_at"] = next_reminder_change(uid, now)
+        pending = [st["next_at"] for st in list(self._state.values()) if st.get("next_at")]
+        wait = REMINDER_SYNC_SECS
+        if pending: wait = min(wait, max(0.0, (min(pending) - datetime.now()).total_seconds()))
+        return wait
+
+    def _run(self):
+        wait = None
+        while True:
+            self._wake.wait(wait); self._wake.clear()
+            try: wait = self._tick()
+            except Exception as e:
+                print(f"⚠️  Planificador de recordatorios: {e}"); wait = REMINDER_SYNC_SECS
+
+reminder_hub = ReminderHub()
+
+@app.route("/api/tasks/stream-ticket", methods=["POST"])
+@require_module("tasks")
+def tasks_stream_ticket():
+    ticket = secrets.token_urlsafe(24)
+    token  = request.headers.get("Authorization","").replace("Bearer ","")
+    expires = (datetime.now() + timedelta(seconds=STREAM_TICKET_SECS)).isoformat()
+    db_execute("INSERT INTO stream_tickets (ticket,token,expires) VALUES (%s,%s,%s)", (ticket, token, expires))
+    return jsonify(ticket=ticket, expires_in=STREAM_TICKET_SECS)
+
+def redeem_stream_ticket(ticket):
+    """Token de sesión del vale (que se gasta), o "" si no existe o caducó."""
+    row = row_to_dict(db_execute("SELECT token,expires FROM stream_tickets WHERE ticket=%s", (ticket,), fetch="one"))
+    if not row: return ""
+    db_execute("DELETE FROM stream_tickets WHERE ticket=%s", (ticket,))
+    return row["token"] if row["expires"] > datetime.now().isoformat() else ""
+
+@app.route("/api/tasks/stream", methods=["GET"])
+def tasks_stream():
+    token  = redeem_stream_ticket(request.args.get("ticket",""))
+    user   = get_session_user(token)
+    denied = check_access(user, "tasks")
+    if denied: return jsonify(error=denied[0]), denied[1]
+    uid = user["id"]; reminders = reminders_for(uid)
+    q = reminder_hub.subscribe(uid, reminders_digest(reminders))
+    if q is None: return jsonify(error="Demasiadas conexiones, usa /api/tasks/reminders"), 503
+
+    # Sin stream_with_context: la conexión a la BD de la petición se libera al
+    # volver la vista y el generador usa conexiones puntuales.
+    def events():
+        try:
+            yield f"retry: 5000\nevent: reminders\ndata: {json.dumps({'reminders': reminders}, default=str)}\n\n"
+            while True:
+                try: yield q.get(timeout=REMINDER_HEARTBEAT)
+                except queue.Empty:
+                    if check_access(get_session_user(token), "tasks"):
+                        yield "event: logout\ndata: {}\n\n"; return
+                    yield ": ping\n\n"
+        finally:
+            reminder_hub.unsubscribe(uid, q)
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # ══════════════════════════════════════════════════════════════════════════════
 #  RUTAS ESTÁTICAS
 # ══════════════════════════════════════════════════════════════════════════════
 
+#  Todo frontend/ se carga en memoria al arrancar: cada archivo con su
+#  variante gzip (y brotli si el paquete está instalado), un ETag fuerte por
+#  codificación y un nombre con huella (/assets/<nombre>.<hash>.<ext>). Las
+#  referencias a archivos locales dentro de los HTML se reescriben a la URL con
+#  huella, que se sirve con caché "immutable"; las páginas usan "no-cache" y
+#  responden 304 si el ETag coincide. Con STATIC_DEV=1 se recargan al cambiar.
+#  El CSS y el JS de cada página viven en frontend/css/<página>.css y
+#  frontend/js/<página>.js, no en línea, para que el navegador los conserve.
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DEV          = os.environ.get("STATIC_DEV", os.environ.get("FLASK_DEBUG", "0")) == "1"
+STATIC_COMPRESS_MIN = 512
+STATIC_COMPRESSIBLE = {".html", ".css", ".js", ".json", ".svg", ".txt", ".map"}
+CACHE_IMMUTABLE     = "public, max-age=31536000, immutable"
+
+class StaticAsset:
+    __slots__ = ("name", "hashed", "mimetype", "digest", "variants")
+
+    def __init__(self, name, data):
+        self.name     = name
+        self.digest   = hashlib.sha256(data).hexdigest()
+        stem, dot, ext = name.rpartition(".")
+        self.hashed   = f"{stem}.{self.digest[:12]}.{ext}" if dot else f"{name}.{self.digest[:12]}"
+        self.mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.variants = {"identity": data}
+        if Path(name).suffix in STATIC_COMPRESSIBLE and len(data) >= STATIC_COMPRESS_MIN:
+            gz = gzip.compress(data, 9, mtime=0)
+            if len(gz) < len(data): self.variants["gzip"] = gz
+            if brotli:
+                br = brotli.compress(data, quality=11)
+                if len(br) < len(data): self.variants["br"] = br
+
+    def etag(self, encoding):
+        return self.digest[:32] + ("" if encoding == "identity" else "-" + encoding)
+
+class StaticAssets:
+    def __init__(self, root):
+        self.root   = Path(root)
+        self.files  = {}     # nombre → StaticAsset
+        self.hashed = {}     # nombre con huella → StaticAsset
+        self._mtime = None
+        self._lock  = threading.Lock()
+
+    def _scan(self):
+        return {p.relative_to(self.root).as_posix(): p for p in sorted(self.root.rglob("*"))
+                if p.is_file() and not any(part.startswith(".") for part in p.relative_to(self.root).parts)}
+
+    def build(self):
+        paths = self._scan()
+        raw   = {name: p.read_bytes() for name, p in paths.items()}
+        files = {name: StaticAsset(name, data) for name, data in raw.items() if not name.endswith(".html")}
+        if files:
+            # "/app.js" o 'app.js' dentro de un HTML → "/assets/app.<hash>.js"
+            refs = re.compile(r'(["\'])/?(' + "|".join(re.escape(n) for n in sorted(files, key=len, reverse=True)) + r')\1')
+            link = lambda m: f'{m.group(1)}/assets/{files[m.group(2)].hashed}{m.group(1)}'
+        for name, data in raw.items():
+            if name.endswith(".html"):
+                if files: data = refs.sub(link, data.decode("utf-8")).encode("utf-8")
+                files[name] = StaticAsset(name, data)
+        self.files, self.hashed = files, {a.hashed: a for a in files.values()}
+        self._mtime = max((p.stat().st_mtime for p in paths.values()), default=0), len(paths)
+        return self
+
+    def _reload_if_changed(self):
+        paths = self._scan()
+        mtime = max((p.stat().st_mtime for p in paths.values()), default=0), len(paths)
+        if mtime != self._mtime:
+            with self._lock: self.build()
+
+    def url(self, name):
+        a = self.files.get(name)
+        return f"/assets/{a.hashed}" if a else f"/{name}"
+
+    def response(self, name, hashed=False):
+        if STATIC_DEV: self._reload_if_changed()
+        a = (self.hashed if hashed else self.files).get(name)
+        if a is None: abort(404)
+        cache = CACHE_IMMUTABLE if hashed and not STATIC_DEV else "no-cache"
+        accepted = request.accept_encodings
+        encoding = next((e for e in ("br", "gzip") if e in a.variants and accepted[e]), "identity")
+        if any(request.if_none_match.contains_weak(a.etag(e)) for e in a.variants):
+            resp = Response(status=304)
+        else:
+            resp = Response(a.variants[encoding], mimetype=a.mimetype)
+            if encoding != "identity": resp.headers["Content-Encoding"] = encoding
+        resp.set_etag(a.etag(encoding))
+        resp.headers["Cache-Control"] = cache
+        if len(a.variants) > 1: resp.headers["Vary"] = "Accept-Encoding"
+        return resp
+
+static_assets = StaticAssets(FRONT_DIR)
+if not MP_CHILD: static_assets.build()
+
+# El endpoint estático de Flask (/<archivo>) también sale de memoria
+app.view_functions["static"] = lambda filename: static_assets.response(filename)
+
+@app.route("/assets/<path:name>")
+def hashed_asset(name): return static_assets.response(name, hashed=True)
+
 @app.route("/")
-def home(): return send_from_directory(app.static_folder,"login.html")
+def home(): return static_assets.response("login.html")
 
 @app.route("/dashboard")
-def dashboard(): return send_from_directory(app.static_folder,"dashboard.html")
+def dashboard(): return static_assets.response("dashboard.html")
 
 @app.route("/medical")
-def medical(): return send_from_directory(app.static_folder,"index.html")
+def medical(): return static_assets.response("index.html")
 
 @app.route("/personal")
-def personal(): return send_from_directory(app.static_folder,"personal.html")
+def personal(): return static_assets.response("personal.html")
 
 @app.route("/admin")
-def admin_panel(): return send_from_directory(app.static_folder,"admin.html")
+def admin_panel(): return static_assets.response("admin.html")
 
 @app.route("/tasks")
-def tasks_page(): return send_from_directory(app.static_folder,"tasks.html")
+def tasks_page(): return static_assets.response("tasks.html")
 
 @app.route("/login-history")
-def login_history_page(): return send_from_directory(app.static_folder,"login-history.html")
+def login_history_page(): return static_assets.response("login-history.html")
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  ARRANQUE
+# ══════════════════════════════════════════════════════════════════════════════
+#  DB_INIT=auto  migra al importar el módulo (python app.py, desarrollo).
+#  DB_INIT=skip  no toca la BD al importar: la migración la hace el maestro de
+#                gunicorn (gunicorn.conf.py, preload_app) o `flask --app app init-db`.
+#  RENDER_PRELOAD=1 importa python-docx/reportlab y compila las plantillas DOCX
+#  al arrancar para que los workers las compartan copy-on-write; si no, se
+#  cargan en el primer render.
+
+DB_INIT        = os.environ.get("DB_INIT", "auto")
+RENDER_PRELOAD = os.environ.get("RENDER_PRELOAD", "0") == "1"
+BOOT_STATS     = {}
+
+def timed_init_db():
+    t0 = time.perf_counter(); init_db()
+    BOOT_STATS["db_init_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Aplica las migraciones pendientes y termina."""
+    timed_init_db()
+    print(f"✅ Esquema en versión {schema_version()} ({BOOT_STATS['db_init_ms']} ms)")
+
+@app.route("/api/health", methods=["GET"])
+def health():
+    return jsonify(status="ok", pid=os.getpid(), boot=BOOT_STATS)
+
+# Las migraciones pueden usar helpers de cualquier sección: se ejecutan al final
+if not MP_CHILD:
+    BOOT_STATS["import_ms"] = round((time.perf_counter() - BOOT_STARTED) * 1000, 1)
+    if DB_INIT == "auto": timed_init_db()
+    if RENDER_PRELOAD: BOOT_STATS["render_libs_ms"] = load_render_libs()
+    BOOT_STATS["total_ms"] = round((time.perf_counter() - BOOT_STARTED) * 1000, 1)
+    print(f"⏱️  Arranque en {BOOT_STATS['total_ms']} ms " + json.dumps(BOOT_STATS))
 
 if __name__ == "__main__":
     host=os.environ.get("HOST","0.0.0.0")
     port=int(os.environ.get("PORT",5000))
+    render_executor()   # el pool arranca antes que los hilos del servidor
     app.run(host=host,port=port,debug=True)
@@ -0,0 +1,67 @@
+"""Benchmarks reproducibles del backend (se ejecutan desde Backend/).
+
+    python -m bench.seed  --reset                 # carga datos sintéticos
+    python -m bench.load  --clients 16 --duration 30
+    python -m bench.micro                         # docx_invoice / generate_pdf
+    python -m bench.compare results/A.json results/B.json
+
+Por defecto todo corre sin red contra SQLite en bench/data/bench.db, sin tocar
+la BD real. Con BENCH_DATABASE_URL se usa ese PostgreSQL (solo uno local y
+desechable: seed --reset vacía las tablas). Cada ejecución guarda un JSON en
+bench/results/ con el commit, la semilla y los parámetros, para comparar
+resultados entre commits con la misma carga.
+"""
+import json, os, platform, subprocess, sys, time
+from pathlib import Path
+
+BENCH_DIR   = Path(__file__).parent
+BACKEND_DIR = BENCH_DIR.parent
+DATA_DIR    = BENCH_DIR / "data"
+RESULTS_DIR = BENCH_DIR / "results"
+DB_PATH     = DATA_DIR / "bench.db"
+PASSWORD    = "bench"
+
+def bench_env():
+    """Variables de entorno para importar app.py contra la BD de benchmarks."""
+    env = {"DB_INIT": "auto", "SQLITE_PATH": str(DB_PATH), "METRICS_ENABLED": "0"}
+    pg = os.environ.get("BENCH_DATABASE_URL", "")
+    if pg: env["DATABASE_URL"] = pg
+    return env
+
+def load_app():
+    DATA_DIR.mkdir(exist_ok=True)
+    if not os.environ.get("BENCH_DATABASE_URL"): os.environ.pop("DATABASE_URL", None)
+    os.environ.update(bench_env())
+    if str(BACKEND_DIR) not in sys.path: sys.path.insert(0, str(BACKEND_DIR))
+    import app
+    return app
+
+def backend_name():
+    return "postgresql" if os.environ.get("BENCH_DATABASE_URL") else "sqlite"
+
+def percentiles(samples):
+    """p50/p95/p99 por rango más cercano, en milisegundos."""
+    if not samples: return {"n": 0}
+    xs = sorted(samples); n = len(xs)
+    pick = lambda q: xs[min(n - 1, max(0, int(round(q * n + 0.5)) - 1))] * 1000
+    return {"n": n, "min": round(xs[0] * 1000, 3), "p50": round(pick(.50), 3), "p95": round(pick(.95), 3),
+            "p99": round(pick(.99), 3), "max": round(xs[-1] * 1000, 3), "mean": round(sum(xs) / n * 1000, 3)}
+
+def git_commit():
+    run = lambda *a: subprocess.run(["git", *a], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+    try:
+        commit = run("rev-parse", "--short", "HEAD") or "desconocido"
+        return commit + ("-dirty" if run("status", "--porcelain", "--", ".") else "")
+    except OSError:
+        return "desconocido"
+
+def save_results(kind, params, results):
+    RESULTS_DIR.mkdir(exist_ok=True)
+    commit = git_commit()
+    doc = {"kind": kind, "commit": commit, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+           "backend": backend_name(), "python": platform.python_version(),
+           "machine": f"{platform.system()} {platform.machine()} ({os.cpu_count()} cpu)",
+           "params": params, "results": results}
+    path = RESULTS_DIR / f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json"
+    path.write_text(json.dumps(doc, indent=2, ensure_ascii=False))
+    return path
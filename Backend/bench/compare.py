@@ -0,0 +1,32 @@
+"""Compara dos resultados de bench.load o bench.micro (p. ej. de dos commits).
+
+    python -m bench.compare bench/results/load-…-abc123.json bench/results/load-…-def456.json
+
+Muestra cada métrica de la base, la nueva y la variación relativa; avisa si
+los parámetros, el backend o la máquina no coinciden.
+"""
+import argparse, json
+from pathlib import Path
+
+METRICS = {"load": ("p50", "p95", "p99", "rps"), "micro": ("median_ms", "min_ms")}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("base"); ap.add_argument("new")
+    args = ap.parse_args()
+    a, b = (json.loads(Path(p).read_text()) for p in (args.base, args.new))
+    if a["kind"] != b["kind"]: raise SystemExit("Los resultados son de tipos distintos")
+    for key in ("params", "backend", "machine"):
+        if a[key] != b[key]: print(f"⚠️  {key} distinto: {a[key]} ≠ {b[key]}")
+    print(f"base {a['commit']} ({a['created']})  →  nuevo {b['commit']} ({b['created']})")
+    print(f"{'caso':<26}{'métrica':>10}{'base':>12}{'nuevo':>12}{'Δ':>9}")
+    for case, ra in a["results"].items():
+        rb = b["results"].get(case)
+        if rb is None: continue
+        for m in METRICS[a["kind"]]:
+            if m not in ra or m not in rb: continue
+            delta = (rb[m] - ra[m]) / ra[m] * 100 if ra[m] else 0.0
+            print(f"{case:<26}{m:>10}{ra[m]:>12}{rb[m]:>12}{delta:>+8.1f}%")
+
+if __name__ == "__main__":
+    main()
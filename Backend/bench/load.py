@@ -0,0 +1,130 @@
+"""Prueba de carga contra los endpoints reales.
+
+Cada cliente (un hilo con conexión keep-alive) inicia sesión como uno de los
+--pool primeros usuarios sembrados (los de historial más largo) y repite una
+mezcla ponderada de peticiones durante --duration segundos, tras --warmup
+segundos que no cuentan. Informa p50/p95/p99 y rendimiento por endpoint.
+Sin --url arranca bench.serve en un subproceso contra la BD de benchmarks.
+"""
+import argparse, http.client, json, os, random, subprocess, sys, threading, time
+from urllib.parse import urlsplit
+
+from bench import BACKEND_DIR, PASSWORD, bench_env, percentiles, save_results
+
+# (etiqueta, peso): la mezcla se mantiene estable para comparar entre commits
+MIX = [("login", 5), ("me", 30), ("tasks_list", 20), ("tasks_reminders", 15),
+       ("personal_list", 15), ("medical_download", 8), ("personal_download", 7)]
+
+class Client:
+    def __init__(self, base, username):
+        u = urlsplit(base)
+        self.conn = http.client.HTTPConnection(u.hostname, u.port or 80, timeout=60)
+        self.username, self.token = username, ""
+        self.medical_ids, self.personal_ids = [], []
+
+    def call(self, method, path, body=None):
+        headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+        if body is not None: headers["Content-Type"] = "application/json"; body = json.dumps(body)
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            resp = self.conn.getresponse(); data = resp.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close(); return 599, b""
+        return resp.status, data
+
+    def login(self):
+        status, data = self.call("POST", "/api/auth/login", {"username": self.username, "password": PASSWORD})
+        if status == 200: self.token = json.loads(data)["token"]
+        return status
+
+    def prepare(self):
+        if self.login() != 200: raise SystemExit(f"No se pudo iniciar sesión como {self.username}: ¿falta bench.seed?")
+        _, data = self.call("GET", "/api/medical/history?limit=50")
+        self.medical_ids = [h["id"] for h in json.loads(data or b"{}").get("history", [])]
+        _, data = self.call("GET", "/api/personal/invoices?limit=50")
+        self.personal_ids = [i["id"] for i in json.loads(data or b"{}").get("invoices", [])]
+
+    def step(self, rng, label):
+        if label == "login": return self.login()
+        if label == "me": return self.call("GET", "/api/auth/me")[0]
+        if label == "tasks_list": return self.call("GET", "/api/tasks")[0]
+        if label == "tasks_reminders": return self.call("GET", "/api/tasks/reminders")[0]
+        if label == "personal_list": return self.call("GET", "/api/personal/invoices")[0]
+        ids = self.medical_ids if label == "medical_download" else self.personal_ids
+        if not ids: return None
+        kind = "medical/history" if label == "medical_download" else "personal/invoices"
+        return self.call("GET", f"/api/{kind}/{rng.choice(ids)}/download/{rng.choice(['pdf', 'word'])}")[0]
+
+def run(base, args):
+    labels, weights = zip(*MIX)
+    clients = [Client(base, f"bench{i % args.pool:04d}") for i in range(args.clients)]
+    for c in clients: c.prepare()
+    samples = {l: [] for l in labels}; errors = {l: 0 for l in labels}
+    lock, start = threading.Lock(), time.perf_counter()
+    measure_from, stop_at = start + args.warmup, start + args.warmup + args.duration
+
+    def worker(n, c):
+        rng, local = random.Random(args.seed + n), []
+        while True:
+            label = rng.choices(labels, weights)[0]
+            t0 = time.perf_counter()
+            if t0 >= stop_at: break
+            status = c.step(rng, label)
+            if status is None: continue
+            if t0 >= measure_from: local.append((label, time.perf_counter() - t0, status < 400))
+        with lock:
+            for label, dt, ok in local:
+                samples[label].append(dt)
+                if not ok: errors[label] += 1
+
+    threads = [threading.Thread(target=worker, args=(n, c)) for n, c in enumerate(clients)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    results = {}
+    for label in labels:
+        results[label] = {**percentiles(samples[label]), "errors": errors[label],
+                          "rps": round(len(samples[label]) / args.duration, 1)}
+    everything = [x for xs in samples.values() for x in xs]
+    results["total"] = {**percentiles(everything), "errors": sum(errors.values()),
+                        "rps": round(len(everything) / args.duration, 1)}
+    return results
+
+def wait_ready(base, proc, timeout=60):
+    u = urlsplit(base); deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc and proc.poll() is not None: raise SystemExit("El servidor de benchmark terminó al arrancar")
+        try:
+            conn = http.client.HTTPConnection(u.hostname, u.port, timeout=2)
+            conn.request("GET", "/api/health"); conn.getresponse().read(); return
+        except OSError: time.sleep(.2)
+    raise SystemExit("El servidor de benchmark no respondió")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--url", help="servidor ya arrancado (p. ej. gunicorn); por defecto se lanza bench.serve")
+    ap.add_argument("--port",     type=int, default=5099)
+    ap.add_argument("--clients",  type=int, default=16)
+    ap.add_argument("--pool",     type=int, default=50, help="usuarios distintos entre los clientes")
+    ap.add_argument("--duration", type=float, default=30)
+    ap.add_argument("--warmup",   type=float, default=5)
+    ap.add_argument("--seed",     type=int, default=42)
+    args = ap.parse_args()
+    base, proc = args.url, None
+    if not base:
+        base = f"http://127.0.0.1:{args.port}"
+        proc = subprocess.Popen([sys.executable, "-m", "bench.serve", str(args.port)], cwd=BACKEND_DIR,
+                                env={**os.environ, **bench_env()}, stdout=subprocess.DEVNULL)
+    try:
+        wait_ready(base, proc)
+        results = run(base, args)
+    finally:
+        if proc: proc.terminate(); proc.wait()
+    print(f"{'endpoint':<20}{'n':>8}{'rps':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'errores':>9}")
+    for label, r in results.items():
+        print(f"{label:<20}{r.get('n',0):>8}{r['rps']:>9}{r.get('p50',0):>10}{r.get('p95',0):>10}"
+              f"{r.get('p99',0):>10}{r['errors']:>9}")
+    params = {k: v for k, v in vars(args).items() if k != "port"}
+    print(f"📄 {save_results('load', {**params, 'mix': dict(MIX)}, results)}")
+
+if __name__ == "__main__":
+    main()
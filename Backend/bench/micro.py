@@ -0,0 +1,66 @@
+"""Micro-benchmarks de los generadores de documentos.
+
+Cada caso se ejecuta --repeat veces (tras una ejecución de calentamiento que
+también carga python-docx/reportlab) con datos deterministas; se informa el
+mínimo, la mediana y la media en ms, y el tamaño del documento generado.
+Los tamaños son filas de la tabla: pacientes o ítems de la factura personal.
+"""
+import argparse, random, statistics, time
+from datetime import datetime
+
+from bench import load_app, save_results
+
+WHEN = datetime(2026, 1, 15, 9, 30)
+
+def patients(n, seed=42):
+    rng = random.Random(seed)
+    return [{"id": i, "name": f"Paciente de prueba {i:05d} {rng.choice(['Gómez', 'Pérez', 'Rodríguez'])}",
+             "price": rng.choice([180000, 220000, 250000])} for i in range(1, n + 1)]
+
+def personal_invoice(n, seed=42):
+    rng = random.Random(seed)
+    return {"number": "INV-BENCH", "date": "15/01/2026", "status": "pendiente", "tax": 19, "notes": "Pago a 30 días",
+            "issuer_name": "Felix Linares", "issuer_email": "felix@example.com", "issuer_phone": "3000000000",
+            "issuer_address": "Calle 1 # 2-3", "client_name": "Clínica del Norte", "client_company": "Clínica del Norte SAS",
+            "client_nit": "900.123.456-7", "client_email": "pagos@example.com",
+            "items": [{"description": f"Servicio de prueba {i:05d}", "qty": rng.randint(1, 5),
+                       "unit_value": rng.choice([50000, 120000, 300000])} for i in range(1, n + 1)]}
+
+def cases(D, sizes):
+    """(nombre, tamaño, función) — cada función devuelve el buffer generado."""
+    out = []
+    for n in sizes:
+        pts = patients(n)
+        out.append(("docx_invoice", n, lambda pts=pts: D.docx_invoice("FAC-BENCH", pts, WHEN)))
+        out.append(("generate_pdf", n, lambda pts=pts: D.generate_pdf("FAC-BENCH", pts, WHEN)))
+        inv = personal_invoice(n)
+        out.append(("generate_personal_pdf", n, lambda inv=inv: D.generate_personal_pdf(inv)))
+        out.append(("generate_personal_docx", n, lambda inv=inv: D.generate_personal_docx(inv)))
+    return out
+
+def measure(fn, repeat):
+    buf = fn(); buf.seek(0, 2); size = buf.tell(); buf.close()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn().close(); times.append(time.perf_counter() - t0)
+    return {"min_ms": round(min(times) * 1000, 2), "median_ms": round(statistics.median(times) * 1000, 2),
+            "mean_ms": round(statistics.fmean(times) * 1000, 2), "repeat": repeat, "bytes": size}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--sizes",  default="10,100,1000,10000")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--only",   default="", help="filtra por nombre de caso (p. ej. generate_pdf)")
+    args = ap.parse_args()
+    A = load_app()
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    results = {}
+    print(f"{'caso':<28}{'min ms':>10}{'mediana':>10}{'media':>10}{'bytes':>10}")
+    for name, n, fn in cases(A.documents, sizes):
+        if args.only and args.only not in name: continue
+        r = results[f"{name}[{n}]"] = measure(fn, args.repeat)
+        print(f"{name+'['+str(n)+']':<28}{r['min_ms']:>10}{r['median_ms']:>10}{r['mean_ms']:>10}{r['bytes']:>10}")
+    print(f"📄 {save_results('micro', vars(args), results)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Carga datos sintéticos con volúmenes realistas.
+
+Los usuarios bench0000… (clave "bench") reciben tareas y facturas con una
+distribución sesgada (Zipf): los primeros acumulan historiales largos y el
+resto unos pocos registros. La misma --seed produce siempre los mismos datos.
+"""
+import argparse, json, random, time, uuid
+from datetime import datetime, timedelta
+
+from bench import DB_PATH, PASSWORD, backend_name, load_app
+
+TABLES = ("users", "sessions", "tasks", "medical_history", "personal_invoices", "personal_invoice_items",
+          "revenue_rollup", "personal_due_rollup", "login_logs", "medical_drafts", "render_jobs", "search_index",
+          "session_revocations", "stream_tickets")
+
+CLIENTS  = ["Clínica del Norte", "Laboratorio Andes", "Hospital San José", "Sueño Sano SAS", "Neuro Centro"]
+TITLES   = ["Revisar informe", "Llamar paciente", "Enviar factura", "Renovar licencia", "Comprar insumos"]
+NAMES    = ["Ana", "Luis", "María", "Carlos", "Lucía", "Jorge", "Sofía", "Pedro", "Elena", "Andrés"]
+SURNAMES = ["Gómez", "Pérez", "Rodríguez", "Martínez", "López", "García", "Torres", "Ramírez"]
+
+def insert_many(A, table, cols, rows):
+    per = max(1, 900 // len(cols))  # límite de variables de SQLite antiguo
+    row = "(" + ",".join(["%s"] * len(cols)) + ")"
+    for k in range(0, len(rows), per):
+        chunk = rows[k:k + per]
+        A.db_execute(f"INSERT INTO {table} ({','.join(cols)}) VALUES " + ",".join([row] * len(chunk)),
+                     [v for r in chunk for v in r])
+
+def owners_for(rng, users, n):
+    weights = [1 / (i + 1) for i in range(len(users))]
+    return rng.choices(users, weights=weights, k=n)
+
+def when(rng, now, days):
+    return now - timedelta(days=rng.uniform(0, days), seconds=rng.randint(0, 86399))
+
+def seed(A, args):
+    rng, now = random.Random(args.seed), datetime.now()
+    person = lambda: f"{rng.choice(NAMES)} {rng.choice(SURNAMES)}"
+    users = []
+    for i in range(args.users):
+        users.append((str(uuid.UUID(int=rng.getrandbits(128))), f"bench{i:04d}", A.hash_password(PASSWORD),
+                      person(), "user", True, "medical,personal,tasks", now.isoformat()))
+    insert_many(A, "users", ("id","username","password","name","role","active","modules","created"), users)
+    ids = [u[0] for u in users]
+
+    tasks = []
+    for owner in owners_for(rng, ids, args.tasks):
+        created = when(rng, now, 730)
+        due = (now + timedelta(days=rng.randint(-60, 60))).strftime("%Y-%m-%d") if rng.random() < .8 else ""
+        tasks.append((str(uuid.UUID(int=rng.getrandbits(128))), owner, rng.choice(TITLES), "", due,
+                      rng.choice(["baja","normal","alta"]), "general",
+                      rng.choice(["pendiente","pendiente","completada"]),
+                      due if due and rng.random() < .3 else "", created.isoformat()))
+    insert_many(A, "tasks", ("id","owner","title","description","due_date","priority","category","status",
+                             "reminder","created_at"), tasks)
+
+    medical = []
+    for n, owner in enumerate(owners_for(rng, ids, args.medical)):
+        pts = [{"id": k, "name": person(), "price": rng.choice([180000, 220000, 250000])}
+               for k in range(1, rng.randint(1, args.patients) + 1)]
+        medical.append((str(uuid.UUID(int=rng.getrandbits(128))), owner, f"FAC-B{n:06d}",
+                        when(rng, now, 730).isoformat(), len(pts), sum(p["price"] for p in pts), json.dumps(pts)))
+    insert_many(A, "medical_history", ("id","owner","invoice_number","created_at","patient_count","total",
+                                       "patients_json"), medical)
+
+    personal, items = [], []
+    for n, owner in enumerate(owners_for(rng, ids, args.personal)):
+        created = when(rng, now, 730); iid = str(uuid.UUID(int=rng.getrandbits(128)))
+        inv = {"id": iid, "owner": owner, "number": f"INV-B{n:06d}", "date": created.strftime("%d/%m/%Y"),
+               "due_date": (created + timedelta(days=30)).strftime("%Y-%m-%d"),
+               "status": rng.choice(["pendiente","pagada","pagada","vencida"]),
+               "issuer_name": person(), "issuer_email": "", "issuer_phone": "", "issuer_address": "",
+               "client_name": rng.choice(CLIENTS), "client_company": "", "client_nit": f"900{n:06d}",
+               "client_email": "", "tax": rng.choice([0, 19]), "notes": "", "created": created.isoformat(),
+               "items": [{"description": f"Servicio {k+1}", "qty": rng.randint(1, 5),
+                          "unit_value": rng.choice([50000, 120000, 300000])}
+                         for k in range(rng.randint(1, args.items))]}
+        personal.append((iid, owner, json.dumps(inv), created.isoformat(), *A.personal_columns(inv)))
+        items += [(iid, k, it["description"], float(it["qty"]), float(it["unit_value"]),
+                   float(it["qty"]) * it["unit_value"]) for k, it in enumerate(inv["items"])]
+    insert_many(A, "personal_invoices", ("id","owner","data_json","created_at",*A.PERSONAL_COLUMNS), personal)
+    insert_many(A, "personal_invoice_items", ("invoice_id","position","description","qty","unit_value","total"), items)
+    A.backfill_rollups(); A.backfill_search()
+    return {"users": len(users), "tasks": len(tasks), "medical_history": len(medical),
+            "personal_invoices": len(personal), "personal_invoice_items": len(items)}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--users",    type=int, default=2000)
+    ap.add_argument("--tasks",    type=int, default=100000)
+    ap.add_argument("--medical",  type=int, default=20000)
+    ap.add_argument("--personal", type=int, default=20000)
+    ap.add_argument("--patients", type=int, default=25, help="máx. pacientes por factura médica")
+    ap.add_argument("--items",    type=int, default=8,  help="máx. ítems por factura personal")
+    ap.add_argument("--seed",     type=int, default=42)
+    ap.add_argument("--reset", action="store_true", help="vacía los datos antes de cargar")
+    args = ap.parse_args()
+    if args.reset and backend_name() == "sqlite":
+        for f in DB_PATH.parent.glob(DB_PATH.name + "*"): f.unlink()
+    A = load_app()
+    if args.reset and backend_name() == "postgresql":
+        for t in TABLES:
+            if t == "users": A.db_execute("DELETE FROM users WHERE username!=%s", ("admin",))
+            else: A.db_execute(f"DELETE FROM {t}")
+    elif A.db_execute("SELECT id FROM users WHERE username=%s", ("bench0000",), fetch="one"):
+        raise SystemExit("La BD ya tiene datos de benchmark: usa --reset")
+    t0 = time.perf_counter()
+    counts = seed(A, args)
+    print(f"✅ Datos cargados en {time.perf_counter()-t0:.1f} s ({backend_name()}): {counts}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+"""Servidor WSGI multihilo contra la BD de benchmarks (lo arranca bench.load)."""
+import logging, sys
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from bench import load_app
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 5099
+    A = load_app()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)   # sin una línea por petición
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"   # keep-alive como detrás de un proxy
+    server = make_server("127.0.0.1", port, A.app, threaded=True)
+    print(f"✅ Servidor de benchmark en http://127.0.0.1:{port}", flush=True)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,534 @@
+# ══════════════════════════════════════════════════════════════════════════════
+#  Facturador FL  —  generadores de documentos y extracción de informes
+#
+#  Sin Flask ni BD: lo importa app.py y también los procesos del pool de
+#  renderizado (ver render_executor en app.py), que arrancan con spawn o
+#  forkserver y cargan solo este módulo, sin las migraciones, los estáticos
+#  ni el resto del arranque de la aplicación.
+# ══════════════════════════════════════════════════════════════════════════════
+
+from pathlib import Path
+from datetime import datetime
+import os, io, re, html, math, zlib, base64, shutil, threading, time, tempfile, zipfile
+
+# python-docx y reportlab se importan dentro de cada generador (ver load_render_libs)
+
+TEMP_DIR = Path(__file__).parent / "temp"   # el mismo que app.TEMP_DIR
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  CONSTANTES MÉDICAS
+# ══════════════════════════════════════════════════════════════════════════════
+
+DOCTOR  = "DR. FRANCISCO ENRIQUE CABRERA PORTIELES"
+SPEC    = "NEUROFISIOLOGO CLINICO"
+LICENSE = "RM0307 - CC 1047488543"
+
+def clean(name): return Path(name).stem.replace("_"," ").title()
+def fmt_money(v): return f"${int(v):,}".replace(",",".")
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  BUFFERS DE RENDERIZADO
+#
+#  En memoria salvo con RENDER_SPOOL_MAX > 0: los documentos mayores de ese
+#  tamaño (bytes) se generan sobre un fichero temporal en TEMP_DIR y
+#  render_document los deja en un fichero spool-* cuya ruta devuelve en lugar
+#  de los bytes; quien la recibe lo envía por bloques y lo borra (o lo mueve).
+#  Entre todos los spool-* no pasan de RENDER_SPOOL_TOTAL bytes: por encima,
+#  el documento se devuelve en memoria. Los restos se purgan tras TEMP_MAX_AGE s.
+# ══════════════════════════════════════════════════════════════════════════════
+
+RENDER_SPOOL_MAX   = int(os.environ.get("RENDER_SPOOL_MAX", 0))
+RENDER_SPOOL_TOTAL = int(os.environ.get("RENDER_SPOOL_TOTAL", 512 * 1024 * 1024))
+TEMP_MAX_AGE       = int(os.environ.get("TEMP_MAX_AGE", 3600))
+
+_temp_sweep = {"last": 0.0}
+
+def sweep_temp_dir(force=False):
+    """Borra de TEMP_DIR los ficheros con más de TEMP_MAX_AGE segundos."""
+    now = time.time()
+    if not force and now - _temp_sweep["last"] < 600: return
+    _temp_sweep["last"] = now
+    for f in TEMP_DIR.glob("*"):
+        try:
+            if f.is_file() and now - f.stat().st_mtime > TEMP_MAX_AGE: f.unlink()
+        except OSError: pass
+
+def new_buffer():
+    if RENDER_SPOOL_MAX:
+        sweep_temp_dir()
+        return tempfile.SpooledTemporaryFile(max_size=RENDER_SPOOL_MAX, dir=TEMP_DIR)
+    return io.BytesIO()
+
+def spool_usage():
+    total = 0
+    for f in TEMP_DIR.glob("spool-*"):
+        try: total += f.stat().st_size
+        except OSError: pass
+    return total
+
+def spool_document(buf, size):
+    """Ruta de un fichero spool-* con el contenido de buf, o None si supera RENDER_SPOOL_TOTAL."""
+    if spool_usage() + size > RENDER_SPOOL_TOTAL: return None
+    fd, path = tempfile.mkstemp(prefix="spool-", dir=TEMP_DIR)
+    with os.fdopen(fd, "wb") as f: shutil.copyfileobj(buf, f, 1024 * 1024)
+    return path
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  RENDERIZADO
+#
+#  Punto de entrada de los hijos del pool: load_render_libs como initializer
+#  y render_document / extract_study como tareas.
+# ══════════════════════════════════════════════════════════════════════════════
+
+def render_document(kind, payload, fmt):
+    """Renderiza el documento (en el proceso web o en un hijo del pool) y devuelve sus
+    bytes o, si supera RENDER_SPOOL_MAX, la ruta (str) del fichero spool-* que lo contiene."""
+    if kind=="medical":
+        number, pts = payload["number"], payload["patients"]
+        when = datetime.fromisoformat(payload["created_at"])
+        buf = docx_invoice(number, pts, when) if fmt=="word" else generate_pdf(number, pts, when)
+    else:
+        buf = generate_personal_docx(payload) if fmt=="word" else generate_personal_pdf(payload)
+    try:
+        size = buf.seek(0, 2); buf.seek(0)
+        if RENDER_SPOOL_MAX and size > RENDER_SPOOL_MAX:
+            path = spool_document(buf, size)
+            if path: return path
+        return buf.read()
+    finally: buf.close()
+
+def load_render_libs():
+    """Importa python-docx y reportlab y compila las plantillas DOCX (idempotente); devuelve los ms."""
+    t0 = time.perf_counter()
+    import docx, docx.shared, docx.enum.text, docx.enum.table
+    import reportlab.lib.pagesizes, reportlab.pdfgen.canvas
+    for template in DocxTemplate.loaded: template.compile()
+    return round((time.perf_counter() - t0) * 1000, 1)
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  PAGINACIÓN DE PDF
+#
+#  PdfPager reparte filas de altura fija entre páginas de un canvas de
+#  reportlab. Lo que se repite en cada página (membrete, pie, cabecera de la
+#  tabla) se dibuja una sola vez como form XObject y cada página solo lo
+#  referencia con doForm. El texto de las filas de una página va en un único
+#  objeto de texto, con la fuente y el color cambiados solo cuando difieren.
+#  Las filas llegan de un iterable y el contenido de cada página se comprime
+#  al cerrarla, así que el coste crece linealmente con el número de filas.
+#
+#  Los flujos van en Flate binario, sin ASCII85 (su coste y un 25 % más de
+#  bytes). reportlab solo lo permite con la opción global rl_config.useA85,
+#  sin equivalente por canvas: pdf_canvas la fija una vez por proceso antes
+#  del primer canvas. En la app y en el pool solo este módulo usa reportlab.
+# ══════════════════════════════════════════════════════════════════════════════
+
+_reportlab_setup = {"done": False}
+
+def pdf_canvas(buf, pagesize):
+    """Canvas de reportlab con compresión de páginas (configura reportlab la primera vez)."""
+    from reportlab.pdfgen import canvas
+    if not _reportlab_setup["done"]:
+        from reportlab import rl_config
+        rl_config.useA85 = 0
+        _reportlab_setup["done"] = True
+    return canvas.Canvas(buf, pagesize=pagesize, pageCompression=1)
+
+class PdfPager:
+    def __init__(self, c, bottom):
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        self.c, self.bottom, self.pages, self.y = c, bottom, 0, 0
+        self._width, self._text, self._style = stringWidth, None, None
+
+    def form(self, name, draw):
+        """Registra un form XObject con lo que dibuje draw(canvas)."""
+        self.c.beginForm(name); draw(self.c); self.c.endForm()
+        return name
+
+    def page(self, forms, top):
+        """Cierra la página en curso (si la hay) y abre otra con los forms indicados."""
+        self.flush()
+        if self.pages: self.c.showPage()
+        for name in forms: self.c.doForm(name)
+        self.pages += 1; self.y = top
+
+    def fits(self, height): return self.y - height >= self.bottom
+
+    def text(self, x, y, s, font="Helvetica", size=10, color=(0, 0, 0), align="left"):
+        t = self._text
+        if t is None: t = self._text = self.c.beginText(); self._style = None
+        if self._style != (font, size, color):
+            t.setFont(font, size); t.setFillColorRGB(*color); self._style = (font, size, color)
+        if align != "left":
+            width = self._width(s, font, size); x -= width if align == "right" else width / 2
+        t.setTextOrigin(x, y); t.textOut(s)
+
+    def flush(self):
+        if self._text is not None: self.c.drawText(self._text); self._text = None
+
+    def save(self):
+        self.flush(); self.c.save()
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  PLANTILLAS DOCX
+#
+#  Cada formato se construye una sola vez por proceso con python-docx
+#  (márgenes, estilos, membrete, tabla) usando marcadores {{campo}} en el
+#  texto y una fila modelo con {{0}}, {{1}}… Al compilarla se guardan:
+#    - el .docx sin word/document.xml, ya comprimido;
+#    - document.xml como cadena de formato, con la fila modelo sustituida
+#      por {rows};
+#    - la fila modelo, también como cadena de formato.
+#  Renderizar es escapar los valores, formatear la fila una vez por línea,
+#  unirlas y añadir document.xml al zip base: no hay objetos python-docx
+#  por petición y el coste es lineal en el número de filas.
+# ══════════════════════════════════════════════════════════════════════════════
+
+DOCX_BODY          = "word/document.xml"
+DOCX_COMPRESSLEVEL = int(os.environ.get("DOCX_COMPRESSLEVEL", 6))
+XML_BAD            = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def xml_text(value):
+    return html.escape(XML_BAD.sub("", str(value)), quote=False)
+
+def format_template(xml):
+    """{{campo}} → {campo}; el resto de llaves se duplican para str.format."""
+    parts = re.split(r"\{\{(\w+)\}\}", xml)
+    return "".join(p.replace("{", "{{").replace("}", "}}") if i % 2 == 0 else "{" + p + "}"
+                   for i, p in enumerate(parts))
+
+class DocxTemplate:
+    loaded = []   # todas las plantillas, para precompilarlas al arrancar
+
+    def __init__(self, build):
+        self._build, self._lock, self._compiled = build, threading.Lock(), None
+        DocxTemplate.loaded.append(self)
+
+    def compile(self):
+        if self._compiled: return self._compiled
+        with self._lock:
+            if self._compiled: return self._compiled
+            raw = io.BytesIO(); self._build().save(raw)
+            base = io.BytesIO()
+            with zipfile.ZipFile(raw) as src, zipfile.ZipFile(base, "w", zipfile.ZIP_DEFLATED) as dst:
+                # los valores pueden empezar o acabar en espacio: se conservan en todo <w:t>
+                xml = src.read(DOCX_BODY).decode().replace("<w:t>", '<w:t xml:space="preserve">')
+                for info in src.infolist():
+                    if info.filename != DOCX_BODY: dst.writestr(info, src.read(info), zipfile.ZIP_DEFLATED)
+            mark  = xml.index("{{0}}")
+            start = max(xml.rfind("<w:tr>", 0, mark), xml.rfind("<w:tr ", 0, mark))
+            end   = xml.index("</w:tr>", mark) + len("</w:tr>")
+            self._compiled = (base.getvalue(), format_template(xml[:start] + "{{rows}}" + xml[end:]),
+                              format_template(xml[start:end]))
+            return self._compiled
+
+    def render(self, fields, rows):
+        """fields: {campo: valor}; rows: iterable de tuplas en el orden de la fila modelo."""
+        base, body, row = self.compile()
+        lines = "".join([row.format(*map(xml_text, r)) for r in rows])
+        xml = body.format_map({**{k: xml_text(v) for k, v in fields.items()}, "rows": lines})
+        buf = new_buffer(); buf.write(base)
+        with zipfile.ZipFile(buf, "a", zipfile.ZIP_DEFLATED, compresslevel=DOCX_COMPRESSLEVEL) as z:
+            z.writestr(DOCX_BODY, xml)
+        return buf
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  GENERADORES DE DOCUMENTOS MÉDICOS
+# ══════════════════════════════════════════════════════════════════════════════
+
+def medical_docx_base():
+    from docx import Document
+    from docx.shared import Pt, Cm, RGBColor
+    from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_PARAGRAPH_ALIGNMENT
+    from docx.enum.table import WD_TABLE_ALIGNMENT
+    doc = Document()
+    for s in doc.sections:
+        s.top_margin=Cm(2); s.bottom_margin=Cm(2)
+        s.left_margin=Cm(2.5); s.right_margin=Cm(2.5)
+    style=doc.styles['Normal']; style.font.name='Arial'; style.font.size=Pt(11)
+    hdr=doc.add_paragraph(); hdr.alignment=WD_ALIGN_PARAGRAPH.CENTER
+    r=hdr.add_run(DOCTOR+"\n"); r.bold=True; r.font.size=Pt(16); r.font.color.rgb=RGBColor(0,51,102)
+    r2=hdr.add_run(SPEC+"\n"); r2.font.size=Pt(12); r2.font.color.rgb=RGBColor(0,51,102)
+    r3=hdr.add_run(LICENSE+"\n\n"); r3.italic=True; r3.font.size=Pt(10); r3.font.color.rgb=RGBColor(0,51,102)
+    p=doc.add_paragraph(); p.alignment=WD_ALIGN_PARAGRAPH.CENTER
+    rc=p.add_run("SE REALIZÓ INFORME Y PROCESAMIENTO DE LA CANTIDAD DE ESTUDIOS: {{count}}\nESTUDIOS DE POLISOMNOGRAFÍA\n\n")
+    rc.bold=True; rc.font.size=Pt(11); rc.font.color.rgb=RGBColor(0,51,102)
+    doc.add_paragraph("FACTURA N°: {{number}}",style='Heading 1').runs[0].bold=True
+    doc.add_paragraph("Fecha: {{date}}"); doc.add_paragraph()
+    tbl=doc.add_table(rows=2,cols=3); tbl.style='Light List Accent 1'
+    tbl.alignment=WD_TABLE_ALIGNMENT.CENTER
+    hc=tbl.rows[0].cells; hc[0].text="No."; hc[1].text="PACIENTE"; hc[2].text="VALOR"
+    for k,cell in enumerate(tbl.rows[1].cells): cell.text="{{%d}}"%k
+    doc.add_paragraph()
+    tp=doc.add_paragraph(); tp.paragraph_format.alignment=WD_PARAGRAPH_ALIGNMENT.RIGHT
+    rt=tp.add_run("TOTAL: {{total}}"); rt.bold=True; rt.font.size=Pt(12)
+    return doc
+
+MEDICAL_DOCX = DocxTemplate(medical_docx_base)
+
+def docx_invoice(number, patients, when=None):
+    return MEDICAL_DOCX.render(
+        {"count": len(patients), "number": number, "date": f"{when or datetime.now():%d/%m/%Y %H:%M}",
+         "total": fmt_money(sum(p['price'] for p in patients))},
+        ((i, p['name'], fmt_money(p['price'])) for i, p in enumerate(patients, 1)))
+
+def generate_pdf(number, patients, when=None):
+    from reportlab.lib.pagesizes import letter
+    buf=new_buffer()
+    c=pdf_canvas(buf,letter); w,h=letter
+    pg=PdfPager(c,bottom=60); rh=18; sub=0; navy=(0,51/255,102/255)
+    def tbl_header(y):
+        def draw(c):
+            c.setFont("Helvetica-Bold",10); c.setFillColorRGB(*navy); c.setStrokeColorRGB(*navy)
+            c.drawString(72,y,"No."); c.drawString(120,y,"PACIENTE"); c.drawRightString(w-72,y,"VALOR")
+            c.line(72,y-5,w-72,y-5)
+        return draw
+    def letterhead(c):
+        c.setFont("Helvetica-Bold",14); c.setFillColorRGB(*navy)
+        c.drawCentredString(w/2,h-50,DOCTOR); c.setFont("Helvetica",12)
+        c.drawCentredString(w/2,h-70,SPEC); c.drawCentredString(w/2,h-85,LICENSE)
+        c.setFont("Helvetica-Bold",10)
+        c.drawCentredString(w/2,h-105,f"SE REALIZÓ INFORME Y PROCESAMIENTO DE LA CANTIDAD DE ESTUDIOS: {len(patients)}")
+        c.drawCentredString(w/2,h-120,"ESTUDIOS DE POLISOMNOGRAFÍA")
+        c.setFont("Helvetica-Bold",12); c.drawString(72,h-150,f"FACTURA N°: {number}")
+        c.setFont("Helvetica",11); c.drawString(72,h-170,f"Fecha: {when or datetime.now():%d/%m/%Y %H:%M}")
+        tbl_header(h-200)(c)
+    first=pg.form("first",letterhead); cont=pg.form("cont",tbl_header(h-50))
+    pg.page([first],h-225)
+    for i,p in enumerate(patients,1):
+        if not pg.fits(rh): pg.page([cont],h-80)
+        pg.text(72,pg.y,str(i),color=navy); pg.text(120,pg.y,p['name'],color=navy)
+        pg.text(w-72,pg.y,fmt_money(p['price']),color=navy,align="right")
+        sub+=p['price']; pg.y-=rh
+    if not pg.fits(40): pg.page([cont],h-80)
+    pg.text(w-72,pg.y-20,f"SUBTOTAL: {fmt_money(sub)}","Helvetica-Bold",11,navy,"right")
+    pg.text(w-72,pg.y-40,f"TOTAL:    {fmt_money(sub)}","Helvetica-Bold",12,navy,"right")
+    pg.save(); return buf
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  FACTURAS PERSONALES
+# ══════════════════════════════════════════════════════════════════════════════
+
+def personal_number(v, default, field):
+    """Valor numérico de un campo de factura: vacío → default; ValueError legible si no es un número."""
+    if v is None or (isinstance(v,str) and not v.strip()): return default
+    try: n=float(v) if not isinstance(v,bool) else math.nan
+    except (TypeError,ValueError): n=math.nan
+    if not math.isfinite(n): raise ValueError(f"{field}: valor no numérico ({v!r})")
+    return int(n) if n.is_integer() else n
+
+def personal_totals(inv):
+    """(subtotal, iva, total) de una factura personal."""
+    sub=sum(personal_number(it.get("qty"),1,"Cantidad")*personal_number(it.get("unit_value"),0,"Valor unitario")
+            for it in inv.get("items") or [])
+    tax=personal_number(inv.get("tax"),0,"IVA"); taxv=sub*tax/100
+    return sub, taxv, sub+taxv
+
+def generate_personal_pdf(inv):
+    from reportlab.lib.pagesizes import A4
+    num=inv["number"]; buf=new_buffer()
+    c=pdf_canvas(buf,A4); w,h=A4
+    pg=PdfPager(c,bottom=60); money=lambda v: f"${v:,.0f}".replace(",",".")
+    def tbl_header(c,ty):
+        c.setFillColorRGB(.05,.08,.18); c.rect(40,ty,w-80,24,fill=1,stroke=0)
+        c.setFont("Helvetica-Bold",9); c.setFillColorRGB(1,1,1)
+        c.drawString(55,ty+8,"DESCRIPCIÓN"); c.drawRightString(w/2+20,ty+8,"CANT.")
+        c.drawRightString(w/2+120,ty+8,"V. UNITARIO"); c.drawRightString(w-50,ty+8,"TOTAL")
+    def first(c):
+        c.setFillColorRGB(.05,.08,.18); c.rect(0,h-120,w,120,fill=1,stroke=0)
+        c.setFillColorRGB(.24,.52,1.0); c.rect(0,h-124,w,4,fill=1,stroke=0)
+        c.setFont("Helvetica-Bold",20); c.setFillColorRGB(1,1,1)
+        c.drawString(40,h-55,inv.get("issuer_name","").upper())
+        c.setFont("Helvetica",11); c.setFillColorRGB(.7,.8,1.0)
+        c.drawString(40,h-75,inv.get("issuer_email",""))
+        c.drawString(40,h-90,inv.get("issuer_phone",""))
+        c.drawString(40,h-105,inv.get("issuer_address",""))
+        c.setFont("Helvetica-Bold",28); c.setFillColorRGB(1,1,1)
+        c.drawRightString(w-40,h-60,"FACTURA")
+        c.setFont("Helvetica",13); c.setFillColorRGB(.7,.8,1.0)
+        c.drawRightString(w-40,h-80,f"N° {num}")
+        c.drawRightString(w-40,h-97,f"Fecha: {inv.get('date',datetime.now().strftime('%d/%m/%Y'))}")
+        c.setFillColorRGB(.94,.96,1.0); c.rect(40,h-210,w-80,75,fill=1,stroke=0)
+        c.setFont("Helvetica-Bold",9); c.setFillColorRGB(.24,.52,1.0)
+        c.drawString(55,h-148,"FACTURADO A")
+        c.setFont("Helvetica-Bold",13); c.setFillColorRGB(.05,.08,.18)
+        c.drawString(55,h-165,inv.get("client_name",""))
+        c.setFont("Helvetica",10); c.setFillColorRGB(.3,.35,.5)
+        c.drawString(55,h-180,inv.get("client_company",""))
+        c.drawString(55,h-193,inv.get("client_nit",""))
+        c.drawString(55,h-206,inv.get("client_email",""))
+        sc={"pagada":(0.13,0.7,0.4),"pendiente":(0.95,0.6,0.1),"vencida":(0.9,0.2,0.2)}.get(inv.get("status","pendiente"),(0.5,0.5,0.5))
+        c.setFillColorRGB(*sc); c.roundRect(w-160,h-168,110,22,5,fill=1,stroke=0)
+        c.setFont("Helvetica-Bold",10); c.setFillColorRGB(1,1,1)
+        c.drawCentredString(w-105,h-153,inv.get("status","pendiente").upper())
+        tbl_header(c,h-255)
+    def cont(c):  # páginas siguientes: franja corta con el número y la cabecera de la tabla
+        c.setFillColorRGB(.05,.08,.18); c.rect(0,h-50,w,50,fill=1,stroke=0)
+        c.setFont("Helvetica-Bold",12); c.setFillColorRGB(1,1,1)
+        c.drawString(40,h-31,inv.get("issuer_name","").upper())
+        c.setFont("Helvetica",11); c.setFillColorRGB(.7,.8,1.0)
+        c.drawRightString(w-40,h-31,f"FACTURA N° {num} · continuación")
+        tbl_header(c,h-90)
+    def foot(c):
+        c.setFillColorRGB(.05,.08,.18); c.rect(0,0,w,40,fill=1,stroke=0)
+        c.setFont("Helvetica",8); c.setFillColorRGB(.5,.6,.8)
+        c.drawCentredString(w/2,25,"Generado con Facturador FL · "+datetime.now().strftime("%d/%m/%Y %H:%M"))
+    forms=[pg.form("first",first),pg.form("foot",foot)]; more=[pg.form("cont",cont),forms[1]]
+    def new_page(top):
+        pg.page(forms if not pg.pages else more,top)
+        pg.text(w-40,25,f"Página {pg.pages}","Helvetica",8,(.5,.6,.8),"right")
+    new_page(h-260); rh=22; sub=0
+    for i,it in enumerate(inv.get("items",[])):
+        if not pg.fits(rh): new_page(h-95)
+        c.setFillColorRGB(*((.97,.98,1.) if i%2==0 else (1.,1.,1.))); c.rect(40,pg.y-rh+4,w-80,rh,fill=1,stroke=0)
+        qty=float(it.get("qty",1)); uv=float(it.get("unit_value",0)); tot=qty*uv; sub+=tot; y=pg.y-4
+        pg.text(55,y,it.get("description","")[:65],"Helvetica",9,(.1,.12,.25))
+        pg.text(w/2+20,y,str(int(qty) if qty==int(qty) else qty),"Helvetica",9,(.1,.12,.25),"right")
+        pg.text(w/2+120,y,money(uv),"Helvetica",9,(.1,.12,.25),"right")
+        pg.text(w-50,y,money(tot),"Helvetica",9,(.1,.12,.25),"right"); pg.y-=rh
+    tax=float(inv.get("tax",0)); taxv=sub*tax/100; total=sub+taxv
+    notes=inv.get("notes","")
+    if not pg.fits(100 if notes else 70): new_page(h-95)
+    pg.flush(); toty=pg.y-15
+    c.setFillColorRGB(.94,.96,1.0); c.rect(w/2+20,toty-50,w/2-60,65,fill=1,stroke=0)
+    c.setFont("Helvetica",10); c.setFillColorRGB(.3,.35,.5)
+    c.drawString(w/2+35,toty+5,"Subtotal:"); c.drawRightString(w-55,toty+5,money(sub))
+    if tax:
+        c.drawString(w/2+35,toty-13,f"IVA ({tax:.0f}%):"); c.drawRightString(w-55,toty-13,money(taxv))
+    c.setFillColorRGB(.05,.08,.18); c.rect(w/2+20,toty-50,w/2-60,22,fill=1,stroke=0)
+    c.setFont("Helvetica-Bold",12); c.setFillColorRGB(1,1,1)
+    c.drawString(w/2+35,toty-41,"TOTAL:"); c.drawRightString(w-55,toty-41,money(total))
+    if notes:
+        c.setFont("Helvetica-Bold",9); c.setFillColorRGB(.3,.35,.5)
+        c.drawString(40,toty-70,"NOTAS:"); c.setFont("Helvetica",9)
+        c.drawString(40,toty-83,notes[:100])
+    pg.save(); return buf
+
+def personal_docx_base(tax, notes):
+    from docx import Document
+    from docx.shared import Pt, Cm, RGBColor
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    doc=Document()
+    for s in doc.sections:
+        s.top_margin=Cm(2);s.bottom_margin=Cm(2);s.left_margin=Cm(2.5);s.right_margin=Cm(2.5)
+    hdr=doc.add_paragraph(); hdr.alignment=WD_ALIGN_PARAGRAPH.LEFT
+    r=hdr.add_run("{{issuer_name}}\n"); r.bold=True; r.font.size=Pt(18); r.font.color.rgb=RGBColor(13,20,46)
+    r2=hdr.add_run("{{issuer_email}}  |  {{issuer_phone}}\n{{issuer_address}}\n")
+    r2.font.size=Pt(9); r2.font.color.rgb=RGBColor(100,120,160)
+    pt=doc.add_paragraph(); pt.alignment=WD_ALIGN_PARAGRAPH.RIGHT
+    rt=pt.add_run("FACTURA N° {{number}}"); rt.bold=True; rt.font.size=Pt(22); rt.font.color.rgb=RGBColor(13,20,46)
+    doc.add_paragraph("Fecha: {{date}}  |  Vence: {{due_date}}")
+    doc.add_paragraph(); doc.add_paragraph("FACTURADO A:").runs[0].bold=True
+    doc.add_paragraph("{{client_name}}  –  {{client_company}}")
+    doc.add_paragraph("NIT/CC: {{client_nit}}  |  Email: {{client_email}}"); doc.add_paragraph()
+    tbl=doc.add_table(rows=2,cols=4); tbl.style='Light List Accent 1'
+    hc=tbl.rows[0].cells; hc[0].text="DESCRIPCIÓN"; hc[1].text="CANT."; hc[2].text="V.UNITARIO"; hc[3].text="TOTAL"
+    for k,cell in enumerate(tbl.rows[1].cells): cell.text="{{%d}}"%k
+    doc.add_paragraph()
+    tp=doc.add_paragraph(); tp.alignment=WD_ALIGN_PARAGRAPH.RIGHT
+    rt=tp.add_run("Subtotal: {{subtotal}}\n"+("IVA: {{iva}}\n" if tax else "")+"TOTAL: {{total}}")
+    rt.bold=True; rt.font.size=Pt(12)
+    if notes: doc.add_paragraph(); doc.add_paragraph("Notas: {{notes}}")
+    return doc
+
+# Una plantilla por combinación de bloques opcionales (línea de IVA, notas)
+PERSONAL_DOCX = {(tax, notes): DocxTemplate(lambda tax=tax, notes=notes: personal_docx_base(tax, notes))
+                 for tax in (False, True) for notes in (False, True)}
+
+def generate_personal_docx(inv):
+    rows, sub = [], 0
+    for it in inv.get("items",[]):
+        qty=float(it.get("qty",1)); uv=float(it.get("unit_value",0)); tot=qty*uv; sub+=tot
+        rows.append((it.get("description",""), str(int(qty) if qty==int(qty) else qty),
+                     f"${uv:,.0f}".replace(",","."), f"${tot:,.0f}".replace(",",".")))
+    tax=float(inv.get("tax",0)); taxv=sub*tax/100; total=sub+taxv
+    fields={k: inv.get(k,"") for k in ("issuer_email","issuer_phone","issuer_address","number","date","due_date",
+                                       "client_name","client_company","client_nit","client_email","notes")}
+    fields.update(issuer_name=inv.get("issuer_name","").upper(), subtotal=f"${sub:,.0f}", iva=f"${taxv:,.0f}", total=f"${total:,.0f}")
+    return PERSONAL_DOCX[bool(tax), bool(inv.get("notes"))].render(fields, rows)
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  EXTRACCIÓN DE DATOS DE INFORMES
+#
+#  Nombre del paciente y fecha del estudio a partir del texto del documento
+#  (.docx, .pdf o .doc binario) o, en su defecto, de sus metadatos.
+# ══════════════════════════════════════════════════════════════════════════════
+
+NAME_LABEL = re.compile(
+    r"(?im)^[ \t]*(?:nombre\s+del\s+paciente|nombre\s+paciente|paciente|nombre)[ \t]*[:\-][ \t]*"
+    r"([A-Za-zÁÉÍÓÚÜÑáéíóúüñ][A-Za-zÁÉÍÓÚÜÑáéíóúüñ .'-]{2,80})")
+NAME_STOP  = re.compile(r"(?i)(?:\s{2,}|\s(?:edad|documento|c\.?\s?c\.?|identificaci[oó]n|fecha|sexo|id|historia)\b).*")
+DATE_LABEL = re.compile(r"(?i)fecha(?:\s+(?:del?\s+)?(?:estudio|examen|realizaci[oó]n|registro))?[ \t]*[:\-]?[ \t]*"
+                        r"(\d{1,2}[/.\-]\d{1,2}[/.\-]\d{2,4}|\d{4}-\d{2}-\d{2})")
+ANY_DATE   = re.compile(r"\b(\d{1,2}/\d{1,2}/\d{4}|\d{4}-\d{2}-\d{2})\b")
+
+def normalize_date(text):
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y", "%d-%m-%y", "%Y%m%d"):
+        try: return datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError: pass
+    return ""
+
+def docx_text(source):
+    """source: ruta o fichero abierto del .docx (zipfile lee solo las entradas necesarias)."""
+    with zipfile.ZipFile(source) as z:
+        names = set(z.namelist())
+        xml  = z.read("word/document.xml").decode("utf-8", "ignore")
+        core = z.read("docProps/core.xml").decode("utf-8", "ignore") if "docProps/core.xml" in names else ""
+    xml  = re.sub(r"</w:p>|<w:br/>", "\n", re.sub(r"<w:tab/>|</w:tc>", "\t", xml))
+    meta = re.search(r"<dcterms:created[^>]*>(\d{4}-\d{2}-\d{2})", core)
+    return html.unescape(re.sub(r"<[^>]+>", "", xml)), meta.group(1) if meta else ""
+
+PDF_STREAM = re.compile(rb"stream\r?\n(.*?)\r?\n?endstream", re.S)
+PDF_TEXT   = re.compile(rb"\[((?:[^\]\\]|\\.)*)\]\s*TJ|\(((?:[^)\\]|\\.)*)\)\s*(?:Tj|'|\")|(T\*|Td|TD|Tm|ET)\b")
+PDF_STRING = re.compile(rb"\(((?:[^)\\]|\\.)*)\)")
+
+def pdf_unescape(raw):
+    raw = re.sub(rb"\\([0-7]{1,3})", lambda m: bytes([int(m.group(1), 8) & 255]), raw)
+    return re.sub(rb"\\(.)", lambda m: {b"n": b"\n", b"r": b"", b"t": b"\t"}.get(m.group(1), m.group(1)), raw).decode("latin-1")
+
+def pdf_text(data, max_streams=40):
+    """Texto de las primeras páginas: pypdf si está instalado; si no, operadores Tj/TJ."""
+    meta = re.search(rb"/CreationDate\s*\(D:(\d{8})", data)
+    meta = normalize_date(meta.group(1).decode()) if meta else ""
+    try:
+        from pypdf import PdfReader
+        reader = PdfReader(io.BytesIO(data))
+        return "\n".join((pg.extract_text() or "") for pg in reader.pages[:3]), meta
+    except ImportError:
+        pass
+    lines, cur = [], []
+    for n, m in enumerate(PDF_STREAM.finditer(data)):
+        if n >= max_streams: break
+        body, head = m.group(1), data[max(0, m.start() - 300):m.start()]
+        try:
+            if b"ASCII85Decode" in head: body = base64.a85decode(body.strip().removesuffix(b"~>"))
+            if b"FlateDecode" in head: body = zlib.decompressobj().decompress(body, 4 * 1024 * 1024)
+        except (ValueError, zlib.error): continue
+        for arr, single, op in PDF_TEXT.findall(body):
+            if op:
+                if cur: lines.append("".join(cur)); cur = []
+            elif arr: cur.append("".join(pdf_unescape(s) for s in PDF_STRING.findall(arr)))
+            else: cur.append(pdf_unescape(single))
+    if cur: lines.append("".join(cur))
+    return "\n".join(lines), meta
+
+def doc_text(data):
+    """Word 97-2003: tramos de texto UTF-16LE o cp1252 del binario."""
+    runs  = [r.decode("utf-16le", "ignore") for r in re.findall(rb"(?:[\x20-\x7e\xa0-\xff]\x00|[\r\t]\x00){6,}", data)]
+    runs += [r.decode("cp1252", "ignore") for r in re.findall(rb"[\x20-\x7e\xa0-\xff\r\t]{6,}", data)]
+    return "\n".join(runs).replace("\r", "\n"), ""
+
+def extract_study(filename, path):
+    """Nombre del paciente y fecha del estudio de un informe (se ejecuta en el pool).
+    path: copia del archivo subido en TEMP_DIR; la lee este proceso y la borra quien la creó."""
+    ext = Path(filename).suffix.lower()
+    try:
+        if ext == ".docx": text, meta = docx_text(path)
+        else: text, meta = (pdf_text if ext == ".pdf" else doc_text)(Path(path).read_bytes())
+    except Exception:
+        text, meta = "", ""
+    name = NAME_LABEL.search(text)
+    name = NAME_STOP.sub("", name.group(1)).strip(" .-'") if name else ""
+    date = DATE_LABEL.search(text) or ANY_DATE.search(text)
+    date = normalize_date(date.group(1)) if date else ""
+    return {"name": name.title() if len(name) >= 3 else clean(filename),
+            "date": date or meta, "source": "texto" if name else "archivo"}
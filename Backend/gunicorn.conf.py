@@ -0,0 +1,23 @@
+# Configuración de gunicorn (se carga sola al ejecutar `gunicorn app:app` desde Backend/).
+#
+# Con preload_app el maestro importa app.py una sola vez: aplica las migraciones
+# y carga python-docx/reportlab antes del fork, así los workers arrancan sin
+# tocar la BD y comparten esas librerías copy-on-write. Los pools de conexiones
+# y los hilos de fondo detectan el fork y se recrean en cada worker.
+import os
+
+os.environ.setdefault("RENDER_PRELOAD", "1")
+
+bind         = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers      = int(os.environ.get("WEB_CONCURRENCY", 2))
+# Cada pestaña de tareas mantiene abierto /api/tasks/stream y ocupa un hilo
+# (hasta REMINDER_STREAMS_MAX por worker): deja hilos libres para la API.
+threads      = int(os.environ.get("GUNICORN_THREADS", 16))
+timeout      = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+preload_app  = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+def post_fork(server, worker):
+    # El pool de renderizado se crea en cada worker antes de que arranquen sus
+    # hilos; sus procesos salen de un forkserver (ver render_executor en app.py).
+    import app
+    app.render_executor()
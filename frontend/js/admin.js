@@ -0,0 +1,165 @@
+const token = localStorage.getItem("token");
+const me    = JSON.parse(localStorage.getItem("user") || "null");
+if (!token || !me || me.role !== "admin") { window.location.href = "/dashboard"; }
+const AUTH = { Authorization: `Bearer ${token}` };
+
+let users    = [];
+let editUID  = null;
+
+const $ = id => document.getElementById(id);
+
+function toast(msg, color="#ffd246") {
+  const d = document.createElement("div");
+  d.className="toast"; d.style.borderColor=color;
+  d.innerHTML=`<i class="fa fa-star" style="color:${color}"></i> ${msg}`;
+  document.body.appendChild(d);
+  setTimeout(()=>d.remove(),2800);
+}
+
+async function loadUsers() {
+  const res  = await fetch("/api/admin/users", { headers: AUTH });
+  if (res.status===403 || res.status===401) { window.location.href="/"; return; }
+  const data = await res.json();
+  users = data.users || [];
+  renderStats();
+  renderTable();
+}
+
+function renderStats() {
+  $("statTotal").textContent   = users.length;
+  $("statActive").textContent  = users.filter(u=>u.active).length;
+  $("statBlocked").textContent = users.filter(u=>!u.active).length;
+}
+
+function renderTable() {
+  const tb = $("usersTbody");
+  tb.innerHTML = "";
+  users.forEach(u => {
+    const isMe = u.id === me.id;
+    const created = new Date(u.created).toLocaleDateString("es-CO",{day:"2-digit",month:"short",year:"numeric"});
+    const tr = document.createElement("tr");
+    tr.innerHTML = `
+      <td>
+        <div class="user-cell">
+          <div class="avatar ${u.role==='admin'?'admin':''}">${(u.name||"?")[0].toUpperCase()}</div>
+          <div>
+            <div class="user-name">${u.name} ${isMe?'<span style="font-size:10px;color:#ffd246">(tú)</span>':''}</div>
+            <div class="user-uname">@${u.username}</div>
+          </div>
+        </div>
+      </td>
+      <td><span class="badge badge-${u.role}">${u.role}</span></td>
+      <td><span class="badge badge-${u.active?'active':'blocked'}">${u.active?'Activo':'Bloqueado'}</span></td>
+      <td>
+        <div class="mod-pills">
+          ${(u.modules||[]).map(m=>`<span class="mod-pill">${m==='medical'?'🩺 Médico':'💼 Personal'}</span>`).join('')}
+          ${u.role==='admin'?'<span class="mod-pill" style="color:#ffd246;border-color:rgba(255,210,70,.3)">⚙️ Admin</span>':''}
+        </div>
+      </td>
+      <td style="color:var(--muted);font-size:12px">${created}</td>
+      <td>
+        <div class="actions-cell">
+          <button class="btn-action btn-edit" data-id="${u.id}"><i class="fa fa-pen"></i> Editar</button>
+          ${!isMe ? `
+            <button class="btn-action btn-toggle ${u.active?'block':''}" data-id="${u.id}">
+              <i class="fa fa-${u.active?'lock':'unlock'}"></i> ${u.active?'Bloquear':'Activar'}
+            </button>
+            ${u.username!=='admin'?`<button class="btn-action btn-del-u" data-id="${u.id}"><i class="fa fa-trash"></i></button>`:''}
+          ` : ''}
+        </div>
+      </td>
+    `;
+    tb.appendChild(tr);
+  });
+
+  // Events
+  tb.querySelectorAll(".btn-edit").forEach(b => {
+    b.onclick = () => openEditModal(b.dataset.id);
+  });
+  tb.querySelectorAll(".btn-toggle").forEach(b => {
+    b.onclick = () => toggleUser(b.dataset.id);
+  });
+  tb.querySelectorAll(".btn-del-u").forEach(b => {
+    b.onclick = () => deleteUser(b.dataset.id);
+  });
+}
+
+function openNewModal() {
+  editUID = null;
+  $("modalTitle").innerHTML = `<i class="fa fa-user-plus" style="color:#ffd246"></i> Nuevo Usuario`;
+  $("mName").value=""; $("mUsername").value=""; $("mPassword").value="";
+  $("mRole").value="user";
+  $("mMedical").checked=true; $("mPersonal").checked=false;
+  $("pwdHint").style.display="none";
+  $("mUsername").disabled=false;
+  $("overlay").classList.add("show");
+}
+
+function openEditModal(uid) {
+  const u = users.find(x=>x.id===uid);
+  if(!u) return;
+  editUID = uid;
+  $("modalTitle").innerHTML = `<i class="fa fa-user-gear" style="color:#ffd246"></i> Editar: ${u.name}`;
+  $("mName").value     = u.name||"";
+  $("mUsername").value = u.username||"";
+  $("mUsername").disabled = true;
+  $("mPassword").value = "";
+  $("mRole").value     = u.role||"user";
+  $("mMedical").checked  = (u.modules||[]).includes("medical");
+  $("mPersonal").checked = (u.modules||[]).includes("personal");
+  $("pwdHint").style.display="inline";
+  $("overlay").classList.add("show");
+}
+
+$("btnNewUser").onclick   = openNewModal;
+$("btnModalCancel").onclick = () => $("overlay").classList.remove("show");
+$("overlay").onclick = e => { if(e.target===$("overlay")) $("overlay").classList.remove("show"); };
+
+$("btnModalSave").onclick = async () => {
+  const mods = [];
+  if($("mMedical").checked)  mods.push("medical");
+  if($("mPersonal").checked) mods.push("personal");
+
+  const body = {
+    name:     $("mName").value.trim(),
+    role:     $("mRole").value,
+    modules:  mods
+  };
+  if(!editUID) {
+    body.username = $("mUsername").value.trim();
+    body.password = $("mPassword").value.trim();
+    if(!body.username||!body.password||!body.name){
+      toast("Completa todos los campos","#ff4d6a"); return;
+    }
+  } else {
+    if($("mPassword").value.trim()) body.password=$("mPassword").value.trim();
+    if(!body.name){ toast("El nombre es requerido","#ff4d6a"); return; }
+  }
+
+  const url    = editUID ? `/api/admin/users/${editUID}` : "/api/admin/users";
+  const method = editUID ? "PUT" : "POST";
+  const res    = await fetch(url,{method,headers:{...AUTH,"Content-Type":"application/json"},body:JSON.stringify(body)});
+  if(!res.ok){ const d=await res.json(); toast(d.error||"Error","#ff4d6a"); return; }
+  $("overlay").classList.remove("show");
+  await loadUsers();
+  toast(editUID?"Usuario actualizado ✓":"Usuario creado ✓");
+};
+
+async function toggleUser(uid) {
+  const res  = await fetch(`/api/admin/users/${uid}/toggle`,{method:"POST",headers:AUTH});
+  const data = await res.json();
+  if(!res.ok){ toast(data.error||"Error","#ff4d6a"); return; }
+  await loadUsers();
+  toast(data.active?"Usuario activado ✓":"Usuario bloqueado");
+}
+
+async function deleteUser(uid) {
+  const u = users.find(x=>x.id===uid);
+  if(!confirm(`¿Eliminar al usuario "${u?.name}"? Esta acción no se puede deshacer.`)) return;
+  const res = await fetch(`/api/admin/users/${uid}`,{method:"DELETE",headers:AUTH});
+  if(!res.ok){ toast("Error al eliminar","#ff4d6a"); return; }
+  await loadUsers();
+  toast("Usuario eliminado");
+}
+
+loadUsers();
@@ -0,0 +1,145 @@
+const token = localStorage.getItem("token");
+const user  = JSON.parse(localStorage.getItem("user") || "null");
+if (!token || !user) { window.location.href = "/"; }
+
+const modules  = user.modules || [];
+const isAdmin  = user.role === "admin";
+const name     = user.name || user.username;
+
+document.getElementById("userName").textContent    = name;
+document.getElementById("welcomeName").textContent = name.split(" ")[0];
+document.getElementById("avatarLetter").textContent= name[0].toUpperCase();
+const rb = document.getElementById("roleBadge");
+rb.textContent = isAdmin ? "ADMIN" : "USER";
+rb.className   = "role-badge " + (isAdmin ? "rb-admin" : "rb-user");
+
+const days = ["domingo","lunes","martes","miércoles","jueves","viernes","sábado"];
+const months = ["enero","febrero","marzo","abril","mayo","junio","julio","agosto","septiembre","octubre","noviembre","diciembre"];
+const now = new Date();
+document.getElementById("dateStr").textContent =
+  `${days[now.getDay()]}, ${now.getDate()} de ${months[now.getMonth()]} de ${now.getFullYear()}`;
+
+const MODS = [
+  {
+    id:"medical", href:"/medical",
+    color:"#4f8bff", bg:"rgba(79,139,255,.12)",
+    tagBg:"rgba(79,139,255,.12)", tagColor:"#4f8bff", tagBorder:"rgba(79,139,255,.2)",
+    icon:"🩺", tag:"Clínica",
+    title:"Facturador Médico",
+    desc:"Gestión de pacientes y estudios de polisomnografía. Historial, filtros y exportación PDF/Word.",
+    visible: modules.includes("medical") || isAdmin
+  },
+  {
+    id:"personal", href:"/personal",
+    color:"#22d3a0", bg:"rgba(34,211,160,.12)",
+    tagBg:"rgba(34,211,160,.12)", tagColor:"#22d3a0", tagBorder:"rgba(34,211,160,.2)",
+    icon:"🧾", tag:"Desarrollo",
+    title:"Facturador Personal",
+    desc:"Genera facturas profesionales con múltiples monedas, IVA y estados de pago.",
+    visible: modules.includes("personal") || isAdmin
+  },
+  {
+    id:"tasks", href:"/tasks",
+    color:"#a78bfa", bg:"rgba(167,139,250,.12)",
+    tagBg:"rgba(167,139,250,.12)", tagColor:"#a78bfa", tagBorder:"rgba(167,139,250,.2)",
+    icon:"✅", tag:"Productividad",
+    title:"Mis Tareas",
+    desc:"Gestiona recordatorios, tareas pendientes y actividades con alertas visuales.",
+    visible: modules.includes("tasks") || isAdmin
+  },
+  {
+    id:"admin", href:"/admin",
+    color:"#ffd246", bg:"rgba(255,210,70,.12)",
+    tagBg:"rgba(255,210,70,.12)", tagColor:"#ffd246", tagBorder:"rgba(255,210,70,.2)",
+    icon:"⚙️", tag:"Administración",
+    title:"Panel de Admin",
+    desc:"Gestión de usuarios, permisos, módulos y configuración del sistema.",
+    visible: isAdmin
+  },
+  {
+    id:"history", href:"/login-history",
+    color:"#38bdf8", bg:"rgba(56,189,248,.12)",
+    tagBg:"rgba(56,189,248,.12)", tagColor:"#38bdf8", tagBorder:"rgba(56,189,248,.2)",
+    icon:"🔐", tag:"Seguridad",
+    title:"Historial de Sesiones",
+    desc:"Consulta quién ha iniciado sesión, intentos fallidos y cierres de sesión.",
+    visible: true
+  }
+];
+
+const grid = document.getElementById("modulesGrid");
+MODS.filter(m=>m.visible).forEach((m,i) => {
+  const a = document.createElement("a");
+  a.href = m.href;
+  a.className = "mod-card";
+  a.style.cssText = `--mod-color:${m.color};--mod-bg:${m.bg};--mod-tag-bg:${m.tagBg};--mod-tag-color:${m.tagColor};--mod-tag-border:${m.tagBorder};animation-delay:${i*.08}s`;
+  a.innerHTML = `
+    <div class="mod-icon">${m.icon}</div>
+    <div class="mod-tag">${m.tag}</div>
+    <div class="mod-title">${m.title}</div>
+    <div class="mod-desc">${m.desc}</div>
+    <div class="mod-arrow"><span>Abrir módulo</span><i class="fa fa-arrow-right"></i></div>
+  `;
+  grid.appendChild(a);
+});
+
+// Resumen de facturación (acumulados del servidor)
+const money = v => "$" + Math.round(v||0).toLocaleString("es-CO");
+async function loadStats() {
+  if (!(isAdmin || modules.includes("medical") || modules.includes("personal"))) return;
+  const res = await fetch("/api/reports/summary?months=12", {headers:{Authorization:`Bearer ${token}`}});
+  if (!res.ok) return;
+  const r = await res.json();
+  const cur = r.months[r.months.length-1];
+  const monthTotal = r.revenue.filter(x=>x.period===cur).reduce((s,x)=>s+x.total,0);
+  const yearTotal  = r.revenue.reduce((s,x)=>s+x.total,0);
+  const invoices   = r.revenue.reduce((s,x)=>s+x.invoices,0);
+  const pending    = r.personal_by_status.find(x=>x.status==="pendiente");
+  const cards = [
+    {label:"Facturado este mes", value:money(monthTotal), sub:cur},
+    {label:"Facturado 12 meses", value:money(yearTotal), sub:`${invoices} facturas`},
+    {label:"Pacientes facturados", value:(r.medical.patients||0).toLocaleString("es-CO"), sub:`${r.medical.invoices} facturas médicas`},
+    {label:"Pendiente de cobro", value:money(pending?pending.total:0), sub:`${pending?pending.count:0} facturas`},
+    {label:"Vencido", value:money(r.overdue.total), sub:`${r.overdue.count} facturas`},
+  ];
+  const sg = document.getElementById("statsGrid");
+  sg.innerHTML = cards.map((c,i)=>`<div class="stat-card" style="animation-delay:${i*.05}s">
+    <div class="stat-label">${c.label}</div><div class="stat-value">${c.value}</div>
+    <div class="stat-sub">${c.sub}</div></div>`).join("");
+  const per = r.months.map(m=>r.revenue.filter(x=>x.period===m).reduce((s,x)=>s+x.total,0));
+  const max = Math.max(...per, 1);
+  document.getElementById("revChart").innerHTML = per.map((v,i)=>`<div class="bar" title="${r.months[i]}: ${money(v)}">
+    <div class="bar-fill" style="height:${Math.round(v*100/max)}%"></div>
+    <div class="bar-label">${r.months[i].slice(5)}</div></div>`).join("");
+  document.getElementById("statsWrap").style.display = "block";
+}
+loadStats();
+
+// Búsqueda global (/api/search): el extracto llega escapado con <mark> en las coincidencias
+const KINDS = {medical:["🩺","/medical"], personal:["🧾","/personal"], task:["✅","/tasks"]};
+const esc = s => String(s??"").replace(/[&<>"']/g, c => ({"&":"&amp;","<":"&lt;",">":"&gt;",'"':"&quot;","'":"&#39;"}[c]));
+let searchTimer = null, searchCursor = null, searchQ = "";
+async function runSearch(more) {
+  const box = document.getElementById("searchResults"), btn = document.getElementById("searchMore");
+  if (!more) { searchQ = document.getElementById("searchBox").value.trim(); searchCursor = null; box.innerHTML = ""; }
+  if (!searchQ) { btn.style.display = "none"; return; }
+  const q = searchQ;
+  const res = await fetch(`/api/search?limit=10&q=${encodeURIComponent(q)}` + (searchCursor ? `&cursor=${searchCursor}` : ""),
+                          {headers:{Authorization:`Bearer ${token}`}});
+  if (!res.ok || q !== searchQ) return;
+  const r = await res.json();
+  if (!more && !r.results.length) box.innerHTML = `<div class="search-hit"><small>Sin resultados</small></div>`;
+  box.insertAdjacentHTML("beforeend", r.results.map(x => `<a class="search-hit" href="${KINDS[x.kind][1]}">
+    ${KINDS[x.kind][0]} <b>${esc(x.title)}</b><small>${esc(x.subtitle)} · ${esc((x.created_at||"").slice(0,10))}</small>
+    ${x.snippet ? `<div class="snip">${x.snippet}</div>` : ""}</a>`).join(""));
+  searchCursor = r.next_cursor;
+  btn.style.display = searchCursor ? "inline-block" : "none";
+}
+document.getElementById("searchBox").oninput = () => { clearTimeout(searchTimer); searchTimer = setTimeout(() => runSearch(false), 250); };
+document.getElementById("searchMore").onclick = () => runSearch(true);
+
+document.getElementById("btnLogout").onclick = async () => {
+  await fetch("/api/auth/logout", {method:"POST", headers:{Authorization:`Bearer ${token}`}});
+  localStorage.clear();
+  window.location.href = "/";
+};
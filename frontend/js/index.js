@@ -0,0 +1,267 @@
+const token=localStorage.getItem("token");
+const user=JSON.parse(localStorage.getItem("user")||"null");
+if(!token||!user){location.href="/";}
+const AUTH={Authorization:`Bearer ${token}`};
+const API="/api/medical";
+const $=id=>document.getElementById(id);
+let editId=null, allPatients=[];
+
+$("navUser").textContent=user.name||user.username;
+
+function cop(v){return "$"+parseInt(v).toLocaleString("es-CO");}
+function toast(msg,color="#4f8bff"){
+  const d=document.createElement("div");d.className="toast";d.style.borderColor=color;
+  d.innerHTML=`<i class="fa fa-circle-check" style="color:${color}"></i> ${msg}`;
+  document.body.appendChild(d);setTimeout(()=>d.remove(),2800);}
+
+// ── Tabs ─────────────────────────────────────────────────
+document.querySelectorAll(".tab").forEach(t=>{
+  t.onclick=()=>{
+    document.querySelectorAll(".tab").forEach(x=>x.classList.remove("active"));
+    t.classList.add("active");
+    $("panelPatients").style.display=t.dataset.tab==="patients"?"block":"none";
+    $("panelHistory").style.display=t.dataset.tab==="history"?"block":"none";
+    if(t.dataset.tab==="history") loadHistory();
+  };
+});
+
+// ── Load patients ─────────────────────────────────────────
+async function load(){
+  const res=await fetch(`${API}/patients`,{headers:AUTH});
+  if(res.status===401){location.href="/";return;}
+  show(await res.json());
+}
+
+function show({patients,count,subtotal}){
+  allPatients=patients;
+  $("totalTxt").textContent=count;
+  $("subtotalTxt").textContent=cop(subtotal);
+  renderTable(patients);
+}
+
+function renderTable(pts){
+  const tb=$("tbody");tb.innerHTML="";
+  if(!pts.length){
+    tb.innerHTML=`<tr><td colspan="4" class="td-empty">
+      <i class="fa fa-inbox" style="font-size:28px;display:block;margin-bottom:10px;opacity:.3"></i>
+      No hay pacientes registrados</td></tr>`;return;}
+  pts.forEach(p=>{
+    const tr=document.createElement("tr");tr.className="fade-row";
+    tr.innerHTML=`<td class="td-id">${p.no??p.id}</td>
+      <td class="td-name">${p.name}${p.date?`<div style="font-size:11px;color:var(--muted)">Estudio: ${p.date.split("-").reverse().join("/")}</div>`:""}</td>
+      <td class="td-price">${cop(p.price)}</td>
+      <td><button class="btn btn-primary btn-sm edit" data-id="${p.id}"><i class="fa fa-pen"></i></button>
+      <button class="btn btn-danger btn-sm del" data-id="${p.id}" style="margin-left:5px"><i class="fa fa-trash"></i></button></td>`;
+    tb.appendChild(tr);});
+}
+
+// Search filter
+$("searchInput").oninput=e=>{
+  const q=e.target.value.toLowerCase();
+  renderTable(q?allPatients.filter(p=>p.name.toLowerCase().includes(q)):allPatients);
+};
+
+// ── CRUD ──────────────────────────────────────────────────
+$("addBtn").onclick=()=>{
+  editId=null;$("mName").value="";$("mPrice").value="";
+  $("modTitle").innerHTML=`<i class="fa fa-user-plus" style="color:#4f8bff"></i> Nuevo Paciente`;
+  $("ovPatient").classList.add("show");};
+$("btnCancelPat").onclick=()=>$("ovPatient").classList.remove("show");
+
+$("btnSavePat").onclick=async()=>{
+  const name=$("mName").value.trim();
+  if(!name){toast("Nombre requerido","#ff4d6a");return;}
+  const body={name};
+  if($("mPrice").value) body.price=$("mPrice").value;
+  const url=editId?`${API}/patients/${editId}`:`${API}/patients`;
+  const method=editId?"PUT":"POST";
+  const r=await fetch(url,{method,headers:{...AUTH,"Content-Type":"application/json"},body:JSON.stringify(body)});
+  if(!r.ok){toast("Error al guardar","#ff4d6a");return;}
+  $("ovPatient").classList.remove("show");load();
+  toast(editId?"Paciente actualizado ✓":"Paciente agregado ✓");};
+
+$("tbody").onclick=e=>{
+  const btn=e.target.closest("button");if(!btn)return;
+  const id=btn.dataset.id;
+  if(btn.classList.contains("del")){
+    if(!confirm("¿Eliminar este paciente?"))return;
+    fetch(`${API}/patients/${id}`,{method:"DELETE",headers:AUTH}).then(load)
+      .then(()=>toast("Eliminado","#ff4d6a"));
+  } else if(btn.classList.contains("edit")){
+    editId=id;
+    const tr=btn.closest("tr").children;
+    $("mName").value=tr[1].textContent;
+    $("mPrice").value=parseInt(tr[2].textContent.replace(/[^\d]/g,""))||"";
+    $("modTitle").innerHTML=`<i class="fa fa-pen" style="color:#4f8bff"></i> Editar Paciente`;
+    $("ovPatient").classList.add("show");}};
+
+$("clearBtn").onclick=()=>{
+  if(!confirm("¿Vaciar toda la lista?"))return;
+  fetch(`${API}/clear`,{method:"DELETE",headers:AUTH}).then(load)
+    .then(()=>toast("Lista vaciada","#ff4d6a"));};
+
+// Upload
+$("uploadBtn").onclick=()=>$("fileInput").click();
+$("fileInput").onchange=()=>{
+  const fd=new FormData();
+  [...$("fileInput").files].forEach(f=>fd.append("files",f));
+  const xhr=new XMLHttpRequest();
+  const bar=pct=>{$("progWrap").style.display="block";$("progBar").style.width=Math.round(pct)+"%";};
+  // 0–50 %: subida · 50–100 %: lectura de los informes en el servidor (NDJSON)
+  xhr.upload.onprogress=e=>bar(e.loaded*50/e.total);
+  let seen=0, result=null;
+  xhr.onprogress=()=>{
+    const lines=xhr.responseText.split("\n");
+    for(;seen<lines.length-1;seen++){
+      const m=JSON.parse(lines[seen]);
+      if(m.total) bar(50+m.done*50/m.total); else result=m;
+    }};
+  xhr.onload=()=>{
+    xhr.onprogress();
+    $("progWrap").style.display="none";load();$("fileInput").value="";
+    if(xhr.status!==200||!result||result.error){
+      let err=result&&result.error; try{err=err||JSON.parse(xhr.responseText).error;}catch(e){}
+      toast(err||"Error al cargar archivos","#ff4d6a");return;}
+    toast(`${result.patients.length} archivos cargados ✓`);};
+  xhr.open("POST",`${API}/patients?progress=1`);
+  xhr.setRequestHeader("Authorization",`Bearer ${token}`);
+  xhr.send(fd);};
+
+// Mass edit
+let massPatients=[];
+$("editPricesBtn").onclick=async()=>{
+  const r=await fetch(`${API}/patients`,{headers:AUTH});
+  const {patients}=await r.json();
+  if(!patients.length){toast("Sin pacientes","#ff4d6a");return;}
+  massPatients=patients;
+  // Agrupar por precio
+  const grupos={};
+  patients.forEach(p=>{
+    if(!grupos[p.price]) grupos[p.price]=[];
+    grupos[p.price].push(p.id);
+  });
+  // Renderizar grupos
+  const container=$("massGroups"); container.innerHTML="";
+  Object.entries(grupos).sort((a,b)=>parseInt(a[0])-parseInt(b[0])).forEach(([price,ids])=>{
+    const div=document.createElement("div");
+    div.style.cssText="background:rgba(255,255,255,.04);border:1px solid var(--border);border-radius:10px;padding:14px;margin-bottom:10px;";
+    div.innerHTML=`
+      <div style="display:flex;align-items:center;justify-content:space-between;margin-bottom:8px">
+        <div>
+          <span style="font-weight:700;color:#f59e0b;font-size:15px">${cop(parseInt(price))}</span>
+          <span style="color:var(--muted);font-size:12px;margin-left:8px">${ids.length} paciente${ids.length>1?"s":""}</span>
+        </div>
+        <span style="font-size:10px;color:var(--muted);text-transform:uppercase;letter-spacing:.5px">Precio actual</span>
+      </div>
+      <div style="display:flex;align-items:center;gap:8px">
+        <input type="number" min="0" placeholder="Nuevo precio (vacío = sin cambio)"
+          data-price="${price}"
+          style="flex:1;background:rgba(255,255,255,.05);border:1px solid var(--border);border-radius:7px;padding:9px 12px;font-size:13px;color:var(--text);font-family:'DM Sans',sans-serif;outline:none;"
+          onfocus="this.style.borderColor='#f59e0b'" onblur="this.style.borderColor='var(--border)'">
+        <span style="font-size:12px;color:var(--muted);white-space:nowrap">→ nuevo</span>
+      </div>`;
+    container.appendChild(div);
+  });
+  $("massPW").style.display="none";$("massPB").style.width="0%";
+  $("massPL").style.display="none";$("massActs").style.display="flex";
+  $("ovMass").classList.add("show");};
+$("btnCancelMass").onclick=()=>$("ovMass").classList.remove("show");
+
+$("btnApplyMass").onclick=async()=>{
+  // Recoger cambios por grupo
+  const cambios=[];
+  document.querySelectorAll("#massGroups input[data-price]").forEach(inp=>{
+    const newPrice=parseInt(inp.value);
+    if(!newPrice||newPrice<0) return; // vacío = sin cambio
+    const oldPrice=parseInt(inp.dataset.price);
+    massPatients.filter(p=>p.price===oldPrice).forEach(p=>cambios.push({id:p.id,price:newPrice}));
+  });
+  if(!cambios.length){toast("No hay cambios para aplicar","#f59e0b");return;}
+  const total=cambios.length;
+  $("massActs").style.display="none";
+  $("massPW").style.display="block";$("massPL").style.display="block";
+  $("massPL").textContent=`Actualizando ${total} pacientes...`;
+  // Un solo lote: una petición y una transacción para todos los cambios
+  $("massPB").style.width="50%";
+  const r=await fetch(`${API}/patients/batch`,{method:"POST",
+    headers:{...AUTH,"Content-Type":"application/json"},
+    body:JSON.stringify({ops:cambios.map(c=>({op:"update",id:c.id,price:c.price}))})});
+  if(!r.ok){$("massPL").textContent="Error al actualizar";$("massActs").style.display="flex";return;}
+  const data=await r.json();
+  $("massPB").style.width="100%";
+  $("massPL").textContent=`✓ ${data.applied} pacientes actualizados`;
+  setTimeout(()=>{$("ovMass").classList.remove("show");show(data);
+    toast(`${data.applied} precios actualizados ✓`,"#22d3a0");},800);};
+
+// Invoice
+async function gen(fmt){
+  const r=await fetch(`${API}/patients`,{headers:AUTH});
+  const d=await r.json();
+  if(!d.patients.length){toast("Sin pacientes","#ff4d6a");return;}
+  const num=$("invoiceInput").value.trim()||`FAC-${Date.now().toString().slice(-6)}`;
+  const res=await fetch(`${API}/invoice/${fmt}`,{method:"POST",
+    headers:{...AUTH,"Content-Type":"application/json"},
+    body:JSON.stringify({invoice_number:num})});
+  if(!res.ok){toast("Error al generar","#ff4d6a");return;}
+  const blob=await res.blob();
+  const url=URL.createObjectURL(blob);
+  const a=document.createElement("a");
+  a.href=url;a.download=`Factura_${num}.${fmt==="word"?"docx":"pdf"}`;
+  a.click();setTimeout(()=>URL.revokeObjectURL(url),100);
+  toast(`Factura ${num} generada ✓`);}
+$("pdfBtn").onclick=()=>gen("pdf");
+$("docxBtn").onclick=()=>gen("word");
+
+// History
+let histCursor=null;
+async function loadHistory(more=false){
+  const r=await fetch(`${API}/history${more&&histCursor?`?cursor=${histCursor}`:""}`,{headers:AUTH});
+  if(!r.ok)return;
+  const {history,next_cursor}=await r.json();
+  histCursor=next_cursor;
+  const tb=$("histTbody");
+  if(more) $("histMore")?.remove(); else tb.innerHTML="";
+  if(!history.length&&!more){
+    tb.innerHTML=`<tr><td colspan="5" class="td-empty">
+      <i class="fa fa-clock-rotate-left" style="font-size:28px;display:block;margin-bottom:10px;opacity:.3"></i>
+      No hay facturas generadas aún</td></tr>`;return;}
+  history.forEach(h=>{
+    const tr=document.createElement("tr");tr.className="fade-row";
+    const d=new Date(h.created_at).toLocaleString("es-CO");
+    tr.innerHTML=`<td><span class="hist-badge">${h.invoice_number}</span></td>
+      <td style="font-size:12px;color:var(--muted)">${d}</td>
+      <td style="color:#4f8bff;font-weight:600">${h.patient_count}</td>
+      <td class="td-price">${cop(h.total)}</td>
+      <td><button class="btn btn-primary btn-sm" onclick="dlHist('${h.id}','pdf')"><i class="fa fa-file-pdf"></i></button>
+      <button class="btn btn-word btn-sm" style="margin-left:5px" onclick="dlHist('${h.id}','word')"><i class="fa fa-file-word"></i></button></td>`;
+    tb.appendChild(tr);});
+  if(next_cursor){
+    const tr=document.createElement("tr");tr.id="histMore";
+    tr.innerHTML=`<td colspan="5" style="text-align:center"><button class="btn btn-primary btn-sm" onclick="loadHistory(true)">Cargar más</button></td>`;
+    tb.appendChild(tr);}}
+
+async function dlHist(id,fmt){
+  const res=await fetch(`${API}/history/${id}/download/${fmt}`,{headers:AUTH});
+  if(!res.ok){toast("Error","#ff4d6a");return;}
+  const blob=await res.blob();
+  const url=URL.createObjectURL(blob);
+  const a=document.createElement("a");a.href=url;a.download=`Factura_historial.${fmt==="word"?"docx":"pdf"}`;
+  a.click();setTimeout(()=>URL.revokeObjectURL(url),100);}
+
+// Export ZIP (mes seleccionado o todo el historial)
+async function exportZip(fmt){
+  const m=$("exportMonth").value;let q=`fmt=${fmt}`;
+  if(m){const [y,mo]=m.split("-").map(Number);
+    q+=`&from=${m}-01&to=${m}-${String(new Date(y,mo,0).getDate()).padStart(2,"0")}`;}
+  toast("Preparando ZIP...","#4f8bff");
+  const res=await fetch(`/api/export/medical?${q}`,{headers:AUTH});
+  if(!res.ok){toast("No hay facturas para exportar","#ff4d6a");return;}
+  const blob=await res.blob();
+  const url=URL.createObjectURL(blob);
+  const a=document.createElement("a");a.href=url;a.download=`Facturas_${m||"todas"}.zip`;
+  a.click();setTimeout(()=>URL.revokeObjectURL(url),100);}
+$("exportPdfBtn").onclick=()=>exportZip("pdf");
+$("exportWordBtn").onclick=()=>exportZip("word");
+
+$("invoiceInput").value=`FAC-${new Date().getFullYear()}${("0000"+(Date.now()%10000)).slice(-4)}`;
+load();
@@ -0,0 +1,131 @@
+const token = localStorage.getItem("token");
+const user  = JSON.parse(localStorage.getItem("user")||"null");
+if(!token||!user){location.href="/";}
+const AUTH  = {Authorization:`Bearer ${token}`};
+const isAdmin = user.role==="admin";
+const $ = id => document.getElementById(id);
+
+let allLogs=[], activeFilter="";
+
+function fmtDate(d){
+  const dt=new Date(d);
+  return dt.toLocaleDateString("es-CO",{day:"2-digit",month:"2-digit",year:"numeric"})
+    +" "+dt.toLocaleTimeString("es-CO",{hour:"2-digit",minute:"2-digit"});
+}
+
+async function loadLogs(){
+  const url = isAdmin ? "/api/admin/login-logs" : "/api/auth/my-logs";
+  const res = await fetch(url,{headers:AUTH});
+  if(res.status===401){location.href="/";return;}
+  const {logs}=await res.json();
+  allLogs=logs;
+  applyFilters();
+  loadStats();
+}
+
+// Contadores y gráfica agregados en el servidor (30 días, no solo las filas cargadas)
+async function loadStats(){
+  const res = await fetch("/api/auth/login-stats?bucket=day",{headers:AUTH});
+  if(!res.ok) return;
+  const s=await res.json(), t=s.totals;
+  $("stExito").textContent  = t.exitoso||0;
+  $("stFallido").textContent= t.fallido||0;
+  $("stCierre").textContent = t.cierre||0;
+  $("stBloq").textContent   = t.bloqueado||0;
+  const days={};
+  s.series.forEach(r=>{
+    const d=days[r.bucket]||(days[r.bucket]={ok:0,ko:0});
+    if(r.status==="exitoso") d.ok+=r.count; else if(r.status!=="cierre") d.ko+=r.count;
+  });
+  const keys=[], d0=new Date(s.from+"T00:00:00");
+  for(let d=new Date(d0);keys.length<30;d.setDate(d.getDate()+1))
+    keys.push(`${d.getFullYear()}-${String(d.getMonth()+1).padStart(2,"0")}-${String(d.getDate()).padStart(2,"0")}`);
+  const max=Math.max(1,...keys.map(k=>(days[k]?.ok||0)+(days[k]?.ko||0)));
+  $("actChart").innerHTML=keys.map(k=>{
+    const d=days[k]||{ok:0,ko:0};
+    return `<div class="bar" title="${k}: ${d.ok} exitosos, ${d.ko} fallidos">
+      <div class="bar-ko" style="height:${d.ko*100/max}%"></div>
+      <div class="bar-ok" style="height:${d.ok*100/max}%"></div></div>`;
+  }).join("");
+  $("ipList").innerHTML=s.ips.filter(i=>i.fallido+i.bloqueado>0)
+    .map(i=>`<span title="${i.count} intentos">${i.ip||"–"} · ${i.fallido+i.bloqueado} ❌</span>`).join("");
+}
+
+function renderLogs(logs){
+  // Table
+  const tb=$("logTbody"); tb.innerHTML="";
+  if(!logs.length){
+    tb.innerHTML=`<tr><td colspan="5" class="td-empty">
+      <i class="fa fa-shield-halved" style="font-size:28px;display:block;margin-bottom:10px;opacity:.3"></i>
+      No hay registros</td></tr>`;
+  } else {
+    logs.forEach(l=>{
+      const tr=document.createElement("tr");
+      tr.innerHTML=`
+        <td><div class="user-pill">
+          <div class="user-av">${(l.name||"?")[0].toUpperCase()}</div>
+          <div class="user-info">
+            <div class="uname">${l.name}</div>
+            <div class="uuser">@${l.username}</div>
+          </div>
+        </div></td>
+        <td><span class="badge b-${l.status}">${l.status}</span></td>
+        <td class="td-device">${l.device||"–"}</td>
+        <td class="td-ip">${l.ip||"–"}</td>
+        <td class="td-date">${fmtDate(l.created_at)}</td>`;
+      tb.appendChild(tr);
+    });
+  }
+
+  // Mobile cards
+  const cards=$("logCards"); cards.innerHTML="";
+  if(!logs.length){
+    cards.innerHTML=`<div style="text-align:center;color:var(--muted);padding:40px">Sin registros</div>`;
+  } else {
+    logs.forEach(l=>{
+      const div=document.createElement("div");
+      div.className="log-card";
+      div.innerHTML=`
+        <div class="lc-top">
+          <div class="user-pill">
+            <div class="user-av">${(l.name||"?")[0].toUpperCase()}</div>
+            <div class="user-info">
+              <div class="uname">${l.name}</div>
+              <div class="uuser">@${l.username}</div>
+            </div>
+          </div>
+          <span class="badge b-${l.status}">${l.status}</span>
+        </div>
+        <div class="lc-meta">
+          <span><i class="fa fa-clock"></i> ${fmtDate(l.created_at)}</span>
+          <span>${l.device||"–"}</span>
+          <span><i class="fa fa-network-wired"></i> ${l.ip||"–"}</span>
+        </div>`;
+      cards.appendChild(div);
+    });
+  }
+}
+
+// Filters
+document.querySelectorAll(".filter-btn").forEach(btn=>{
+  btn.onclick=()=>{
+    document.querySelectorAll(".filter-btn").forEach(b=>b.classList.remove("active"));
+    btn.classList.add("active");
+    activeFilter=btn.dataset.f;
+    applyFilters();
+  };
+});
+
+$("searchInput").oninput=applyFilters;
+
+function applyFilters(){
+  const q=$("searchInput").value.toLowerCase();
+  let logs=allLogs;
+  if(activeFilter) logs=logs.filter(l=>l.status===activeFilter);
+  if(q) logs=logs.filter(l=>
+    l.name.toLowerCase().includes(q)||l.username.toLowerCase().includes(q)
+  );
+  renderLogs(logs);
+}
+
+loadLogs();
@@ -0,0 +1,36 @@
+const btn = document.getElementById("btnLogin");
+const err = document.getElementById("errMsg");
+const errTxt = document.getElementById("errTxt");
+
+async function doLogin() {
+  const usr = document.getElementById("usr").value.trim();
+  const pwd = document.getElementById("pwd").value;
+  if (!usr || !pwd) { showErr("Completa todos los campos"); return; }
+  btn.innerHTML = '<i class="fa fa-spinner fa-spin"></i> Ingresando...';
+  btn.disabled = true;
+  try {
+    const res = await fetch("/api/auth/login", {
+      method:"POST", headers:{"Content-Type":"application/json"},
+      body: JSON.stringify({username:usr, password:pwd})
+    });
+    const data = await res.json();
+    if (!res.ok) { showErr(data.error || "Error al iniciar sesión"); return; }
+    localStorage.setItem("token", data.token);
+    localStorage.setItem("user", JSON.stringify(data.user));
+    window.location.href = "/dashboard";
+  } catch(e) {
+    showErr("Error de conexión con el servidor");
+  } finally {
+    btn.innerHTML = '<i class="fa fa-arrow-right-to-bracket"></i> Iniciar Sesión';
+    btn.disabled = false;
+  }
+}
+
+function showErr(msg) {
+  errTxt.textContent = msg;
+  err.classList.add("show");
+  setTimeout(()=>err.classList.remove("show"), 4000);
+}
+
+btn.onclick = doLogin;
+document.addEventListener("keydown", e => { if(e.key==="Enter") doLogin(); });
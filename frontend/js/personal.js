@@ -0,0 +1,273 @@
+// ── Auth ──────────────────────────────────────────────────────────────────
+const token = localStorage.getItem("token");
+const user  = JSON.parse(localStorage.getItem("user") || "null");
+if (!token || !user) { window.location.href = "/"; }
+document.getElementById("navUser").textContent = user.name || user.username;
+const AUTH = { Authorization: `Bearer ${token}` };
+const API  = "/api/personal";
+
+// ── State ─────────────────────────────────────────────────────────────────
+let invoices    = [];
+let selectedId  = null;
+let items       = [];
+
+// ── Utils ─────────────────────────────────────────────────────────────────
+const $ = id => document.getElementById(id);
+const fmt = v => "$ " + parseFloat(v||0).toLocaleString("es-CO",{minimumFractionDigits:0,maximumFractionDigits:0}) + " COP";
+
+function toast(msg, color="#2dd4a0") {
+  const d = document.createElement("div");
+  d.className = "toast";
+  d.style.borderColor = color;
+  d.innerHTML = `<i class="fa fa-circle-check" style="color:${color}"></i> ${msg}`;
+  document.body.appendChild(d);
+  setTimeout(()=>d.remove(), 2800);
+}
+
+// ── Items dinámicos ───────────────────────────────────────────────────────
+function addItem(desc="",qty=1,uv=0) {
+  items.push({ desc, qty, uv });
+  renderItems();
+}
+
+function renderItems() {
+  const c = $("itemsContainer");
+  c.innerHTML = "";
+  items.forEach((it, i) => {
+    const row = document.createElement("div");
+    row.className = "item-row";
+    row.innerHTML = `
+      <input placeholder="Descripción del servicio" value="${it.desc}"   data-i="${i}" data-f="desc">
+      <input type="number" min="0" placeholder="1"  value="${it.qty}"    data-i="${i}" data-f="qty" style="text-align:center">
+      <input type="number" min="0" placeholder="0"  value="${it.uv}"     data-i="${i}" data-f="uv">
+      <input value="${fmt(it.qty*it.uv)}" readonly style="color:#2dd4a0;font-weight:600;background:rgba(45,212,160,.05)">
+      <button class="btn-del-item" data-i="${i}"><i class="fa fa-xmark"></i></button>
+    `;
+    c.appendChild(row);
+  });
+  c.querySelectorAll("input[data-f]").forEach(inp => {
+    inp.oninput = () => {
+      const i = +inp.dataset.i, f = inp.dataset.f;
+      items[i][f] = f==="desc" ? inp.value : parseFloat(inp.value)||0;
+      calcTotals();
+      renderItems();
+    };
+  });
+  c.querySelectorAll(".btn-del-item").forEach(btn => {
+    btn.onclick = () => { items.splice(+btn.dataset.i,1); renderItems(); calcTotals(); };
+  });
+  calcTotals();
+}
+
+function calcTotals() {
+  const sub   = items.reduce((s,it)=>s+(it.qty*it.uv),0);
+  const tax   = parseFloat($("fTax").value)||0;
+  const taxV  = sub*tax/100;
+  const total = sub+taxV;
+  $("tSubtotal").textContent = fmt(sub);
+  $("tTax").textContent      = fmt(taxV);
+  $("tTotal").textContent    = fmt(total);
+}
+
+$("fTax").oninput = calcTotals;
+$("btnAddItem").onclick = () => addItem();
+
+// ── Load invoices ─────────────────────────────────────────────────────────
+let nextCursor = null;
+async function loadInvoices(more=false) {
+  try {
+    const q = more && nextCursor ? `?cursor=${nextCursor}` : "";
+    const res = await fetch(`${API}/invoices${q}`, { headers: AUTH });
+    if (res.status===401) { window.location.href="/"; return; }
+    const data = await res.json();
+    invoices = more ? invoices.concat(data.invoices || []) : (data.invoices || []);
+    nextCursor = data.next_cursor;
+    renderList();
+  } catch(e) { console.error(e); }
+}
+
+function renderList() {
+  const c = $("invoiceList");
+  if (!invoices.length) {
+    c.innerHTML = `<div class="empty-state"><div class="icon">📄</div><p>Aún no tienes facturas.<br>¡Crea tu primera factura personal!</p></div>`;
+    return;
+  }
+  c.innerHTML = "";
+  [...invoices].reverse().forEach(inv => {
+    const sub = (inv.items||[]).reduce((s,it)=>s+(it.qty||1)*(it.unit_value||0),0);
+    const taxV= sub*(inv.tax||0)/100;
+    const total=sub+taxV;
+    const div = document.createElement("div");
+    div.className = `inv-card${inv.id===selectedId?" selected":""}`;
+    div.innerHTML = `
+      <div class="inv-left">
+        <h4>${inv.number}</h4>
+        <p>${inv.client_name||"Sin cliente"} · ${inv.client_company||""}</p>
+        <span class="status-badge st-${inv.status}">${inv.status}</span>
+      </div>
+      <div class="inv-right">
+        <div class="inv-amount">${fmt(total)}</div>
+        <div class="inv-date">${inv.date}</div>
+      </div>
+    `;
+    div.onclick = () => selectInvoice(inv);
+    c.appendChild(div);
+  });
+  if (nextCursor) {
+    const more = document.createElement("button");
+    more.className = "btn-new"; more.style.margin = "10px auto 0";
+    more.innerHTML = `<i class="fa fa-angles-down"></i> Cargar más`;
+    more.onclick = () => loadInvoices(true);
+    c.appendChild(more);
+  }
+}
+
+function selectInvoice(inv) {
+  selectedId = inv.id;
+  // Fill form
+  $("fIssuerName").value    = inv.issuer_name    ||"";
+  $("fIssuerEmail").value   = inv.issuer_email   ||"";
+  $("fIssuerPhone").value   = inv.issuer_phone   ||"";
+  $("fIssuerAddress").value = inv.issuer_address ||"";
+  $("fClientName").value    = inv.client_name    ||"";
+  $("fClientCompany").value = inv.client_company ||"";
+  $("fClientNit").value     = inv.client_nit     ||"";
+  $("fClientEmail").value   = inv.client_email   ||"";
+  $("fNumber").value        = inv.number         ||"";
+  $("fStatus").value        = inv.status         ||"pendiente";
+  $("fDate").value          = toInputDate(inv.date||"");
+  $("fDueDate").value       = toInputDate(inv.due_date||"");
+  $("fTax").value           = inv.tax||0;
+  $("fNotes").value         = inv.notes          ||"";
+  items = (inv.items||[]).map(it=>({ desc:it.description||"", qty:it.qty||1, uv:it.unit_value||0 }));
+  renderItems();
+  $("formTitle").innerHTML = `<i class="fa fa-pencil" style="color:#2dd4a0"></i> Editando ${inv.number}`;
+  $("dlSection").style.display = "block";
+  $("dlNum").textContent = inv.number;
+  $("btnDlPdf").onclick  = () => download(inv.id,"pdf");
+  $("btnDlWord").onclick = () => download(inv.id,"word");
+  $("btnDlDel").onclick  = () => deleteInvoice(inv.id);
+  renderList();
+}
+
+function toInputDate(d) {
+  // dd/mm/yyyy → yyyy-mm-dd
+  if (!d) return "";
+  const p = d.split("/");
+  if (p.length===3) return `${p[2]}-${p[1]}-${p[0]}`;
+  return d;
+}
+function fromInputDate(d) {
+  if (!d) return "";
+  const p = d.split("-");
+  if (p.length===3) return `${p[2]}/${p[1]}/${p[0]}`;
+  return d;
+}
+
+function collectForm() {
+  return {
+    number:          $("fNumber").value.trim() || `INV-${Date.now().toString().slice(-6)}`,
+    date:            fromInputDate($("fDate").value),
+    due_date:        fromInputDate($("fDueDate").value),
+    status:          $("fStatus").value,
+    issuer_name:     $("fIssuerName").value.trim(),
+    issuer_email:    $("fIssuerEmail").value.trim(),
+    issuer_phone:    $("fIssuerPhone").value.trim(),
+    issuer_address:  $("fIssuerAddress").value.trim(),
+    client_name:     $("fClientName").value.trim(),
+    client_company:  $("fClientCompany").value.trim(),
+    client_nit:      $("fClientNit").value.trim(),
+    client_email:    $("fClientEmail").value.trim(),
+    items:           items.map(it=>({ description:it.desc, qty:it.qty, unit_value:it.uv })),
+    tax:             parseFloat($("fTax").value)||0,
+    notes:           $("fNotes").value.trim()
+  };
+}
+
+$("btnNew").onclick = () => {
+  selectedId = null;
+  clearForm();
+};
+
+function clearForm() {
+  ["fIssuerName","fIssuerEmail","fIssuerPhone","fIssuerAddress",
+   "fClientName","fClientCompany","fClientNit","fClientEmail",
+   "fNumber","fNotes"].forEach(id => $(id).value="");
+  $("fStatus").value = "pendiente";
+  $("fDate").value   = new Date().toISOString().split("T")[0];
+  $("fDueDate").value= "";
+  $("fTax").value    = 0;
+  items = [{ desc:"", qty:1, uv:0 }];
+  renderItems();
+  $("formTitle").innerHTML = `<i class="fa fa-file-invoice" style="color:#2dd4a0"></i> Nueva Factura`;
+  $("dlSection").style.display="none";
+  $("fNumber").value = `INV-${new Date().getFullYear()}-${String(invoices.length+1).padStart(3,"0")}`;
+  renderList();
+}
+
+$("btnCancelForm").onclick = clearForm;
+
+$("btnSave").onclick = async () => {
+  const data = collectForm();
+  if (!data.client_name && !data.issuer_name) {
+    toast("Completa al menos el nombre del emisor y cliente","#ff4d6a"); return;
+  }
+  try {
+    let res;
+    if (selectedId) {
+      res = await fetch(`${API}/invoices/${selectedId}`, {
+        method:"PUT",
+        headers:{...AUTH,"Content-Type":"application/json"},
+        body:JSON.stringify(data)
+      });
+    } else {
+      res = await fetch(`${API}/invoices`, {
+        method:"POST",
+        headers:{...AUTH,"Content-Type":"application/json"},
+        body:JSON.stringify(data)
+      });
+    }
+    if (!res.ok) throw new Error();
+    const inv = await res.json();
+    selectedId = inv.id;
+    await loadInvoices();
+    selectInvoice(inv);
+    toast(selectedId?"Factura actualizada ✓":"Factura guardada ✓");
+  } catch(e) { toast("Error al guardar","#ff4d6a"); }
+};
+
+async function download(id, fmt) {
+  const res = await fetch(`${API}/invoices/${id}/download/${fmt}`, { headers: AUTH });
+  if (!res.ok) { toast("Error al descargar","#ff4d6a"); return; }
+  const blob = await res.blob();
+  const url  = URL.createObjectURL(blob);
+  const a    = document.createElement("a");
+  a.href=url; a.download=`Factura_${id.slice(0,8)}.${fmt==="word"?"docx":"pdf"}`;
+  a.click();
+  setTimeout(()=>URL.revokeObjectURL(url),100);
+}
+
+$("btnExport").onclick = async () => {
+  toast("Preparando ZIP...","#3d7fff");
+  const res = await fetch(`/api/export/personal?fmt=pdf`, { headers: AUTH });
+  if (!res.ok) { toast("No hay facturas para exportar","#ff4d6a"); return; }
+  const blob = await res.blob();
+  const url  = URL.createObjectURL(blob);
+  const a    = document.createElement("a");
+  a.href=url; a.download=`Facturas_personales.zip`;
+  a.click();
+  setTimeout(()=>URL.revokeObjectURL(url),100);
+};
+
+async function deleteInvoice(id) {
+  if (!confirm("¿Eliminar esta factura?")) return;
+  await fetch(`${API}/invoices/${id}`, { method:"DELETE", headers:AUTH });
+  selectedId=null;
+  await loadInvoices();
+  clearForm();
+  toast("Factura eliminada");
+}
+
+// Init
+clearForm();
+loadInvoices();
@@ -0,0 +1,252 @@
+const token = localStorage.getItem("token");
+const user  = JSON.parse(localStorage.getItem("user") || "null");
+if (!token || !user) { window.location.href = "/"; }
+document.getElementById("navUser").textContent = user.name || user.username;
+const AUTH = { Authorization: `Bearer ${token}` };
+const API  = "/api/tasks";
+const $    = id => document.getElementById(id);
+
+let allTasks = [];
+let editId   = null;
+let activeFilter = "";
+
+function toast(msg, color="#a78bfa") {
+  const d=document.createElement("div"); d.className="toast"; d.style.borderColor=color;
+  d.innerHTML=`<i class="fa fa-circle-check" style="color:${color}"></i> ${msg}`;
+  document.body.appendChild(d); setTimeout(()=>d.remove(),2800);
+}
+
+function isOverdue(due) {
+  if (!due) return false;
+  return new Date(due) < new Date(new Date().toDateString());
+}
+function isToday(due) {
+  if (!due) return false;
+  return due === new Date().toISOString().split("T")[0];
+}
+function fmtDate(d) {
+  if (!d) return "";
+  const p=d.split("-"); return `${p[2]}/${p[1]}/${p[0]}`;
+}
+
+// Recordatorios: el servidor los envía por SSE cuando cambian; si el canal
+// no está disponible se vuelve a consultar /reminders cada 5 min.
+let stream=null, pollTimer=null, streamRetries=0;
+async function loadReminders() {
+  const res=await fetch(`${API}/reminders`,{headers:AUTH});
+  if (!res.ok) return;
+  const {reminders}=await res.json();
+  renderReminders(reminders);
+}
+
+function startPolling() {
+  if (pollTimer) return;
+  loadReminders(); pollTimer=setInterval(loadReminders, 300000);
+}
+
+async function openReminderStream() {
+  if (!window.EventSource) return startPolling();
+  // El token de sesión no va en la URL: se canjea por un vale de un solo uso
+  const res=await fetch(`${API}/stream-ticket`,{method:"POST",headers:AUTH}).catch(()=>null);
+  if (!res || !res.ok) return startPolling();
+  const {ticket}=await res.json();
+  stream=new EventSource(`${API}/stream?ticket=${encodeURIComponent(ticket)}`);
+  stream.addEventListener("reminders",e=>{ streamRetries=0; renderReminders(JSON.parse(e.data).reminders); });
+  stream.addEventListener("logout",()=>{ stream.close(); window.location.href="/"; });
+  stream.onerror=()=>{
+    // El navegador reintentaría con el vale ya gastado: se cierra y se pide otro.
+    // Tras varios fallos seguidos (401/503, servidor caído…) se vuelve al sondeo.
+    stream.close(); stream=null;
+    if (++streamRetries<=3) setTimeout(openReminderStream, 5000*streamRetries);
+    else startPolling();
+  };
+}
+
+function renderReminders(reminders) {
+  const bar=$("remindersBar"); bar.innerHTML="";
+  reminders.slice(0,5).forEach(r=>{
+    const cls=`ra-${r.alert_type}`;
+    const icon=r.alert_type==="vencida"?"fa-circle-xmark":r.alert_type==="hoy"?"fa-bell":"fa-bell-slash";
+    const msg=r.alert_type==="vencida"?`Vencida el ${fmtDate(r.due_date)}`:
+              r.alert_type==="hoy"?"Vence hoy":"Vence mañana";
+    const div=document.createElement("div");
+    div.className=`reminder-alert ${cls}`;
+    div.innerHTML=`<i class="fa ${icon}"></i><strong>${r.title}</strong><span style="margin-left:4px;opacity:.8">· ${msg}</span>`;
+    bar.appendChild(div);
+  });
+}
+
+let nextCursor = null;
+async function loadTasks(more=false) {
+  const params=new URLSearchParams();
+  if (activeFilter) params.set("status",activeFilter);
+  if (more && nextCursor) params.set("cursor",nextCursor);
+  const res=await fetch(`${API}?${params}`,{headers:AUTH});
+  if (res.status===401){window.location.href="/";return;}
+  const {tasks,next_cursor,stats}=await res.json();
+  allTasks=more?allTasks.concat(tasks):tasks;
+  nextCursor=next_cursor;
+  renderStats(stats);
+  renderTasks(allTasks);
+  if (!more && !stream) await loadReminders();
+}
+
+function renderStats(stats) {
+  $("stTotal").textContent   = stats.total;
+  $("stPending").textContent = stats.pendiente;
+  $("stDone").textContent    = stats.completada;
+  $("stOverdue").textContent = stats.vencidas;
+}
+
+function renderTasks(tasks) {
+  const grid=$("tasksGrid"); grid.innerHTML="";
+  if (!tasks.length) {
+    grid.innerHTML=`<div class="empty-state">
+      <div class="icon">✅</div>
+      <p>${activeFilter==="completada"?"No tienes tareas completadas":"No tienes tareas. ¡Crea una!"}</p>
+    </div>`; return;
+  }
+  const catIcons={general:"📌",trabajo:"💼",personal:"👤",urgente:"🚨",facturacion:"🧾",medico:"🩺"};
+  tasks.forEach((t,i)=>{
+    const over=isOverdue(t.due_date)&&t.status!=="completada";
+    const today=isToday(t.due_date)&&t.status!=="completada";
+    const pbCls=t.priority==="alta"?"pb-alta":t.priority==="baja"?"pb-baja":"pb-normal";
+    const card=document.createElement("div");
+    card.className=`task-card${t.status==="completada"?" done":""}`;
+    card.style.animationDelay=(i*.04)+"s";
+    let dueBadge="";
+    if (t.due_date) {
+      const cls=over?"tb-over":today?"tb-today":"tb-due";
+      const label=over?`Vencida ${fmtDate(t.due_date)}`:today?"Vence hoy":`${fmtDate(t.due_date)}`;
+      dueBadge=`<span class="task-badge ${cls}"><i class="fa fa-calendar-day"></i> ${label}</span>`;
+    }
+    card.innerHTML=`
+      <div class="task-priority-bar ${pbCls}"></div>
+      <div class="task-header">
+        <div class="task-title">${t.title}</div>
+        <div class="task-check${t.status==="completada"?" checked":""}" data-id="${t.id}">
+          ${t.status==="completada"?'<i class="fa fa-check" style="color:#fff;font-size:11px"></i>':""}
+        </div>
+      </div>
+      ${t.description?`<div class="task-desc">${t.description}</div>`:""}
+      <div class="task-meta">
+        <span class="task-badge tb-cat">${catIcons[t.category]||"📌"} ${t.category}</span>
+        ${dueBadge}
+      </div>
+      <div class="task-actions">
+        <label class="ta-sel"><input type="checkbox" data-id="${t.id}"${selected.has(t.id)?" checked":""}> Seleccionar</label>
+        <button class="ta-btn ta-edit" data-id="${t.id}"><i class="fa fa-pen"></i> Editar</button>
+        <button class="ta-btn ta-del"  data-id="${t.id}"><i class="fa fa-trash"></i></button>
+      </div>
+    `;
+    grid.appendChild(card);
+  });
+
+  // Events
+  grid.querySelectorAll(".task-check").forEach(el=>{
+    el.onclick=()=>toggleComplete(el.dataset.id);
+  });
+  grid.querySelectorAll(".ta-edit").forEach(el=>{
+    el.onclick=()=>openEdit(el.dataset.id);
+  });
+  grid.querySelectorAll(".ta-del").forEach(el=>{
+    el.onclick=()=>deleteTask(el.dataset.id);
+  });
+  grid.querySelectorAll(".ta-sel input").forEach(el=>{
+    el.onchange=()=>{ el.checked?selected.add(el.dataset.id):selected.delete(el.dataset.id); renderBulk(); };
+  });
+  if (nextCursor) {
+    const more=document.createElement("button");
+    more.className="ta-btn ta-edit"; more.style.cssText="grid-column:1/-1;justify-self:center;padding:10px 22px";
+    more.innerHTML=`<i class="fa fa-angles-down"></i> Cargar más`;
+    more.onclick=()=>loadTasks(true);
+    grid.appendChild(more);
+  }
+}
+
+async function toggleComplete(id) {
+  const res=await fetch(`${API}/${id}/complete`,{method:"POST",headers:AUTH});
+  const data=await res.json();
+  await loadTasks();
+  toast(data.status==="completada"?"Tarea completada ✓":"Tarea reabierta","#2dd4a0");
+}
+
+async function deleteTask(id) {
+  if (!confirm("¿Eliminar esta tarea?")) return;
+  await fetch(`${API}/${id}`,{method:"DELETE",headers:AUTH});
+  await loadTasks();
+  toast("Tarea eliminada","#ff4d6a");
+}
+
+// Selección múltiple → un solo POST /api/tasks/batch
+const selected = new Set();
+function renderBulk() {
+  $("bulkCount").textContent=`${selected.size} seleccionada${selected.size===1?"":"s"}`;
+  $("bulkBar").classList.toggle("show", selected.size>0);
+}
+async function bulk(action) {
+  if (action==="none") { selected.clear(); renderBulk(); renderTasks(allTasks); return; }
+  if (action==="delete" && !confirm(`¿Eliminar ${selected.size} tareas?`)) return;
+  const ops=[...selected].map(id=>action==="delete"?{op:"delete",id}:{op:"complete",id,done:action==="complete"});
+  const res=await fetch(`${API}/batch`,{method:"POST",headers:{...AUTH,"Content-Type":"application/json"},body:JSON.stringify({ops})});
+  if (!res.ok) { toast("Error al aplicar los cambios","#ff4d6a"); return; }
+  const {applied}=await res.json();
+  selected.clear(); renderBulk();
+  await loadTasks();
+  toast(action==="delete"?`${applied} tareas eliminadas`:action==="complete"?`${applied} tareas completadas ✓`:`${applied} tareas reabiertas`,
+        action==="delete"?"#ff4d6a":"#2dd4a0");
+}
+document.querySelectorAll("[data-bulk]").forEach(b=>b.onclick=()=>bulk(b.dataset.bulk));
+
+function openEdit(id) {
+  const t=allTasks.find(x=>x.id===id); if(!t) return;
+  editId=id;
+  $("modalTitle").innerHTML=`<i class="fa fa-pen" style="color:#a78bfa"></i> Editar Tarea`;
+  $("mTitle").value    =t.title||"";
+  $("mDesc").value     =t.description||"";
+  $("mDue").value      =t.due_date||"";
+  $("mReminder").value =t.reminder||"";
+  $("mPriority").value =t.priority||"normal";
+  $("mCategory").value =t.category||"general";
+  $("overlay").classList.add("show");
+}
+
+$("btnNew").onclick=()=>{
+  editId=null;
+  $("modalTitle").innerHTML=`<i class="fa fa-plus-circle" style="color:#a78bfa"></i> Nueva Tarea`;
+  $("mTitle").value=""; $("mDesc").value=""; $("mDue").value="";
+  $("mReminder").value=""; $("mPriority").value="normal"; $("mCategory").value="general";
+  $("overlay").classList.add("show");
+};
+$("btnCancel").onclick=()=>$("overlay").classList.remove("show");
+$("overlay").onclick=e=>{ if(e.target===$("overlay")) $("overlay").classList.remove("show"); };
+
+$("btnSave").onclick=async()=>{
+  const title=$("mTitle").value.trim();
+  if (!title) { toast("El título es requerido","#ff4d6a"); return; }
+  const body={
+    title, description:$("mDesc").value.trim(),
+    due_date:$("mDue").value, reminder:$("mReminder").value,
+    priority:$("mPriority").value, category:$("mCategory").value
+  };
+  const url=editId?`${API}/${editId}`:API;
+  const method=editId?"PUT":"POST";
+  const res=await fetch(url,{method,headers:{...AUTH,"Content-Type":"application/json"},body:JSON.stringify(body)});
+  if (!res.ok) { toast("Error al guardar","#ff4d6a"); return; }
+  $("overlay").classList.remove("show");
+  await loadTasks();
+  toast(editId?"Tarea actualizada ✓":"Tarea creada ✓");
+};
+
+// Filtros
+document.querySelectorAll(".filter-btn").forEach(btn=>{
+  btn.onclick=()=>{
+    document.querySelectorAll(".filter-btn").forEach(b=>b.classList.remove("active"));
+    btn.classList.add("active");
+    activeFilter=btn.dataset.f;
+    loadTasks();
+  };
+});
+
+loadTasks();
+openReminderStream();